@@ -0,0 +1,265 @@
+import os
+import re
+import json
+import zlib
+import gzip
+import uuid
+import shutil
+import datetime as dt
+from glob import glob
+from os.path import join
+from tempfile import SpooledTemporaryFile
+from threading import Lock
+from typing import BinaryIO, Iterator
+from urllib.parse import unquote
+from requests import Response
+from download import Spool, build_response
+from io_utils import make_dir_if_not_exists_and_check_is_dir, is_http_success, write_atomic
+from constants import SOS_SERVER
+
+ARCHIVE_DIR = 'data/archive'
+# Segments are closed and a new one started once they reach this size
+SEGMENT_BYTES: int = 1024 ** 3
+READ_SIZE: int = 64 * 1024
+# Compressed bytes of a streamed record kept in memory before spilling to disk
+MEMBER_SPOOL_BYTES: int = 1024 ** 2
+# Headers that describe the encoding on the wire rather than the decoded body that is archived
+DROPPED_HEADERS = ['content-encoding', 'transfer-encoding', 'content-length']
+# Ends the block of every WARC record
+RECORD_END = b'\r\n\r\n'
+
+# Archived pages by kind, matched against the url of the response
+URL_PATTERNS: dict[str, str] = {
+    'meeting': r'/OpenMeetingsPublic/ViewMeetingDetailByID\?MeetingID=(\d+)',
+    'body_om': r'/OpenMeetingsPublic/OpenMeetingDashboard\?.*EntityID=(\d+)',
+    'body_gd': r'/OpenMeetingsPublic/GovDirectory\?.*EntityID=(\d+)',
+    'body_bm': r'/OpenMeetingsPublic/BoardMembers\?.*EntityID=(\d+)',
+    'document': r'/Common/DownloadMeetingFiles\?FilePath=(.*)'}
+
+def classify(url: str) -> tuple[str, str] | None:
+    """
+    Finds what an archived url was fetched for.
+
+    :return: (kind, key), where key is the meeting or body id or the document path; None for other urls
+    """
+    for kind, pattern in URL_PATTERNS.items():
+        match = re.search(pattern, url)
+        if match:
+            return kind, unquote(match.group(1))
+    return None
+
+def get_request_url(response: Response) -> str:
+    """
+    :return: the url a response was requested by, before any redirects; a response built outside requests only has its own url
+    """
+    first = response.history[0] if response.history else response
+    return first.request.url if first.request is not None and first.request.url else response.url
+
+def build_record_head(response: Response, length: int) -> bytes:
+    """
+    Builds the WARC and HTTP headers of a record for a response whose decoded body is length bytes. The record is the head, then the body, then RECORD_END.
+    """
+    headers = ''.join(f'{k}: {v}\r\n' for k, v in response.headers.items() if k.lower() not in DROPPED_HEADERS)
+    http = f'HTTP/1.1 {response.status_code} {response.reason or ""}\r\n{headers}Content-Length: {length}\r\n\r\n'.encode('utf-8')
+    warc = ''.join([
+        'WARC/1.0\r\n',
+        'WARC-Type: response\r\n',
+        f'WARC-Record-ID: <urn:uuid:{uuid.uuid4()}>\r\n',
+        f'WARC-Date: {dt.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")}\r\n',
+        f'WARC-Target-URI: {response.url}\r\n',
+        'Content-Type: application/http; msgtype=response\r\n',
+        f'Content-Length: {len(http) + length}\r\n',
+        '\r\n'])
+    return warc.encode('utf-8') + http
+
+def build_record(response: Response) -> bytes:
+    """
+    Builds a WARC/1.0 response record holding the status line, headers and decoded body of a response.
+    """
+    return build_record_head(response, len(response.content)) + response.content + RECORD_END
+
+def parse_headers(lines: list[bytes]) -> dict[str, str]:
+    headers: dict[str, str] = {}
+    for line in lines:
+        name, _, value = line.decode('utf-8').partition(':')
+        headers[name.strip()] = value.strip()
+    return headers
+
+def parse_record(record: bytes) -> Response:
+    """
+    Rebuilds the response archived in a record.
+    """
+    warc_head, _, rest = record.partition(b'\r\n\r\n')
+    warc = parse_headers(warc_head.split(b'\r\n')[1:])
+    http = rest[:int(warc['Content-Length'])]
+    http_head, _, content = http.partition(b'\r\n\r\n')
+    lines = http_head.split(b'\r\n')
+    status = int(lines[0].split(b' ')[1])
+    headers = parse_headers(lines[1:])
+    headers.pop('Content-Length', None)
+    return build_response(warc['WARC-Target-URI'], status, headers, content)
+
+def read_member(f: BinaryIO, limit: int | None = None) -> bytes | None:
+    """
+    Reads the gzip member starting at the current position of f and leaves f at the start of the next one.
+
+    :param limit: if given, only the first limit bytes of the member are kept, e.g. to read its headers
+    :return: the decompressed member; None at the end of the file or if the member was cut short
+    """
+    d = zlib.decompressobj(wbits=31)
+    parts: list[bytes] = []
+    kept = 0
+    while not d.eof:
+        chunk = f.read(READ_SIZE)
+        if not chunk:
+            # a run interrupted mid-write leaves a partial record at the end of its segment
+            return None
+        part = d.decompress(chunk)
+        if limit is None or kept < limit:
+            parts.append(part)
+            kept += len(part)
+    f.seek(-len(d.unused_data), os.SEEK_CUR)
+    member = b''.join(parts)
+    return member if limit is None else member[:limit]
+
+def read_segment(filename: str) -> Iterator[tuple[int, Response]]:
+    """
+    Reads every record of a segment.
+
+    :return: (offset, response) of each record
+    """
+    with open(filename, 'rb') as f:
+        while True:
+            offset = f.tell()
+            record = read_member(f)
+            if record is None:
+                return
+            yield offset, parse_record(record)
+
+def read_record_at(filename: str, offset: int) -> Response:
+    with open(filename, 'rb') as f:
+        f.seek(offset)
+        record = read_member(f)
+    if record is None:
+        raise RuntimeError(f'Could not read record at {offset} in {filename}.')
+    return parse_record(record)
+
+def get_segments(dir: str = ARCHIVE_DIR) -> list[str]:
+    """
+    Lists the segments of an archive, oldest first.
+    """
+    return sorted(glob(join(dir, '*.warc.gz')))
+
+def get_index_filename(segment: str) -> str:
+    return segment.removesuffix('.warc.gz') + '.idx'
+
+def build_index_entry(kind_and_key: tuple[str, str], offset: int) -> str:
+    kind, key = kind_and_key
+    return json.dumps({'kind': kind, 'key': key, 'offset': offset}) + '\n'
+
+def index_segment(segment: str) -> list[tuple[str, str, int]]:
+    """
+    Builds the index of a segment written without one, from the WARC headers of its records, and saves it beside the segment. Each record is still decompressed to find where the next starts, but only its headers are kept.
+    """
+    entries: list[tuple[str, str, int]] = []
+    with open(segment, 'rb') as f:
+        while True:
+            offset = f.tell()
+            head = read_member(f, limit=READ_SIZE)
+            if head is None:
+                break
+            warc = parse_headers(head.partition(b'\r\n\r\n')[0].split(b'\r\n')[1:])
+            kind_and_key = classify(warc.get('WARC-Target-URI', ''))
+            if kind_and_key:
+                entries.append((*kind_and_key, offset))
+    write_atomic(get_index_filename(segment), ''.join(build_index_entry((kind, key), offset) for kind, key, offset in entries).encode('utf-8'))
+    return entries
+
+def read_index(segment: str) -> list[tuple[str, str, int]]:
+    """
+    Reads the (kind, key, offset) of every classified record in a segment from the index saved beside it, building the index if there is none.
+    """
+    filename = get_index_filename(segment)
+    if not os.path.exists(filename):
+        return index_segment(segment)
+    entries: list[tuple[str, str, int]] = []
+    with open(filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            # a run interrupted mid-write can leave a partial last line
+            if line.endswith('\n'):
+                entry = json.loads(line)
+                entries.append((entry['kind'], entry['key'], entry['offset']))
+    return entries
+
+class ResponseArchive:
+    """
+    Append-only archive of every successful response from the SOS site, stored as gzipped WARC records. Each record is its own gzip member, so segments can be appended to without rewriting and read back one record at a time. Beside each segment, an index records the kind, key and offset of each record, so the archive can be indexed without decompressing it. Records are compressed before the lock is taken; only appending them is serialized. Safe to share between threads.
+    """
+    def __init__(self, dir: str = ARCHIVE_DIR, segment_bytes: int = SEGMENT_BYTES):
+        make_dir_if_not_exists_and_check_is_dir(dir)
+        self.dir: str = dir
+        self.segment_bytes: int = segment_bytes
+        self.count: int = 0
+        self._lock = Lock()
+        self._prefix: str = dt.datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+        self._segment: int = 0
+        self._open()
+
+    def _open(self):
+        segment = join(self.dir, f'{self._prefix}-{self._segment:05}.warc.gz')
+        self._file: BinaryIO = open(segment, 'ab')
+        self._index = open(get_index_filename(segment), 'a', encoding='utf-8')
+
+    def _append(self, member: bytes | BinaryIO, size: int, kind_and_key: tuple[str, str] | None):
+        with self._lock:
+            if self._file.tell() > 0 and self._file.tell() + size > self.segment_bytes:
+                self._file.close()
+                self._index.close()
+                self._segment += 1
+                self._open()
+            offset = self._file.tell()
+            if isinstance(member, bytes):
+                self._file.write(member)
+            else:
+                shutil.copyfileobj(member, self._file, READ_SIZE)
+            # the record is written out before the index points at it
+            self._file.flush()
+            if kind_and_key:
+                self._index.write(build_index_entry(kind_and_key, offset))
+                self._index.flush()
+            self.count += 1
+
+    def write(self, response: Response):
+        if not response.url.startswith(SOS_SERVER) or not is_http_success(response):
+            return
+        member = gzip.compress(build_record(response))
+        self._append(member, len(member), classify(get_request_url(response)))
+
+    def write_spool(self, spool: Spool):
+        """
+        Archives a streamed response from its spool, compressing it a chunk at a time rather than building the record in memory.
+        """
+        if not spool.url.startswith(SOS_SERVER) or not is_http_success(spool):
+            return
+        compressor = zlib.compressobj(wbits=31)
+        with SpooledTemporaryFile(max_size=MEMBER_SPOOL_BYTES) as member:
+            member.write(compressor.compress(build_record_head(spool.response, spool.size)))
+            for chunk in spool.chunks():
+                member.write(compressor.compress(chunk))
+            member.write(compressor.compress(RECORD_END) + compressor.flush())
+            size = member.tell()
+            member.seek(0)
+            self._append(member, size, classify(get_request_url(spool.response))) # type: ignore
+
+    def hook(self, response: Response, *args, **kwargs) -> Response:
+        """
+        Archives a response; for use as a requests response hook. Streamed responses are skipped, since reading their body here would load it into memory; they are archived from their spool by write_spool.
+        """
+        if not kwargs.get('stream'):
+            self.write(response)
+        return response
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+            self._index.close()
@@ -0,0 +1,344 @@
+import sys
+import json
+import os
+import platform
+import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import perf_counter
+from typing import Callable, Iterable, Any
+from pymongo import MongoClient
+from pymongo.database import Database
+from requests import Response
+from resource_type import DocType, ResourceType
+from download import download_meeting, download_body, download_document
+from parse import RawMeeting, RawDocument, parse_meeting, parse_body, parse_tika_html, extract_text, get_stamp, get_hash
+from validate import Meeting, Document, validate_meeting, get_document_paths
+from store import store_meeting
+from index import get_meeting_as_indexable
+from io_utils import make_dir_if_not_exists_and_check_is_dir
+from session import get_session
+from rate_limit import configure_rate_controller
+from stand_in import StandInServer, redirect_session, FIXTURES_DIR
+
+BENCHMARK_DATABASE = 'scrape_benchmark'
+WORKER_COUNTS: list[int] = [1, 4, 16, 64]
+MEETING_COUNT: int = 2000
+DOCUMENTS_PER_MEETING: int = 2
+SNIPPETS_PER_DOCUMENT: int = 50
+
+# Pipeline benchmark defaults
+PIPELINE_MEETING_COUNT: int = 500
+BODY_COUNT: int = 50
+PIPELINE_WORKERS: int = 16
+# Seconds between retries; short so injected errors measure retry cost, not the production wait
+BENCHMARK_TRY_WAIT: float = 0.05
+# Requests per second allowed to the stand-in, high enough not to limit throughput unless it throttles
+BENCHMARK_RATE: int = 100000
+BENCHMARKS_DIR = 'data/benchmarks'
+# A stage is reported as regressed when its throughput falls by more than this fraction
+REGRESSION_TOLERANCE: float = 0.1
+
+def make_meeting(documents: int = DOCUMENTS_PER_MEETING, snippets: int = SNIPPETS_PER_DOCUMENT) -> Meeting:
+    """
+    Makes a synthetic meeting with the given number of agendas and snippets per agenda.
+    """
+    agendas = [Document(stamp=0.0,
+                        name=None,
+                        doctype=DocType.AGENDA,
+                        dt=0.0,
+                        filer='Benchmark',
+                        path=f'/Notices/0/{i}.pdf',
+                        snippets=[f'Snippet {j} of benchmark agenda {i}.' for j in range(snippets)])
+               for i in range(documents)]
+    return Meeting(stamp=0.0, body=1, meeting_dt=0.0, meeting_address='Benchmark', filing_dt=0.0,
+                   agendas=agendas, minutes=[], contact_name='Benchmark', contact_phone='', contact_email='',
+                   is_meeting_dt_changed=False, is_address_changed=False, is_annual_calendar_changed=False,
+                   is_emergency_changed=False, is_public_notice_changed=False, is_agenda_changed=False,
+                   is_emergency=False, is_annual_calendar=False, is_public_notice=False, is_cancelled=False,
+                   cancelled_dt=None, cancelled_reason=None)
+
+def time_threaded(action: Callable[[int], object], count: int, workers: int) -> float:
+    """
+    Runs action over range(count) on a thread pool and returns the elapsed seconds.
+    """
+    before = dt.datetime.utcnow().timestamp()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(action, range(count)))
+    return dt.datetime.utcnow().timestamp() - before
+
+def clear_benchmark_database(db: Database):
+    for rtype in ResourceType:
+        db[rtype.collection_name()].delete_many({})
+
+def benchmark_store(db: Database, worker_counts: list[int] = WORKER_COUNTS, count: int = MEETING_COUNT) -> dict[int, dict[str, float]]:
+    """
+    Measures store_meeting throughput with and without a global lock around every store, the way store.py serialized writes before.
+
+    :param db: a scratch database; it is cleared before each measurement
+    :param worker_counts: numbers of threads to measure
+    :param count: meetings stored per measurement
+    :return: meetings per second by worker count and mode ('locked' or 'unlocked')
+    """
+    meeting = make_meeting()
+    lock = Lock()
+
+    def store_locked(id: int):
+        with lock:
+            store_meeting(db, id, meeting)
+
+    def store_unlocked(id: int):
+        store_meeting(db, id, meeting)
+
+    results: dict[int, dict[str, float]] = {}
+    for workers in worker_counts:
+        results[workers] = {}
+        for mode, action in [('locked', store_locked), ('unlocked', store_unlocked)]:
+            clear_benchmark_database(db)
+            elapsed = time_threaded(action, count, workers)
+            results[workers][mode] = count / elapsed
+    clear_benchmark_database(db)
+    return results
+
+def format_store_results(results: dict[int, dict[str, float]]) -> str:
+    lines = ['workers\tlocked/s\tunlocked/s\tspeedup']
+    for workers, rates in results.items():
+        lines.append(f"{workers}\t{rates['locked']:.1f}\t\t{rates['unlocked']:.1f}\t\t{rates['unlocked']/rates['locked']:.2f}x")
+    return '\n'.join(lines)
+
+def percentile(ordered: list[float], q: float) -> float:
+    """
+    :param ordered: sorted values
+    :param q: the quantile, from 0 to 1
+    """
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, round(q * (len(ordered) - 1)))]
+
+def get_peak_rss_mb() -> float | None:
+    """
+    :return: the peak resident memory of this process, or None where it cannot be read, e.g. on Windows
+    """
+    try:
+        # Unix only
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def get_rss_mb() -> float | None:
+    """
+    :return: the resident memory of this process, or its peak where the current value cannot be read
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except (OSError, ValueError, AttributeError):
+        return get_peak_rss_mb()
+
+def measure(stage: str, action: Callable[[Any], Any], items: Iterable, workers: int) -> tuple[list, dict]:
+    """
+    Runs action over items on a thread pool, timing each call.
+
+    :return: (the results, with None for failures, and the stage's measurements)
+    """
+    items = list(items)
+    latencies: list[float] = []
+    errors = [0]
+    lock = Lock()
+
+    def timed(item) -> Any:
+        before = perf_counter()
+        result = None
+        try:
+            result = action(item)
+        except Exception:
+            with lock:
+                errors[0] += 1
+        latency = perf_counter() - before
+        with lock:
+            latencies.append(latency)
+        return result
+
+    rss_before = get_rss_mb()
+    before = perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(timed, items))
+    elapsed = perf_counter() - before
+    latencies.sort()
+    rss, peak_rss = get_rss_mb(), get_peak_rss_mb()
+    return results, {'stage': stage,
+                     'items': len(items),
+                     'errors': errors[0],
+                     'seconds': round(elapsed, 4),
+                     'items_per_sec': round(len(items) / elapsed, 2) if elapsed > 0 else 0.0,
+                     'p50_ms': round(percentile(latencies, 0.5) * 1000, 3),
+                     'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+                     # None where memory cannot be read
+                     'rss_mb': round(rss, 1) if rss is not None else None,
+                     'rss_delta_mb': round(rss - rss_before, 1) if rss is not None and rss_before is not None else None,
+                     'peak_rss_mb': round(peak_rss, 1) if peak_rss is not None else None}
+
+def extract_document(response: Response) -> RawDocument:
+    return RawDocument(stamp=get_stamp(response), snippets=parse_tika_html(extract_text(response.content).text), hash=get_hash(response))
+
+def benchmark_pipeline(
+        server: StandInServer,
+        db: Database | None,
+        count: int = PIPELINE_MEETING_COUNT,
+        bodies: int = BODY_COUNT,
+        workers: int = PIPELINE_WORKERS) -> list[dict]:
+    """
+    Measures each stage of downloading meetings, bodies and documents from a stand-in server and parsing, validating, storing and exporting them. Stages run one after another over every item, so each is timed alone.
+
+    :param server: a started stand-in; the shared session is redirected to it
+    :param db: a scratch database, cleared before and after, or None to skip the validate, store and export stages
+    :param count: meetings to process
+    :param bodies: bodies to process
+    :param workers: threads per stage
+    :return: the measurements of each stage
+    """
+    redirect_session(get_session(), server.url, workers)
+    configure_rate_controller(BENCHMARK_RATE, BENCHMARK_RATE)
+    stages: list[dict] = []
+
+    def run(stage: str, action: Callable[[Any], Any], items: Iterable) -> list:
+        results, measured = measure(stage, action, items, workers)
+        stages.append(measured)
+        return results
+
+    pages = run('download_meeting', lambda id: download_meeting(id, wait=BENCHMARK_TRY_WAIT), range(count))
+    body_pages = run('download_body', lambda id: download_body(id, wait=BENCHMARK_TRY_WAIT), range(bodies))
+    raws: list[RawMeeting | None] = run('parse_meeting', parse_meeting, [page for page in pages if page is not None])
+    run('parse_body', lambda download: parse_body(download['om'], download['gd'], download['bm']), [download for download in body_pages if download is not None])
+    raws = [raw for raw in raws if raw is not None]
+    paths = sorted({path for raw in raws for path in get_document_paths(raw)})
+    document_responses = run('download_document', lambda path: download_document(path, wait=BENCHMARK_TRY_WAIT), paths)
+    rawdocs = run('tika', extract_document, [response for response in document_responses if response is not None])
+    documents: dict[str, RawDocument] = {path: rawdoc for path, rawdoc in zip([path for path, response in zip(paths, document_responses) if response is not None], rawdocs) if rawdoc is not None}
+    if db is None:
+        return stages
+    clear_benchmark_database(db)
+    for i, name in enumerate({raw.body for raw in raws if raw.body}):
+        db[ResourceType.BODY.collection_name()].insert_one({'_id': i, 'name': name})
+    meetings: list[Meeting | None] = run('validate_meeting', lambda raw: validate_meeting(db, raw, documents.__getitem__), raws)
+    stored = [(id, meeting) for id, meeting in enumerate(meetings) if meeting is not None]
+    run('store_meeting', lambda stored: store_meeting(db, *stored), stored)
+    run('export_meeting', lambda id: get_meeting_as_indexable(db, id), [id for id, _ in stored])
+    clear_benchmark_database(db)
+    return stages
+
+def write_results(results: dict, dir: str = BENCHMARKS_DIR) -> str:
+    make_dir_if_not_exists_and_check_is_dir('data')
+    make_dir_if_not_exists_and_check_is_dir(dir)
+    filename = f"{dir}/pipeline_{dt.datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.json"
+    with open(filename, 'w') as f:
+        json.dump(results, f, indent=2)
+    return filename
+
+def format_pipeline_results(stages: list[dict]) -> str:
+    lines = ['stage\t\t\titems\terrors\titems/s\t\tp50 ms\t\tp99 ms\t\trss MB']
+    for stage in stages:
+        lines.append(f"{stage['stage']:<24}{stage['items']}\t{stage['errors']}\t{stage['items_per_sec']:<16}{stage['p50_ms']:<16}{stage['p99_ms']:<16}{stage['rss_mb']}")
+    return '\n'.join(lines)
+
+def compare_results(baseline: dict, current: dict, tolerance: float = REGRESSION_TOLERANCE) -> list[str]:
+    """
+    :return: a line for each stage whose throughput fell by more than tolerance from the baseline
+    """
+    before = {stage['stage']: stage for stage in baseline['stages']}
+    regressions: list[str] = []
+    for stage in current['stages']:
+        old = before.get(stage['stage'])
+        if old and old['items_per_sec'] > 0 and stage['items_per_sec'] < old['items_per_sec'] * (1 - tolerance):
+            regressions.append(f"{stage['stage']}: {old['items_per_sec']} -> {stage['items_per_sec']} items/s")
+    return regressions
+
+# pipeline options that take no value
+FLAGS = ['no-db']
+
+def parse_options(args: list[str]) -> tuple[list[str], dict[str, str]]:
+    positional: list[str] = []
+    options: dict[str, str] = {}
+    i = 0
+    while i < len(args):
+        if args[i][2:] in FLAGS:
+            options[args[i][2:]] = 'true'
+            i += 1
+        elif args[i].startswith('--') and i + 1 < len(args):
+            options[args[i][2:]] = args[i+1]
+            i += 2
+        else:
+            positional.append(args[i])
+            i += 1
+    return positional, options
+
+def print_help():
+    print('\nUsage:\n\tpython3 benchmark.py store [count: int]')
+    print('\tpython3 benchmark.py pipeline [count: int] [--bodies int] [--workers int] [--latency ms] [--error-rate float] [--tika-latency ms] [--fixtures dir] [--no-db]')
+    print('\tpython3 benchmark.py compare [baseline.json] [result.json]\n')
+
+def run_pipeline(args: list[str], options: dict[str, str]):
+    try:
+        count = int(args[2]) if len(args) >= 3 else PIPELINE_MEETING_COUNT
+        bodies = int(options.get('bodies', BODY_COUNT))
+        workers = int(options.get('workers', PIPELINE_WORKERS))
+        latency = float(options.get('latency', 0)) / 1000
+        error_rate = float(options.get('error-rate', 0))
+        tika_latency = float(options.get('tika-latency', 0)) / 1000
+    except ValueError:
+        print('Error: counts and options must be parseable numbers.')
+        print_help()
+        exit(1)
+    db = None if 'no-db' in options else MongoClient()[BENCHMARK_DATABASE]
+    # the recorded pages and PDFs are in the tests directory of a source checkout unless --fixtures is given
+    with StandInServer(latency, error_rate, tika_latency, fixtures_dir=options.get('fixtures', FIXTURES_DIR)) as server:
+        stages = benchmark_pipeline(server, db, count, bodies, workers)
+        requests, errors = server.requests, server.errors
+    results = {'stamp': dt.datetime.utcnow().timestamp(),
+               'config': {'meetings': count, 'bodies': bodies, 'workers': workers, 'latency': latency, 'error_rate': error_rate, 'tika_latency': tika_latency},
+               'host': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()},
+               'server': {'requests': requests, 'errors': errors},
+               'stages': stages}
+    print(format_pipeline_results(stages))
+    print(f'Wrote {write_results(results)}.')
+
+def run_compare(args: list[str]):
+    if len(args) != 4:
+        print_help()
+        exit(1)
+    with open(args[2]) as f:
+        baseline = json.load(f)
+    with open(args[3]) as f:
+        current = json.load(f)
+    regressions = compare_results(baseline, current)
+    for regression in regressions:
+        print(regression)
+    if regressions:
+        exit(1)
+    print('No regressions.')
+
+def main(args):
+    args, options = parse_options(args)
+    match (args[1] if len(args) >= 2 else None):
+        case 'store':
+            count = MEETING_COUNT
+            if len(args) >= 3:
+                try:
+                    count = int(args[2])
+                except ValueError:
+                    print("Error: count must be a parseable integer.")
+                    print_help()
+                    exit(1)
+            db = MongoClient()[BENCHMARK_DATABASE]
+            print(format_store_results(benchmark_store(db, count=count)))
+        case 'pipeline':
+            run_pipeline(args, options)
+        case 'compare':
+            run_compare(args)
+        case _:
+            print_help()
+            exit(1)
+
+if __name__ == '__main__':
+    main(sys.argv)
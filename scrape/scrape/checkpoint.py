@@ -0,0 +1,94 @@
+import sqlite3
+import datetime as dt
+from os.path import join
+from threading import Lock
+from typing import Iterable
+from io_utils import make_dir_if_not_exists_and_check_is_dir
+
+CHECKPOINTS_DIR = 'data/checkpoints'
+# Outcomes held in memory before they are written out
+BUFFER_SIZE: int = 1000
+
+# Outcomes of processing an id
+SUCCESS = 'success'
+# already stored, or an empty page
+SKIPPED = 'skipped'
+# downloaded but failed validation
+INVALID = 'invalid'
+ERROR = 'error'
+# outcomes that a resumed run does not retry
+COMPLETED = [SUCCESS, SKIPPED, INVALID]
+
+def get_outcome(result) -> str:
+    """
+    Maps the result of run.py's process functions to an outcome: 0 (or any non-int result) is a success, -1 skipped and 1 invalid.
+    """
+    if result == -1:
+        return SKIPPED
+    if result == 1:
+        return INVALID
+    return SUCCESS
+
+class Checkpoint:
+    """
+    Durable log of the outcome of every id a run processes, in SQLite. A resumed run reads it to skip completed ids without querying MongoDB and to retry only failures. Outcomes are buffered and written in batches. Safe to share between threads.
+    """
+    def __init__(self, name: str, dir: str = CHECKPOINTS_DIR, buffer_size: int = BUFFER_SIZE):
+        """
+        :param name: names the log, one per command and resource, e.g. 'download_meeting'
+        """
+        make_dir_if_not_exists_and_check_is_dir(dir)
+        self.filename: str = join(dir, f'{name}.db')
+        self.buffer_size: int = buffer_size
+        self._buffer: list[tuple[int, str, int, str, float]] = []
+        self._lock = Lock()
+        self._conn = sqlite3.connect(self.filename, check_same_thread=False)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS outcomes (id INTEGER PRIMARY KEY, outcome TEXT NOT NULL, tries INTEGER NOT NULL, error TEXT, stamp REAL NOT NULL)')
+        self._conn.commit()
+
+    def record(self, id: int, outcome: str, error: str = '', tries: int | None = None):
+        """
+        :param tries: download tries made for the id in this run, e.g. from download.get_try_count
+        """
+        with self._lock:
+            self._buffer.append((id, outcome, tries or 0, error, dt.datetime.utcnow().timestamp()))
+            if len(self._buffer) >= self.buffer_size:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        # tries adds up the download tries of every run that processed the id
+        self._conn.executemany(
+            'INSERT INTO outcomes VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT(id) DO UPDATE SET outcome = excluded.outcome, tries = tries + excluded.tries, error = excluded.error, stamp = excluded.stamp',
+            self._buffer)
+        self._conn.commit()
+        self._buffer.clear()
+
+    def select(self, ids: Iterable[int]) -> list[int]:
+        """
+        Chooses which of ids a resumed run processes: those never processed and those that failed.
+        """
+        ids = list(ids)
+        if not ids:
+            return []
+        with self._lock:
+            self._flush()
+            rows = self._conn.execute(
+                f"SELECT id FROM outcomes WHERE id BETWEEN ? AND ? AND outcome IN ({','.join('?' * len(COMPLETED))})",
+                (min(ids), max(ids), *COMPLETED)).fetchall()
+        completed = {row[0] for row in rows}
+        return [id for id in ids if id not in completed]
+
+    def counts(self) -> dict[str, int]:
+        with self._lock:
+            self._flush()
+            return dict(self._conn.execute('SELECT outcome, COUNT(*) FROM outcomes GROUP BY outcome').fetchall())
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._conn.close()
@@ -8,4 +8,5 @@ def localhost_with_port(port: int) -> str:
 TIKA_SERVER: str = localhost_with_port(TIKA_PORT)
 TIKA_ENDPOINT: str = TIKA_SERVER + '/tika'
 MONGODB_SERVER: str = localhost_with_port(MONGODB_PORT)
-TYPESENSE_SERVER: str = localhost_with_port(TYPESENSE_PORT)
\ No newline at end of file
+TYPESENSE_SERVER: str = localhost_with_port(TYPESENSE_PORT)
+SOS_SERVER: str = 'https://opengov.sos.ri.gov'
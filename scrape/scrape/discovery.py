@@ -0,0 +1,85 @@
+from os.path import exists
+from threading import Lock
+from typing import Iterable
+from io_utils import write_atomic
+
+# Which meeting ids exist. Ids are marked live when a body dashboard lists them or they are stored, and empty when SOS returns a page without a meeting. Later runs skip empty ids, so only live and unchecked ids are downloaded.
+
+IDS_FILE = 'data/meeting_ids.bin'
+
+class IdBitmap:
+    """
+    A set of non-negative ids held as one bit per id. Grows to fit the largest id added.
+    """
+    def __init__(self, bits: bytes = b''):
+        self.bits: bytearray = bytearray(bits)
+
+    def add(self, id: int):
+        if id >> 3 >= len(self.bits):
+            self.bits.extend(bytes((id >> 3) + 1 - len(self.bits)))
+        self.bits[id >> 3] |= 1 << (id & 7)
+
+    def discard(self, id: int):
+        if id >> 3 < len(self.bits):
+            self.bits[id >> 3] &= ~(1 << (id & 7))
+
+    def __contains__(self, id: int) -> bool:
+        return id >> 3 < len(self.bits) and bool(self.bits[id >> 3] & (1 << (id & 7)))
+
+    def max(self) -> int:
+        """
+        :return: the largest id in the set, or -1 if it is empty
+        """
+        for i in range(len(self.bits) - 1, -1, -1):
+            if self.bits[i]:
+                return (i << 3) + self.bits[i].bit_length() - 1
+        return -1
+
+    def count(self) -> int:
+        return sum(bin(byte).count('1') for byte in self.bits)
+
+class MeetingIds:
+    """
+    Persisted live and empty meeting ids. Safe to share between threads.
+    """
+    def __init__(self, filename: str = IDS_FILE):
+        self.filename: str = filename
+        self.live = IdBitmap()
+        self.empty = IdBitmap()
+        self._lock = Lock()
+        if exists(filename):
+            with open(filename, 'rb') as f:
+                data = f.read()
+            # the live bitmap's length, then the live bitmap, then the empty bitmap
+            size = int.from_bytes(data[:8], 'big')
+            self.live = IdBitmap(data[8:8 + size])
+            self.empty = IdBitmap(data[8 + size:])
+
+    def mark_live(self, ids: Iterable[int]):
+        with self._lock:
+            for id in ids:
+                self.live.add(id)
+                self.empty.discard(id)
+
+    def mark_empty(self, id: int):
+        with self._lock:
+            if id not in self.live:
+                self.empty.add(id)
+
+    def select(self, ids: Iterable[int], discovered_only: bool = False) -> list[int]:
+        """
+        Chooses which of ids to download. Ids above the largest live id are always chosen, since new meetings are given new ids and an id that was empty may since have been filled.
+
+        :param ids: candidate ids
+        :param discovered_only: if true, choose only live ids below the frontier instead of every id not known to be empty
+        """
+        with self._lock:
+            frontier = self.live.max()
+            if discovered_only:
+                return [id for id in ids if id > frontier or id in self.live]
+            return [id for id in ids if id > frontier or id not in self.empty]
+
+    def save(self):
+        with self._lock:
+            data = len(self.live.bits).to_bytes(8, 'big') + bytes(self.live.bits) + bytes(self.empty.bits)
+        write_atomic(self.filename, data)
@@ -0,0 +1,186 @@
+import json
+import os
+import hashlib
+import sqlite3
+import datetime as dt
+from os.path import join, exists
+from threading import Lock
+from typing import Callable
+from download import Spool, download_document_spooled
+from parse import RawDocument, parse_document_spooled, get_stamp
+from parse_pool import ParsePool
+from io_utils import make_dir_if_not_exists_and_check_is_dir, write_atomic
+
+CACHE_DIR = 'data/cache'
+MAX_CACHE_BYTES: int = 10 * 1024 ** 3
+# Reads whose last_used times are held in memory before being written to the index together
+TOUCH_BATCH: int = 1000
+
+class DocumentCache:
+    """
+    On-disk cache of document PDFs and the snippets Tika extracted from them.
+
+    Blobs are content-addressed: a PDF and its snippets are stored once per sha256 hash, so identical PDFs filed under different paths are downloaded and extracted once. An index maps each SOS FilePath to the hash of its content, so a cached path skips the network entirely. When the blobs exceed max_bytes, the least recently used are evicted.
+    """
+    def __init__(self, dir: str = CACHE_DIR, max_bytes: int = MAX_CACHE_BYTES):
+        make_dir_if_not_exists_and_check_is_dir(dir)
+        self.dir: str = dir
+        self.max_bytes: int = max_bytes
+        self._lock = Lock()
+        self._conn = sqlite3.connect(join(dir, 'index.db'), check_same_thread=False)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS paths (path TEXT PRIMARY KEY, hash TEXT NOT NULL, stamp REAL NOT NULL)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, size INTEGER NOT NULL, last_used REAL NOT NULL)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS blobs_last_used ON blobs (last_used)')
+        self._conn.commit()
+        self.size: int = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+        # last_used times not yet written, by hash
+        self._touched: dict[str, float] = {}
+
+    def _blob_path(self, hash: str, extension: str) -> str:
+        return join(self.dir, hash[:2], f'{hash}.{extension}')
+
+    def _touch(self, hash: str):
+        # reads only record the time; it reaches the index with the next put, a full batch or close
+        with self._lock:
+            self._touched[hash] = dt.datetime.utcnow().timestamp()
+            if len(self._touched) >= TOUCH_BATCH:
+                self._flush_touched()
+                self._conn.commit()
+
+    def _flush_touched(self):
+        self._conn.executemany('UPDATE blobs SET last_used = ? WHERE hash = ?', [(used, hash) for hash, used in self._touched.items()])
+        self._touched.clear()
+
+    def get(self, path: str) -> RawDocument | None:
+        """
+        Gets the document last downloaded from path, without touching the network.
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT hash, stamp FROM paths WHERE path = ?', (path,)).fetchone()
+        if row is None:
+            return None
+        hash, stamp = row
+        snippets = self._read_snippets(hash)
+        if snippets is None:
+            return None
+        self._touch(hash)
+        return RawDocument(stamp=stamp, snippets=snippets, hash=hash)
+
+    def get_snippets(self, hash: str) -> list[str] | None:
+        """
+        Gets the snippets extracted from a PDF with the given content hash.
+        """
+        snippets = self._read_snippets(hash)
+        if snippets is not None:
+            self._touch(hash)
+        return snippets
+
+    def get_content(self, hash: str) -> bytes | None:
+        filename = self._blob_path(hash, 'pdf')
+        if not exists(filename):
+            return None
+        with open(filename, 'rb') as f:
+            return f.read()
+
+    def _read_snippets(self, hash: str) -> list[str] | None:
+        # a blob evicted while it is read counts as missing
+        try:
+            with open(self._blob_path(hash, 'json'), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def put(self, path: str, document: RawDocument, content: bytes | Spool):
+        """
+        Caches a document's PDF and snippets, and records that path currently has its content. A spooled PDF is copied a chunk at a time. The blobs are written before the lock is taken, so other workers only wait on the index.
+        """
+        if isinstance(content, Spool):
+            hash, length, chunks = document.hash or content.hash, content.size, content.chunks()
+        else:
+            hash, length, chunks = document.hash or hashlib.sha256(content).hexdigest(), len(content), content
+        with self._lock:
+            cached = self._conn.execute('SELECT 1 FROM blobs WHERE hash = ?', (hash,)).fetchone() is not None
+        size = 0
+        if not cached:
+            # blobs are content-addressed, so workers writing the same hash at once write the same bytes
+            os.makedirs(join(self.dir, hash[:2]), exist_ok=True)
+            write_atomic(self._blob_path(hash, 'pdf'), chunks)
+            snippets = json.dumps(document.snippets).encode('utf-8')
+            write_atomic(self._blob_path(hash, 'json'), snippets)
+            size = length + len(snippets)
+        with self._lock:
+            if size and self._conn.execute('INSERT OR IGNORE INTO blobs VALUES (?, ?, ?)', (hash, size, dt.datetime.utcnow().timestamp())).rowcount:
+                self.size += size
+            self._conn.execute('INSERT OR REPLACE INTO paths VALUES (?, ?, ?)', (path, hash, document.stamp))
+            # eviction goes by last use, so reads recorded since the last put are written first
+            self._flush_touched()
+            self._conn.commit()
+            self._evict(keep=hash)
+
+    def _evict(self, keep: str):
+        while self.size > self.max_bytes:
+            row = self._conn.execute('SELECT hash, size FROM blobs WHERE hash != ? ORDER BY last_used LIMIT 1', (keep,)).fetchone()
+            if row is None:
+                return
+            hash, size = row
+            for extension in ['pdf', 'json']:
+                if exists(self._blob_path(hash, extension)):
+                    os.remove(self._blob_path(hash, extension))
+            self._conn.execute('DELETE FROM blobs WHERE hash = ?', (hash,))
+            self._conn.execute('DELETE FROM paths WHERE hash = ?', (hash,))
+            self._conn.commit()
+            self.size -= size
+
+    def close(self):
+        with self._lock:
+            self._flush_touched()
+            self._conn.commit()
+            self._conn.close()
+
+def build_fetch_document(
+        cache: DocumentCache,
+        parse: Callable[[Spool], RawDocument] = parse_document_spooled,
+        reuse: Callable[[str, str], RawDocument | None] | None = None) -> Callable[[str], RawDocument]:
+    """
+    Constructs a document fetcher for validate_meeting that goes through the cache. A cached path skips both the network and Tika; a new path whose content is already cached skips Tika.
+
+    :param cache: the cache
+    :param parse: extracts a downloaded document that is not cached
+    :param reuse: if given, looks up a stored document by path and content hash, which is returned instead of extracting or caching it again
+    """
+    def fetch_document(path: str) -> RawDocument:
+        cached = cache.get(path)
+        if cached is not None:
+            return (reuse(path, cached.hash) if reuse and cached.hash else None) or cached
+        with download_document_spooled(path) as spool:
+            if reuse and (stored := reuse(path, spool.hash)) is not None:
+                return stored
+            snippets = cache.get_snippets(spool.hash)
+            if snippets is None:
+                document = parse(spool)
+            else:
+                document = RawDocument(stamp=get_stamp(spool), snippets=snippets, hash=spool.hash)
+            cache.put(path, document, spool)
+        return document
+    return fetch_document
+
+def build_fetch_document_for(
+        cache: DocumentCache | None,
+        pool: ParsePool | None,
+        reuse: Callable[[str, str], RawDocument | None] | None = None) -> Callable[[str], RawDocument]:
+    """
+    Constructs the document fetcher of downloads and refreshes, going through the cache and the parse pool when given.
+
+    :param reuse: if given, looks up a stored document by path and content hash, which is returned instead of extracting it again
+    """
+    # documents are streamed through a spool to Tika, so a large agenda packet is never held in memory whole
+    parse: Callable[[Spool], RawDocument] = pool.parse_document_spooled if pool else parse_document_spooled
+    if cache:
+        return build_fetch_document(cache, parse, reuse)
+    return lambda path: spool_and_parse(path, parse, reuse)
+
+def spool_and_parse(path: str, parse: Callable[[Spool], RawDocument], reuse: Callable[[str, str], RawDocument | None] | None = None) -> RawDocument:
+    with download_document_spooled(path) as spool:
+        if reuse and (stored := reuse(path, spool.hash)) is not None:
+            return stored
+        return parse(spool)
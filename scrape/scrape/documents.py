@@ -0,0 +1,94 @@
+from queue import Queue
+from threading import Thread, Lock
+from typing import Callable
+from bson import ObjectId
+from pymongo.database import Database
+from parse import RawDocument
+from validate import fetch_document
+from store import fill_pending_document
+from resource_type import ResourceType
+
+# Threads downloading and extracting documents. Each one holds a Tika request, so this bounds Tika load independently of the meeting workers.
+DOCUMENT_WORKERS: int = 16
+# Pending documents queued ahead of the workers; submit blocks when the queue is full
+QUEUE_SIZE: int = 4096
+
+docs = ResourceType.DOCUMENT.collection_name()
+
+def get_pending_documents(db: Database) -> list[tuple[ObjectId, str]]:
+    """
+    Finds documents left pending, e.g. by an interrupted run.
+
+    :return: (id, path) of each pending document
+    """
+    return [(document['_id'], document['path']) for document in db[docs].find({'pending': True}, {'path': 1})]
+
+class DocumentWorkers:
+    """
+    A pool of threads that downloads pending documents and fills them in. Meetings are stored with pending document references and their documents are submitted here, so meeting pages are not held up behind slow PDF downloads and Tika extractions.
+    """
+    def __init__(self,
+                 db: Database,
+                 get_document: Callable[[str], RawDocument] = fetch_document,
+                 workers: int = DOCUMENT_WORKERS,
+                 on_error: Callable[[ObjectId, str, Exception], None] | None = None,
+                 queue_size: int = QUEUE_SIZE):
+        """
+        :param db: the database holding the pending documents
+        :param get_document: downloads and extracts a document from its path
+        :param workers: number of threads
+        :param on_error: called with the document id, path and exception when a document fails; it stays pending
+        :param queue_size: maximum number of documents waiting for a worker
+        """
+        self.db: Database = db
+        self.get_document: Callable[[str], RawDocument] = get_document
+        self.on_error: Callable[[ObjectId, str, Exception], None] | None = on_error
+        self.filled: int = 0
+        self.failed: int = 0
+        self._queue: Queue = Queue(maxsize=queue_size)
+        self._lock = Lock()
+        self._threads: list[Thread] = [Thread(target=self._work, daemon=True) for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, id: ObjectId, path: str):
+        self._queue.put((id, path))
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            id, path = item
+            try:
+                filled = fill_pending_document(self.db, id, self.get_document(path))
+                with self._lock:
+                    self.filled += filled
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                if self.on_error:
+                    self.on_error(id, path, e)
+            self._queue.task_done()
+
+    def wait(self):
+        """
+        Waits for every document submitted so far to finish. Workers keep running.
+        """
+        self._queue.join()
+
+    def close(self):
+        """
+        Waits for every submitted document to finish.
+        """
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def __enter__(self) -> 'DocumentWorkers':
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -1,16 +1,58 @@
+import asyncio
+import hashlib
+from contextvars import ContextVar
+from tempfile import SpooledTemporaryFile
 from time import sleep
-from typing import Callable
-from requests import Response, get, post
+from typing import Callable, Awaitable, Mapping, Iterator
+from aiohttp import ClientSession
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
 from io_utils import is_http_success
+from session import get_session, get_spool_hooks
+from constants import SOS_SERVER
+from rate_limit import RateController, get_rate_controller, get_backoff, get_retry_after, is_throttled, is_network_error
+from metrics import get_registry, timed
 
 MAX_TRIES: int = 3
 TRY_WAIT: float = 10.0
+# Seconds to wait for the SOS site to respond
+REQUEST_TIMEOUT: float = 60.0
+# Bytes read from a streamed response at a time
+STREAM_CHUNK_BYTES: int = 64 * 1024
+# Bytes of a streamed document kept in memory before the rest is written to a temporary file
+SPOOL_BYTES: int = 1024 ** 2
+
+# Tries of every download by outcome, and the time spent waiting on the rate controller or backing off between them
+TRIES = {outcome: get_registry().counter('scrape_download_tries_total', 'Requests to the SOS site by outcome', outcome=outcome)
+         for outcome in ['success', 'throttled', 'failed', 'error']}
+WAIT_SECONDS = get_registry().histogram('scrape_download_wait_seconds', 'Time downloads spent paced by the rate controller or backing off')
+# Tries made by the downloads of the id being processed, held in a list so that tasks started for the id, which copy the context, add to the same count
+_try_count: ContextVar[list[int] | None] = ContextVar('try_count', default=None)
+
+def start_try_count():
+    """
+    Starts counting the tries of the downloads made from here on in the current thread or task, e.g. those of one id.
+    """
+    _try_count.set([0])
+
+def get_try_count() -> int | None:
+    """
+    :return: tries made since start_try_count, or None if it was not called
+    """
+    count = _try_count.get()
+    return count[0] if count is not None else None
+
+def add_tries(tries: int):
+    count = _try_count.get()
+    if count is not None:
+        count[0] += tries
 
 def url_to_file(url: str, method: str = 'get', filename: str | None = None):
     if method == 'get':
-        r = get(url)
+        r = get_session().get(url)
     elif method == 'post':
-        r = post(url)
+        r = get_session().post(url)
     else:
         raise ValueError("Method must be 'get' or 'post'.")
     
@@ -21,51 +63,229 @@ def url_to_file(url: str, method: str = 'get', filename: str | None = None):
         for chunk in r.iter_content(chunk_size=128):
             f.write(chunk)
 
+def fetch(url: str) -> Response:
+    return get_session().get(url, timeout=REQUEST_TIMEOUT)
+
+class Spool:
+    """
+    The body of a streamed response, kept in memory up to max_memory bytes and in a temporary file past that, with its sha256 hash taken as it arrives. It has the status, headers and url of its response, so it can stand in for one in is_http_success and get_stamp.
+
+    :param response: a response requested with stream=True; it is read to the end and closed
+    :param max_memory: bytes kept in memory before spilling to disk
+    """
+    def __init__(self, response: Response, max_memory: int = SPOOL_BYTES):
+        self.response: Response = response
+        self.file = SpooledTemporaryFile(max_size=max_memory)
+        h = hashlib.sha256()
+        self.size: int = 0
+        try:
+            for chunk in response.iter_content(STREAM_CHUNK_BYTES):
+                h.update(chunk)
+                self.file.write(chunk)
+                self.size += len(chunk)
+        except BaseException:
+            self.file.close()
+            raise
+        finally:
+            response.close()
+        # the same hash as get_hash of the unstreamed response
+        self.hash: str = h.hexdigest()
+
+    @property
+    def status_code(self) -> int:
+        return self.response.status_code
+
+    @property
+    def headers(self):
+        return self.response.headers
+
+    @property
+    def url(self) -> str:
+        return self.response.url
+
+    def chunks(self) -> Iterator[bytes]:
+        """
+        Reads the body from the start, a chunk at a time. Each call starts a new pass, so a failed upload can be replayed.
+        """
+        self.file.seek(0)
+        while chunk := self.file.read(STREAM_CHUNK_BYTES):
+            yield chunk
+
+    def read(self) -> bytes:
+        self.file.seek(0)
+        return self.file.read()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self) -> 'Spool':
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def fetch_spooled(url: str) -> Response | Spool:
+    """
+    Fetches a url without holding its body in memory. The body of a successful response is spooled inside the try, so a connection dropped partway through is retried by multitry like any other failure.
+
+    :return: the spool of a successful response, or the closed response of a failed one
+    """
+    response = get_session().get(url, timeout=REQUEST_TIMEOUT, stream=True)
+    if not is_http_success(response):
+        response.close()
+        return response
+    spool = Spool(response)
+    try:
+        for hook in get_spool_hooks():
+            hook(spool)
+    except BaseException:
+        spool.close()
+        raise
+    return spool
+
 # Generate URLs
 
-generate_meeting_url: Callable[[int], str] = lambda id : f'https://opengov.sos.ri.gov/OpenMeetingsPublic/ViewMeetingDetailByID?MeetingID={id}'
+generate_meeting_url: Callable[[int], str] = lambda id : f'{SOS_SERVER}/OpenMeetingsPublic/ViewMeetingDetailByID?MeetingID={id}'
 
 def generate_body_om_url(id: int) -> str:
-    return f'https://opengov.sos.ri.gov/OpenMeetingsPublic/OpenMeetingDashboard?subtopmenuId=201&EntityID={id}'
+    return f'{SOS_SERVER}/OpenMeetingsPublic/OpenMeetingDashboard?subtopmenuId=201&EntityID={id}'
 
 def generate_body_gd_url(id: int) -> str:
-    return f"https://opengov.sos.ri.gov/OpenMeetingsPublic/GovDirectory?subtopmenuID=202&EntityID={id}"
+    return f"{SOS_SERVER}/OpenMeetingsPublic/GovDirectory?subtopmenuID=202&EntityID={id}"
 
 def generate_body_bm_url(id: int) -> str:
-    return f"https://opengov.sos.ri.gov/OpenMeetingsPublic/BoardMembers?subtopmenuID=203&EntityID={id}"
+    return f"{SOS_SERVER}/OpenMeetingsPublic/BoardMembers?subtopmenuID=203&EntityID={id}"
 
 def generate_document_url(filename: str) -> str:
-    url: str = f"https://opengov.sos.ri.gov/Common/DownloadMeetingFiles?FilePath={filename}"
+    url: str = f"{SOS_SERVER}/Common/DownloadMeetingFiles?FilePath={filename}"
     return url
 
 def download_meeting(id: int, max_tries: int = MAX_TRIES, wait: float = TRY_WAIT) -> Response:
     url = generate_meeting_url(id)
-    r: Response = multitry(max_tries, wait, get, is_http_success, url)
+    r: Response = multitry(max_tries, wait, fetch, is_http_success, url, controller=get_rate_controller())
     return r
 
 def download_body(id: int, max_tries: int = MAX_TRIES, wait: float = TRY_WAIT) -> dict[str, Response]:
     om_url = generate_body_om_url(id)
     gd_url = generate_body_gd_url(id)
     bm_url = generate_body_bm_url(id)
-    om: Response = multitry(max_tries, wait, get, is_http_success, om_url)
-    gd: Response = multitry(max_tries, wait, get, is_http_success, gd_url)
-    bm: Response = multitry(max_tries, wait, get, is_http_success, bm_url)
+    om: Response = multitry(max_tries, wait, fetch, is_http_success, om_url, controller=get_rate_controller())
+    gd: Response = multitry(max_tries, wait, fetch, is_http_success, gd_url, controller=get_rate_controller())
+    bm: Response = multitry(max_tries, wait, fetch, is_http_success, bm_url, controller=get_rate_controller())
     return {'om': om, 'gd': gd, 'bm': bm}
 
+def download_body_om(id: int, max_tries: int = MAX_TRIES, wait: float = TRY_WAIT) -> Response:
+    return multitry(max_tries, wait, fetch, is_http_success, generate_body_om_url(id), controller=get_rate_controller())
+
 def download_document(filename: str, max_tries: int = MAX_TRIES, wait: float = TRY_WAIT) -> Response:
     url = generate_document_url(filename)
-    r: Response = multitry(max_tries, wait, get, is_http_success, url)
+    r: Response = multitry(max_tries, wait, fetch, is_http_success, url, controller=get_rate_controller())
     return r
 
-def multitry(max_tries: int, wait: float, func: Callable, is_success: Callable, *args):
+def download_document_spooled(filename: str, max_tries: int = MAX_TRIES, wait: float = TRY_WAIT) -> Spool:
+    """
+    Downloads a document into a Spool rather than memory, for agenda packets too large to hold in every worker at once. Close the spool when done with it.
+    """
+    url = generate_document_url(filename)
+    spool: Spool = multitry(max_tries, wait, fetch_spooled, is_http_success, url, controller=get_rate_controller())
+    return spool
+
+@timed('download')
+def multitry(max_tries: int, wait: float, func: Callable, is_success: Callable, *args, controller: RateController | None = None):
+    """
+    Calls func until is_success accepts its result, waiting an exponential backoff with jitter between tries.
+
+    :param max_tries: maximum number of calls
+    :param wait: backoff before the second try; it doubles with each further try
+    :param controller: if given, paces calls and is told which succeeded and which were throttled
+    :return: the accepted result; the number of calls made is added to the try count of the current id
+    """
     try_count = 0
     while try_count < max_tries:
         try_count += 1
+        if controller:
+            pause = controller.reserve()
+            WAIT_SECONDS.observe(pause)
+            sleep(pause)
+        retry_after: float | None = None
         try:
             result = func(*args)
             if is_success(result):
+                TRIES['success'].inc()
+                if controller:
+                    controller.on_success()
+                add_tries(try_count)
+                return result
+            TRIES['throttled' if is_throttled(result) else 'failed'].inc()
+            if controller and is_throttled(result):
+                retry_after = get_retry_after(result)
+                controller.on_throttle(retry_after)
+        except Exception as e:
+            TRIES['error'].inc()
+            if controller and is_network_error(e):
+                controller.on_throttle()
+        if try_count < max_tries:
+            pause = max(retry_after or 0.0, get_backoff(wait, try_count))
+            WAIT_SECONDS.observe(pause)
+            sleep(pause)
+    add_tries(try_count)
+    raise RuntimeError(f'{str(func)} with args {str(args)} failed after {try_count} tries with {wait} second wait.')
+
+# Async download
+
+def build_response(url: str, status: int, headers: Mapping[str, str], content: bytes) -> Response:
+    """
+    Packages a response received outside of requests as a requests Response so it can be passed to the parse functions.
+    """
+    response = Response()
+    response.url = url
+    response.status_code = status
+    response.headers = CaseInsensitiveDict(headers)
+    response.encoding = get_encoding_from_headers(response.headers)
+    response._content = content
+    return response
+
+async def fetch_async(session: ClientSession, url: str) -> Response:
+    async with session.get(url) as r:
+        return build_response(url, r.status, r.headers, await r.read())
+
+async def download_meeting_async(session: ClientSession, id: int, max_tries: int = MAX_TRIES, wait: float = TRY_WAIT) -> Response:
+    url = generate_meeting_url(id)
+    return await multitry_async(max_tries, wait, fetch_async, is_http_success, session, url, controller=get_rate_controller())
+
+async def download_document_async(session: ClientSession, filename: str, max_tries: int = MAX_TRIES, wait: float = TRY_WAIT) -> Response:
+    url = generate_document_url(filename)
+    return await multitry_async(max_tries, wait, fetch_async, is_http_success, session, url, controller=get_rate_controller())
+
+@timed('download')
+async def multitry_async(max_tries: int, wait: float, func: Callable[..., Awaitable], is_success: Callable, *args, controller: RateController | None = None):
+    try_count = 0
+    while try_count < max_tries:
+        try_count += 1
+        if controller:
+            pause = controller.reserve()
+            WAIT_SECONDS.observe(pause)
+            await asyncio.sleep(pause)
+        retry_after: float | None = None
+        try:
+            result = await func(*args)
+            if is_success(result):
+                TRIES['success'].inc()
+                if controller:
+                    controller.on_success()
+                add_tries(try_count)
                 return result
-            sleep(wait)
-        except Exception:
-            sleep(wait)
-    raise RuntimeError(f'{str(func)} with args {str(args)} failed after {try_count} tries with {wait} second wait.')
\ No newline at end of file
+            TRIES['throttled' if is_throttled(result) else 'failed'].inc()
+            if controller and is_throttled(result):
+                retry_after = get_retry_after(result)
+                controller.on_throttle(retry_after)
+        except Exception as e:
+            TRIES['error'].inc()
+            if controller and is_network_error(e):
+                controller.on_throttle()
+        if try_count < max_tries:
+            pause = max(retry_after or 0.0, get_backoff(wait, try_count))
+            WAIT_SECONDS.observe(pause)
+            await asyncio.sleep(pause)
+    add_tries(try_count)
+    raise RuntimeError(f'{str(func)} with args {str(args)} failed after {try_count} tries with {wait} second wait.')
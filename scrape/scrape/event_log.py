@@ -0,0 +1,114 @@
+import json
+import traceback
+import datetime as dt
+from os.path import exists, isdir
+from queue import Queue, Empty, Full
+from threading import Thread
+from time import monotonic
+from typing import Any
+
+# Structured run logs. Workers put events on a queue and return at once; a background thread writes them as JSON lines in batches and starts a new file when one grows past MAX_LOG_BYTES.
+
+MAX_LOG_BYTES: int = 64 * 1024 ** 2
+# Seconds the writer collects events for before writing them together
+FLUSH_INTERVAL: float = 1.0
+# Events written per batch at most
+BATCH_SIZE: int = 1000
+# Events waiting to be written; when the queue is full, events are dropped rather than blocking workers
+QUEUE_SIZE: int = 100000
+
+class EventLog:
+    """
+    A queue-backed JSON-lines log. Each event is one object with a timestamp, e.g. {"ts": ..., "id": 1009540, "stage": "download_meeting", "outcome": "error", "tries": 3, "elapsed": 1.2}. Safe to share between threads.
+
+    :param dir: the directory in which to create the log
+    :param name: descriptor added to the log filename
+    """
+    def __init__(self,
+                 dir: str,
+                 name: str = '',
+                 max_bytes: int = MAX_LOG_BYTES,
+                 flush_interval: float = FLUSH_INTERVAL,
+                 queue_size: int = QUEUE_SIZE):
+        if not isdir(dir):
+            raise IOError(f"'{dir}' is not a directory.")
+        self.base_name: str = f"{dir}/log_{name+'_' if name else name}{dt.datetime.utcnow().isoformat().replace(':', '-')}"
+        self.max_bytes: int = max_bytes
+        self.flush_interval: float = flush_interval
+        self.filenames: list[str] = []
+        self.dropped: int = 0
+        self._queue: Queue = Queue(maxsize=queue_size)
+        self._file = self._open()
+        self._size: int = 0
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def filename(self) -> str:
+        return self.filenames[-1]
+
+    def _open(self):
+        count = len(self.filenames)
+        filename = f'{self.base_name}.jsonl' if count == 0 else f'{self.base_name}_{count}.jsonl'
+        while exists(filename):
+            count += 1
+            filename = f'{self.base_name}_{count}.jsonl'
+        self.filenames.append(filename)
+        return open(filename, 'x')
+
+    def log(self, **fields: Any):
+        """
+        Queues an event without waiting for it to be written.
+        """
+        fields['ts'] = dt.datetime.utcnow().timestamp()
+        try:
+            self._queue.put_nowait(fields)
+        except Full:
+            self.dropped += 1
+
+    def error(self, e: BaseException, **fields: Any):
+        """
+        Queues an event for an exception, with its message and traceback.
+        """
+        self.log(outcome='error', error=f'{type(e).__name__}: {e}', traceback=''.join(traceback.format_exception(e)), **fields)
+
+    def _run(self):
+        while True:
+            event = self._queue.get()
+            batch: list[dict] = []
+            deadline = monotonic() + self.flush_interval
+            while event is not None:
+                batch.append(event)
+                if len(batch) >= BATCH_SIZE:
+                    break
+                try:
+                    event = self._queue.get(timeout=max(0.0, deadline - monotonic()))
+                except Empty:
+                    break
+            self._write(batch)
+            # None is the sentinel queued by close
+            if event is None:
+                return
+
+    def _write(self, batch: list[dict]):
+        if not batch:
+            return
+        text = ''.join(json.dumps(event, default=str) + '\n' for event in batch)
+        self._file.write(text)
+        self._file.flush()
+        self._size += len(text)
+        if self._size >= self.max_bytes:
+            self._file.close()
+            self._file = self._open()
+            self._size = 0
+
+    def close(self):
+        """
+        Writes every queued event and closes the file.
+        """
+        if self.dropped:
+            self._queue.put({'ts': dt.datetime.utcnow().timestamp(), 'stage': 'log', 'outcome': 'dropped', 'count': self.dropped})
+        # the writer stops at the sentinel, after the events queued before it
+        self._queue.put(None)
+        self._thread.join()
+        self._file.close()
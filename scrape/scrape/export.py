@@ -0,0 +1,56 @@
+import gzip
+import json
+from threading import Lock
+from typing import TextIO
+
+# Lines held in memory before they are written out
+BUFFER_SIZE: int = 1000
+
+FORMATS = ['json', 'ndjson', 'ndjson.gz']
+
+def ndjson_extension(compress: bool) -> str:
+    return 'jsonl.gz' if compress else 'jsonl'
+
+class NdjsonWriter:
+    """
+    Writes one JSON object per line (JSON Lines), the format read by Typesense's /documents/import endpoint. Objects are buffered and written in batches of at most buffer_size lines, so memory does not grow with the size of the export. Safe to share between threads.
+    """
+    def __init__(self, filename: str, compress: bool = False, buffer_size: int = BUFFER_SIZE):
+        """
+        :param filename: the file to create
+        :param compress: if true, gzip the output
+        :param buffer_size: maximum number of lines buffered before writing
+        """
+        self.filename: str = filename
+        self.buffer_size: int = buffer_size
+        self.count: int = 0
+        self._buffer: list[str] = []
+        self._lock = Lock()
+        self._file: TextIO = gzip.open(filename, 'xt', encoding='utf-8') if compress else open(filename, 'x', encoding='utf-8')
+
+    def write(self, object: dict):
+        line = json.dumps(object) + '\n'
+        with self._lock:
+            self._buffer.append(line)
+            self.count += 1
+            if len(self._buffer) >= self.buffer_size:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        self._file.write(''.join(self._buffer))
+        self._buffer.clear()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._file.close()
+
+    def __enter__(self) -> 'NdjsonWriter':
+        return self
+
+    def __exit__(self, *args):
+        self.close()
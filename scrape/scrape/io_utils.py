@@ -1,18 +1,14 @@
-from  os import mkdir
+from  os import mkdir, replace, getpid
 from os.path import exists, isdir, isfile
-from io import TextIOWrapper
 import threading
-from typing import Tuple, Callable
-import datetime as dt
-import traceback
+from concurrent.futures import Future
+from typing import Iterable
 from requests import Response, get
 from pymongo import MongoClient
 from pymongo.database import Database
 from constants import TIKA_SERVER, MONGODB_SERVER
 from resource_type import ResourceType
-from threading import Lock
-
-add_event: Callable[[str, str], str] = lambda event, log : log + f'\t{dt.datetime.utcnow()}: {event}\n'
+from session import get_session
 
 def make_dir_if_not_exists_and_check_is_dir(dir: str) -> None:
     if not exists(dir):
@@ -20,45 +16,23 @@ def make_dir_if_not_exists_and_check_is_dir(dir: str) -> None:
     elif not isdir(dir):
         raise IOError(f'Cannot create dir {dir} in package: {dir} exists but is not a directory.')
 
+def write_atomic(filename: str, content: bytes | Iterable[bytes]) -> None:
+    # readers see either the old file or the whole new one; the temporary name is unique to the writer, so concurrent writers of one file do not collide
+    tmp = f'{filename}.{getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp, 'wb') as f:
+        if isinstance(content, bytes):
+            f.write(content)
+        else:
+            for chunk in content:
+                f.write(chunk)
+    replace(tmp, filename)
+
 def make_file_if_not_exists_and_check_is_file(file: str) -> None:
     if not exists(file):
         open(file, 'x').close()
     elif not isfile(file):
         raise IOError(f'Cannot create file {file}: {file} exists but is not a file.')
 
-def make_log(dir: str, name:str = '') -> TextIOWrapper:
-    """
-    Safely makes a timestamped log file without overwriting
-    
-    :param dir: the directory in which to create the log
-    :param name: optional descriptor to add the the log filename
-    """
-    if not isdir(dir):
-        raise IOError(f"'{dir}' is not a directory.")
-    log_base_name = f"{dir}/log_{name+'_' if name else name}{str(dt.datetime.utcnow()).replace(' ', '_')}"
-    count: int = 0
-    log_name = f'{log_base_name}.txt'
-    while exists(log_name):
-        count += 1
-        log_name = f'{log_base_name}_{count}.txt'
-    return open(log_name, 'x')
-
-def make_log_and_lock(dir: str, name:str='') -> Tuple[TextIOWrapper, threading.Lock]:
-    """
-    Safely makes and packages a log file and thread lock on it
-    
-    :param dir: the directory in which to create the log
-    :param name: optional descriptor to add the the log filename
-    """
-    return (make_log(dir, name), threading.Lock())
-
-def threadsafe_write_if_log(to_write: str, log_and_lock: Tuple[TextIOWrapper, threading.Lock] | None, write_traceback: bool = False):
-    if log_and_lock is not None:
-        with log_and_lock[1]:
-            log_and_lock[0].write(to_write)
-            if write_traceback:
-                traceback.print_exc(file=log_and_lock[0])
-
 def is_http_success(response: Response) -> bool:
     code = response.status_code
     if code > 299:
@@ -68,38 +42,161 @@ def is_http_success(response: Response) -> bool:
     return True
 
 def is_tika_server_healthy() -> bool:
-    r: Response = get(TIKA_SERVER)
+    r: Response = get_session().get(TIKA_SERVER)
     return is_http_success(r)
 
 def is_mongodb_server_healthy() -> bool:
     r: Response = get(MONGODB_SERVER)
     return is_http_success(r)
 
-def build_in_db(rtype: ResourceType, db: Database, db_lock: Lock) -> Callable[[int], bool]:
-    def in_db(id: int) -> bool:
-        with db_lock:
-            collection = db[rtype.collection_name()]
-            return collection.find_one({'_id': id}) is not None
-    return in_db
-
 bodies = ResourceType.BODY.collection_name()
 
-def get_body_id_from_name(db: Database, db_lock: Lock, name: str) -> int:
+def get_body_id_from_name(db: Database, name: str) -> int:
     collection = db[bodies]
-    with db_lock:
-        found = collection.find_one({'name': name})
+    found = collection.find_one({'name': name})
     if found:
         return found['_id']
     raise RuntimeError(f"No body with name '{name}' was found.")
 
+class BodyIds:
+    """
+    Body ids by name, loaded from the bodies collection in one query. Names missing from the map, e.g. bodies stored since it was loaded, are looked up by name, which ensure_indexes indexes, and concurrent lookups of the same name share one query. Safe to share between threads.
+    """
+    def __init__(self, db: Database):
+        self.db: Database = db
+        self._ids: dict[str, int] = {found['name']: found['_id'] for found in db[bodies].find({}, {'name': 1})}
+        self._misses: dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> int:
+        id = self._ids.get(name)
+        if id is not None:
+            return id
+        with self._lock:
+            if name in self._ids:
+                return self._ids[name]
+            miss = self._misses.get(name)
+            is_first = miss is None
+            if is_first:
+                miss = self._misses[name] = Future()
+        if not is_first:
+            # raises the first lookup's error if it failed
+            return miss.result()
+        try:
+            id = get_body_id_from_name(self.db, name)
+            with self._lock:
+                self._ids[name] = id
+            miss.set_result(id)
+            return id
+        except Exception as e:
+            # failures are not remembered, since the body may be stored later
+            miss.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._misses[name]
+
+_body_ids: BodyIds | None = None
+_body_ids_lock = threading.Lock()
+
+def get_body_ids(db: Database) -> BodyIds:
+    """
+    Gets the name to id map shared by all validation, loading it on first use or when given a different database.
+    """
+    global _body_ids
+    with _body_ids_lock:
+        if _body_ids is None or _body_ids.db is not db:
+            _body_ids = BodyIds(db)
+        return _body_ids
+
 def get_database() -> Database:
     assert(is_mongodb_server_healthy())
     client = MongoClient()
     return client.scrape
 
+def warn_missing_indexes(db: Database) -> int:
+    """
+    Prints a warning for each missing index. Call once per run; the indexes are created by the migrate command, not here, since creating them on a large collection blocks startup.
+
+    :return: number of missing indexes
+    """
+    missing = get_missing_indexes(db)
+    for collection, name in missing:
+        print(f'Warning: index {collection}.{name} is missing; run `python3 run.py migrate` to create it.')
+    return len(missing)
+
+def get_index_name(keys: list[tuple[str, int]]) -> str:
+    # the name MongoDB gives an index by default
+    return '_'.join(f'{field}_{direction}' for field, direction in keys)
+
+def get_missing_indexes(db: Database) -> list[tuple[str, str]]:
+    """
+    Compares the indexes each collection needs, as listed by ResourceType.get_db_indexes, against those it has, by their keys. Only reads index_information, so it is cheap to run at every startup.
+
+    :return: (collection, index name) of every missing index
+    """
+    missing: list[tuple[str, str]] = []
+    for rtype in ResourceType:
+        collection = db[rtype.collection_name()]
+        existing = [list(info['key']) for info in collection.index_information().values()]
+        for keys, _ in rtype.get_db_indexes():
+            if list(keys) not in existing:
+                missing.append((collection.name, get_index_name(keys)))
+    return missing
+
+def ensure_indexes(db: Database) -> list[tuple[str, str, str]]:
+    """
+    Creates the indexes each collection needs, as listed by ResourceType.get_db_indexes. Indexes that exist are left alone. Creating an index can take long on a large collection, so this is run by the migrate command rather than at startup.
+
+    :return: (collection, index name, 'created' or 'exists') for every index
+    """
+    report: list[tuple[str, str, str]] = []
+    for rtype in ResourceType:
+        collection = db[rtype.collection_name()]
+        existing = collection.index_information()
+        for keys, options in rtype.get_db_indexes():
+            name = collection.create_index(keys, **options)
+            report.append((collection.name, name, 'exists' if name in existing else 'created'))
+    return report
+
+def get_index_builds(db: Database) -> list[dict]:
+    """
+    :return: index builds in progress on the database, with their progress where the server reports it
+    """
+    ops = db.client.admin.command({'currentOp': 1, 'command.createIndexes': {'$exists': True}, 'ns': {'$regex': f'^{db.name}\\.'}})
+    return [{'ns': op.get('ns'), 'msg': op.get('msg', ''), 'progress': op.get('progress', {})} for op in ops.get('inprog', [])]
+
 def clear(db: Database):
     for rtype in ResourceType:
         db[rtype.collection_name()].delete_many({})
 
-def is_in_db(db: Database, db_lock: Lock, collection: str, id: int) -> bool:
-    return db[collection].find_one({'_id': id}) is not None
\ No newline at end of file
+def is_in_db(db: Database, collection: str, id: int) -> bool:
+    return db[collection].find_one({'_id': id}) is not None
+
+class ExistingIds:
+    """
+    Which ids of a collection are stored, prefetched a chunk at a time with one projected range query and held as one bit per id, so checking an id needs no query. Ids outside the prefetched range are looked up one at a time.
+    """
+    def __init__(self, db: Database, rtype: ResourceType):
+        self.db: Database = db
+        self.collection: str = rtype.collection_name()
+        # (start, stop, bits), replaced whole so readers never see a half-built range
+        self._range: tuple[int, int, bytearray] = (0, 0, bytearray())
+
+    def prefetch(self, start: int, stop: int):
+        """
+        Fetches which ids in [start, stop) are stored. Call between chunks, before workers check ids.
+        """
+        bits = bytearray((stop - start + 7) // 8)
+        # the projection lets the query be answered from the _id index alone
+        for found in self.db[self.collection].find({'_id': {'$gte': start, '$lt': stop}}, {'_id': 1}):
+            i = found['_id'] - start
+            bits[i >> 3] |= 1 << (i & 7)
+        self._range = (start, stop, bits)
+
+    def __contains__(self, id: int) -> bool:
+        start, stop, bits = self._range
+        if start <= id < stop:
+            i = id - start
+            return bool(bits[i >> 3] & (1 << (i & 7)))
+        return is_in_db(self.db, self.collection, id)
@@ -0,0 +1,249 @@
+import json
+from bisect import bisect_left
+from functools import wraps
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from inspect import iscoroutinefunction
+from threading import Lock, Thread, Event
+from time import perf_counter
+from typing import Callable
+from io_utils import write_atomic
+
+# Counters, histograms and gauges for each stage of the pipeline, so a slow crawl shows whether it is waiting on SOS, Tika, MongoDB or the CPU. Metrics live in this process only: work done inside ParsePool's worker processes is timed by the parent as it waits.
+
+# Upper bounds in seconds of the latency histogram buckets
+BUCKETS: list[float] = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0]
+# Seconds between JSON snapshots
+SNAPSHOT_INTERVAL: float = 10.0
+# Address the metrics are served on unless --metrics-host is given
+METRICS_HOST: str = '127.0.0.1'
+
+Labels = tuple[tuple[str, str], ...]
+
+def format_labels(labels: Labels, extra: Labels = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+class Counter:
+    def __init__(self):
+        self.value: float = 0.0
+        self._lock = Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self) -> float:
+        return self.value
+
+class Gauge:
+    def __init__(self):
+        self.value: float = 0.0
+        self._lock = Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.inc(-amount)
+
+    def set(self, value: float):
+        with self._lock:
+            self.value = value
+
+    def snapshot(self) -> float:
+        return self.value
+
+class Histogram:
+    def __init__(self, buckets: list[float] = BUCKETS):
+        self.buckets: list[float] = buckets
+        # the last count is for values above every bucket
+        self.counts: list[int] = [0] * (len(buckets) + 1)
+        self.sum: float = 0.0
+        self.count: int = 0
+        self._lock = Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimates a quantile as the upper bound of the bucket it falls in.
+        """
+        with self._lock:
+            rank = q * self.count
+            seen = 0
+            for bound, count in zip(self.buckets, self.counts):
+                seen += count
+                if seen >= rank and seen > 0:
+                    return bound
+            return float('inf') if self.count else 0.0
+
+    def snapshot(self) -> dict:
+        return {'count': self.count,
+                'sum': round(self.sum, 6),
+                'p50': self.quantile(0.5),
+                'p99': self.quantile(0.99)}
+
+class Registry:
+    """
+    Metrics by name and labels, created on first use. Safe to share between threads.
+    """
+    def __init__(self):
+        self._metrics: dict[str, tuple[str, str, dict[Labels, Counter | Gauge | Histogram]]] = {}
+        self._lock = Lock()
+
+    def _get(self, kind: str, name: str, help: str, labels: dict[str, str], build: Callable):
+        key: Labels = tuple(sorted(labels.items()))
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = (kind, help, {})
+            series = self._metrics[name][2]
+            if key not in series:
+                series[key] = build()
+            return series[key]
+
+    def counter(self, name: str, help: str = '', **labels: str) -> Counter:
+        return self._get('counter', name, help, labels, Counter)
+
+    def gauge(self, name: str, help: str = '', **labels: str) -> Gauge:
+        return self._get('gauge', name, help, labels, Gauge)
+
+    def histogram(self, name: str, help: str = '', **labels: str) -> Histogram:
+        return self._get('histogram', name, help, labels, Histogram)
+
+    def to_prometheus(self) -> str:
+        """
+        :return: every metric in the Prometheus text exposition format
+        """
+        lines: list[str] = []
+        with self._lock:
+            metrics = [(name, kind, help, list(series.items())) for name, (kind, help, series) in self._metrics.items()]
+        for name, kind, help, series in metrics:
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, metric in series:
+                if isinstance(metric, Histogram):
+                    cumulative = 0
+                    for bound, count in zip(metric.buckets + [float('inf')], metric.counts):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else repr(bound)
+                        lines.append(f'{name}_bucket{format_labels(labels, (("le", le),))} {cumulative}')
+                    lines.append(f'{name}_sum{format_labels(labels)} {metric.sum}')
+                    lines.append(f'{name}_count{format_labels(labels)} {metric.count}')
+                else:
+                    lines.append(f'{name}{format_labels(labels)} {metric.value}')
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self) -> dict:
+        """
+        :return: every metric by name, as a list of its labels and values
+        """
+        with self._lock:
+            metrics = [(name, list(series.items())) for name, (_, _, series) in self._metrics.items()]
+        return {name: [{'labels': dict(labels), 'value': metric.snapshot()} for labels, metric in series]
+                for name, series in metrics}
+
+_registry = Registry()
+
+def get_registry() -> Registry:
+    return _registry
+
+class stage:
+    """
+    Times a block of work as a pipeline stage, counting it in flight while it runs and as an error if it raises.
+    """
+    def __init__(self, name: str, registry: Registry | None = None):
+        registry = registry or _registry
+        self.seconds = registry.histogram('scrape_stage_seconds', 'Time spent in each pipeline stage', stage=name)
+        self.in_flight = registry.gauge('scrape_stage_in_flight', 'Calls of each pipeline stage in progress', stage=name)
+        self.errors = registry.counter('scrape_stage_errors_total', 'Calls of each pipeline stage that raised', stage=name)
+
+    def __enter__(self) -> 'stage':
+        self.in_flight.inc()
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.seconds.observe(perf_counter() - self._start)
+        self.in_flight.dec()
+        if exc_type is not None:
+            self.errors.inc()
+
+def timed(name: str) -> Callable[[Callable], Callable]:
+    """
+    Decorates a function or coroutine function to be timed as the stage name.
+    """
+    def decorate(func: Callable) -> Callable:
+        if iscoroutinefunction(func):
+            @wraps(func)
+            async def timed_coroutine(*args, **kwargs):
+                with stage(name):
+                    return await func(*args, **kwargs)
+            return timed_coroutine
+        @wraps(func)
+        def timed_function(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return timed_function
+    return decorate
+
+def serve_metrics(port: int, host: str = METRICS_HOST, registry: Registry | None = None) -> ThreadingHTTPServer:
+    """
+    Serves the metrics at /metrics in the Prometheus text format and at /metrics.json as a snapshot, from a daemon thread.
+
+    :param host: address to listen on; only this machine by default, since the metrics are served without authentication
+    """
+    registry = registry or _registry
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path == '/metrics':
+                body, content_type = registry.to_prometheus().encode('utf-8'), 'text/plain; version=0.0.4'
+            elif self.path == '/metrics.json':
+                body, content_type = json.dumps(registry.snapshot()).encode('utf-8'), 'application/json'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+class SnapshotWriter:
+    """
+    Writes a JSON snapshot of the metrics to a file every interval seconds, and once more on close.
+    """
+    def __init__(self, filename: str, interval: float = SNAPSHOT_INTERVAL, registry: Registry | None = None):
+        self.filename: str = filename
+        self.interval: float = interval
+        self.registry: Registry = registry or _registry
+        self._stop = Event()
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self):
+        write_atomic(self.filename, json.dumps(self.registry.snapshot(), indent=1).encode('utf-8'))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.write()
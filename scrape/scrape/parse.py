@@ -1,11 +1,18 @@
 import re
+import hashlib
 import pytz
+from html.parser import HTMLParser
+from typing import Iterable
 from bs4 import BeautifulSoup as bs
 from bs4 import Tag
-from requests import Response, put
+from lxml.html import HtmlElement, document_fromstring
+from bson import ObjectId
+from aiohttp import ClientSession
+from requests import Response
 import datetime as dt
-from constants import TIKA_ENDPOINT
-from io_utils import is_tika_server_healthy
+from tika import get_tika_client
+from download import Spool
+from metrics import timed, stage
 
 RI_TZ = pytz.timezone("US/Eastern")
 
@@ -37,7 +44,8 @@ class RawMeeting:
                  is_public_notice: str,
                  is_cancelled: str,
                  cancelled_dt: str,
-                 cancelled_reason: str):
+                 cancelled_reason: str,
+                 hash: str = ''):
         self.stamp: float = stamp
         self.body: str = body
         self.meeting_date: str = meeting_date
@@ -62,6 +70,7 @@ class RawMeeting:
         self.is_cancelled: str = is_cancelled
         self.cancelled_dt: str = cancelled_dt
         self.cancelled_reason: str = cancelled_reason
+        self.hash: str = hash
 
 class RawOMBody:
     def __init__(self,
@@ -113,7 +122,8 @@ class RawBody:
                  stamp: float,
                  om: RawOMBody,
                  gd: RawGDBody,
-                 bm: RawBMBody):
+                 bm: RawBMBody,
+                 hash: str = ''):
         self.stamp: float = stamp
         self.name: str = om.name
         self.contact_name: str = om.contact_name
@@ -133,13 +143,22 @@ class RawBody:
         self.max_members: str | None  = bm.max_members
         self.authority: tuple[str, str]  = bm.authority
         self.board_members: list[tuple[str, str, str, str, str]] = bm.board_members
+        self.hash: str = hash
 
 class RawDocument:
     def __init__(self,
                  stamp: float,
-                 snippets: list[str]):
+                 snippets: list[str],
+                 hash: str = '',
+                 id: ObjectId | None = None,
+                 pending: bool = False):
         self.stamp: float = stamp
         self.snippets: list[str] = snippets
+        self.hash: str = hash
+        # id of the stored document when it is unchanged and should be reused
+        self.id: ObjectId | None = id
+        # if the document has not been downloaded yet and is stored without snippets
+        self.pending: bool = pending
 
 def check_meeting_table_title(table: Tag, expected_title: str):
     # raise AttributeError or TypeError if selector chain is not valid
@@ -210,8 +229,86 @@ def get_stamp(response: Response) -> float:
         return local_dt_to_posix(dt.datetime.strptime(string, DATE_PATTERN))
     return 0.0
 
-def parse_meeting(response: Response) -> RawMeeting:
-    soup = bs(response.text, "html.parser")
+def get_hash(*responses: Response) -> str:
+    h = hashlib.sha256()
+    for response in responses:
+        h.update(response.content)
+    return h.hexdigest()
+
+# HTML parser backends for meeting and body pages. Both build identical raw objects; lxml builds its tree in C and is several times faster than bs4 with html.parser.
+PARSERS = ['lxml', 'bs4']
+DEFAULT_PARSER = 'lxml'
+
+_parser: str = DEFAULT_PARSER
+
+def configure_parser(parser: str):
+    """
+    Sets the backend used to parse meeting and body pages.
+
+    :param parser: one of PARSERS
+    """
+    global _parser
+    if parser not in PARSERS:
+        raise RuntimeError(f"Parser '{parser}' not recognized; expected one of {PARSERS}.")
+    _parser = parser
+
+def get_parser() -> str:
+    return _parser
+
+def build_raw_meeting(
+        stamp: float,
+        hash: str,
+        flag_dict: dict[str, str],
+        infodict: dict[str, str],
+        agendas: list[tuple[str, str]],
+        minutes: list[tuple[str, str]],
+        contact_dict: dict[str, str]) -> RawMeeting:
+    """
+    Builds a meeting from the values a parser backend extracted from its page. Raises KeyError if a value is missing.
+
+    :param flag_dict: hidden input values of the info table by input id
+    :param infodict: info table cells by label
+    :param agendas: (text, onclick) of each agenda link
+    :param minutes: (text, onclick) of each minutes link
+    :param contact_dict: contact table cells by label
+    """
+    return RawMeeting(stamp=stamp,
+                        body=infodict['Public Body Name:'],
+                        meeting_date=infodict['Date:'],
+                        meeting_time=infodict['Time:'],
+                        meeting_address=infodict['Address:'],
+                        filing_dt=infodict['Filed on:'],
+                        agendas=agendas,
+                        minutes=minutes,
+                        contact_name=contact_dict['Contact Person:'],
+                        contact_phone=contact_dict['Phone:'],
+                        contact_email=contact_dict['Email:'],
+                        is_meeting_date_changed=flag_dict['HdnMeetingDateChange'],
+                        is_meeting_time_changed=flag_dict['HdnMeetingTimeChange'],
+                        is_address_changed=flag_dict['HdnAddressChange'],
+                        is_annual_calendar_changed=flag_dict['HdnIsAnnualCalendarChange'],
+                        is_emergency_changed=flag_dict['HdnIsEmergencyChange'],
+                        is_public_notice_changed=flag_dict['HdnIsPublicNoticeChange'],
+                        is_agenda_changed=flag_dict['HdnIsAgendaChange'],
+                        is_emergency=flag_dict['HdnEmergencyStr'],
+                        is_annual_calendar=flag_dict['HdnAnualStr'],
+                        is_public_notice=flag_dict['HdnIspublicAnnouncementnotice'],
+                        is_cancelled=flag_dict['HdnCancelMeetingFlag'],
+                        cancelled_dt=flag_dict['HdnCancelMeetingDateTime'],
+                        cancelled_reason=flag_dict['HdnCancelledComments'],
+                        hash=hash)
+
+@timed('parse_meeting')
+def parse_meeting(response: Response, parser: str | None = None) -> RawMeeting:
+    return parse_meeting_page(response.text, get_stamp(response), get_hash(response), parser)
+
+def parse_meeting_page(text: str, stamp: float = 0.0, hash: str = '', parser: str | None = None) -> RawMeeting:
+    if (parser or _parser) == 'lxml':
+        return parse_meeting_page_lxml(text, stamp, hash)
+    return parse_meeting_page_bs4(text, stamp, hash)
+
+def parse_meeting_page_bs4(text: str, stamp: float, hash: str) -> RawMeeting:
+    soup = bs(text, "html.parser")
 
     # get meeting tables
     tables = soup.find_all(name="table", class_="table meeting")
@@ -226,29 +323,9 @@ def parse_meeting(response: Response) -> RawMeeting:
         raise RuntimeError(f"Expected 13 input tags but only got {len(inputs)}.")
     flag_dict: dict[str, str] = get_dict_from_input_vals(inputs)
 
-    # parse infotable hidden input values
-    is_meeting_date_changed: str = flag_dict['HdnMeetingDateChange']
-    is_meeting_time_changed: str = flag_dict['HdnMeetingTimeChange']
-    is_address_changed: str = flag_dict['HdnAddressChange']
-    is_annual_calendar_changed: str = flag_dict['HdnIsAnnualCalendarChange']
-    is_emergency_changed: str = flag_dict['HdnIsEmergencyChange']
-    is_public_notice_changed: str = flag_dict['HdnIsPublicNoticeChange']
-    is_agenda_changed: str = flag_dict['HdnIsAgendaChange']
-    is_emergency_flag: str = flag_dict['HdnEmergencyStr']
-    is_annual_calendar_flag: str = flag_dict['HdnAnualStr']
-    is_public_notice_flag: str = flag_dict['HdnIspublicAnnouncementnotice']
-    is_cancelled: str = flag_dict['HdnCancelMeetingFlag']
-    cancelled_dt: str = flag_dict['HdnCancelMeetingDateTime']
-    cancelled_reason: str = flag_dict['HdnCancelledComments']
-    
     # parse infotable tbody rows
     # use dict so KeyError is raised if key is not in table
     infodict = get_dict_from_meeting_table(infotable)
-    body: str = infodict['Public Body Name:']
-    meeting_date: str = infodict['Date:']
-    meeting_time: str = infodict['Time:']
-    meeting_address: str = infodict['Address:']
-    filing_dt: str = infodict['Filed on:']
 
     # parse agendas
     agenda_table = tables[1]
@@ -262,42 +339,40 @@ def parse_meeting(response: Response) -> RawMeeting:
     contact_table = tables[3]
     check_meeting_table_title(contact_table, 'Contact Information')
     contact_dict = get_dict_from_meeting_table(contact_table)
-    contact_name: str = contact_dict['Contact Person:']
-    contact_phone: str = contact_dict['Phone:']
-    contact_email: str = contact_dict['Email:']
-
-    return RawMeeting(stamp=get_stamp(response),
-                        body=body,
-                        meeting_date=meeting_date,
-                        meeting_time=meeting_time,
-                        meeting_address=meeting_address,
-                        filing_dt=filing_dt,
-                        agendas=agendas,
-                        minutes=minutes,
-                        contact_name=contact_name,
-                        contact_phone=contact_phone,
-                        contact_email=contact_email,
-                        is_meeting_date_changed=is_meeting_date_changed,
-                        is_meeting_time_changed=is_meeting_time_changed,
-                        is_address_changed=is_address_changed,
-                        is_annual_calendar_changed=is_annual_calendar_changed,
-                        is_emergency_changed=is_emergency_changed,
-                        is_public_notice_changed=is_public_notice_changed,
-                        is_agenda_changed=is_agenda_changed,
-                        is_emergency=is_emergency_flag,
-                        is_annual_calendar=is_annual_calendar_flag,
-                        is_public_notice=is_public_notice_flag,
-                        is_cancelled=is_cancelled,
-                        cancelled_dt=cancelled_dt,
-                        cancelled_reason=cancelled_reason)
-
-def parse_body(om_response: Response, gd_response: Response, bm_response: Response) -> RawBody:
-    om = parse_body_om_page(om_response.text)
-    gd = parse_body_gd_page(gd_response.text)
-    bm = parse_body_bm_page(bm_response.text)
-    return RawBody(stamp=get_stamp(om_response), om=om, gd=gd, bm=bm)
-
-def parse_body_om_page(text: str) -> RawOMBody:
+
+    return build_raw_meeting(stamp, hash, flag_dict, infodict, agendas, minutes, contact_dict)
+
+@timed('parse_body')
+def parse_body(om_response: Response, gd_response: Response, bm_response: Response, parser: str | None = None) -> RawBody:
+    om = parse_body_om_page(om_response.text, parser)
+    gd = parse_body_gd_page(gd_response.text, parser)
+    bm = parse_body_bm_page(bm_response.text, parser)
+    return RawBody(stamp=get_stamp(om_response), om=om, gd=gd, bm=bm, hash=get_hash(om_response, gd_response, bm_response))
+
+MEETING_LINK_PATTERN = r'ViewMeetingDetails\((\d+)\)'
+
+def parse_dashboard_meeting_ids(text: str) -> list[int]:
+    """
+    Finds the ids of the meetings listed on a body's dashboard (om) page. The page lists every meeting of the body, so the ids exist without downloading them.
+    """
+    return sorted({int(id) for id in re.findall(MEETING_LINK_PATTERN, text)})
+
+def parse_body_om_page(text: str, parser: str | None = None) -> RawOMBody:
+    if (parser or _parser) == 'lxml':
+        return parse_body_om_page_lxml(text)
+    return parse_body_om_page_bs4(text)
+
+def parse_body_gd_page(text: str, parser: str | None = None) -> RawGDBody:
+    if (parser or _parser) == 'lxml':
+        return parse_body_gd_page_lxml(text)
+    return parse_body_gd_page_bs4(text)
+
+def parse_body_bm_page(text: str, parser: str | None = None) -> RawBMBody:
+    if (parser or _parser) == 'lxml':
+        return parse_body_bm_page_lxml(text)
+    return parse_body_bm_page_bs4(text)
+
+def parse_body_om_page_bs4(text: str) -> RawOMBody:
     soup = bs(text, "html.parser")
 
     forms = soup.find_all('form')
@@ -320,7 +395,7 @@ def parse_body_om_page(text: str) -> RawOMBody:
     
     return RawOMBody(name, contact_name, contact_phone, contact_email, subcommittees)
 
-def parse_body_gd_page(text: str) -> RawGDBody:
+def parse_body_gd_page_bs4(text: str) -> RawGDBody:
     soup = bs(text, "html.parser")
     forms = soup.find_all('form')
     form = forms[1]
@@ -365,7 +440,7 @@ def parse_body_gd_page(text: str) -> RawGDBody:
         responsibilities=responsibilities,
         people=dict())
 
-def parse_body_bm_page(text: str) -> RawBMBody:
+def parse_body_bm_page_bs4(text: str) -> RawBMBody:
     soup = bs(text, "html.parser")
     forms = soup.find_all('form')
     form = forms[1]
@@ -387,16 +462,235 @@ def parse_body_bm_page(text: str) -> RawBMBody:
         authority=authority,
         board_members=board_members)
 
+def has_class(name: str) -> str:
+    # XPath predicate matching an element whose class list contains name, like bs4's class_=name
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+def get_second_next_sibling(element: HtmlElement) -> HtmlElement | None:
+    """
+    Gets what bs4 calls element.next_sibling.next_sibling, where text between elements is a sibling. Returns None where that would be text.
+    """
+    if element.tail:
+        return element.getnext()
+    next = element.getnext()
+    if next is None or next.tail:
+        return None
+    return next.getnext()
+
+def check_meeting_table_title_lxml(table: HtmlElement, expected_title: str):
+    title: str = table.xpath('./thead/tr//label')[0].text_content()
+    if title != expected_title:
+        raise RuntimeError(f"Expected table title '{expected_title}' but got '{title}'.")
+
+def get_cells_from_meeting_table_lxml(table: HtmlElement, num_rows: int = -1, num_cells: int = -1) -> list[list[HtmlElement]]:
+    tablerows = table.xpath('.//tbody/tr')
+    # infotable should have num_rows rows in tbody
+    if num_rows != -1 and len(tablerows) != num_rows:
+        raise RuntimeError(f"Expected {num_rows} rows in infotable.tbody but found {len(tablerows)}.")
+    rows = []
+    for tr in tablerows:
+        cells = tr.xpath('.//td')
+        # infotable tbody row should have num_cells cells
+        if num_cells != -1 and len(cells) != num_cells:
+            raise RuntimeError(f"Expected {num_cells} cells in row but got {len(cells)}.")
+        rows.append(cells)
+    return rows
+
+def get_dict_from_meeting_table_lxml(table: HtmlElement, num_rows: int = -1, num_cells: int = -1) -> dict:
+    return {cells[0].text_content().strip(): cells[1].text_content().strip()
+            for cells in get_cells_from_meeting_table_lxml(table, num_rows, num_cells)}
+
+def get_list_from_meeting_table_lxml(table: HtmlElement, num_rows: int = -1, num_cells: int = -1) -> list:
+    return [cells[1].text_content().strip() for cells in get_cells_from_meeting_table_lxml(table, num_rows, num_cells)]
+
+def parse_doclist_lxml(links: list[HtmlElement]) -> list[tuple[str, str]]:
+    return [(link.text_content(), link.attrib['onclick']) for link in links]
+
+def parse_meeting_page_lxml(text: str, stamp: float, hash: str) -> RawMeeting:
+    root: HtmlElement = document_fromstring(text)
+
+    tables = root.xpath('//table[@class="table meeting"]')
+    if len(tables) != 4:
+        raise RuntimeError(f"Expected 4 tables of class 'table meeting' in html, but found {len(tables)}.")
+
+    infotable = tables[0]
+    inputs: list[HtmlElement] = infotable.xpath('./thead/tr/input')
+    if len(inputs) != 13:
+        raise RuntimeError(f"Expected 13 input tags but only got {len(inputs)}.")
+    flag_dict: dict[str, str] = {input.attrib['id']: input.attrib['value'] for input in inputs}
+    infodict = get_dict_from_meeting_table_lxml(infotable)
+
+    agendas = parse_doclist_lxml(tables[1].xpath('.//tbody/tr/td/a'))
+    minutes = parse_doclist_lxml(tables[2].xpath('.//tbody/tr/td/a'))
+
+    contact_table = tables[3]
+    check_meeting_table_title_lxml(contact_table, 'Contact Information')
+    contact_dict = get_dict_from_meeting_table_lxml(contact_table)
+
+    return build_raw_meeting(stamp, hash, flag_dict, infodict, agendas, minutes, contact_dict)
+
+def parse_body_om_page_lxml(text: str) -> RawOMBody:
+    root: HtmlElement = document_fromstring(text)
+    forms = root.xpath('//form')
+
+    header_form = forms[0]
+    name: str = header_form.xpath('.//h1')[0].text_content()
+    rows = header_form.xpath(f'.//div[{has_class("row")}]')
+    vals = [row.xpath('./div')[1].text_content().strip() for row in rows]
+    contact_name: str = vals[0]
+    contact_phone: str = vals[1]
+    contact_email: str = vals[2]
+
+    subtitle = forms[1].xpath(f'.//h2[{has_class("subTitle")}]')[0]
+    subcommittee_table = get_second_next_sibling(subtitle)
+    if subcommittee_table is not None and subcommittee_table.tag == 'div':
+        subcommittees: list[tuple[str, str]] = [(link.attrib['href'], link.text_content()) for link in subcommittee_table.xpath('.//a')]
+    else:
+        subcommittees = []
+
+    return RawOMBody(name, contact_name, contact_phone, contact_email, subcommittees)
+
+def parse_body_gd_page_lxml(text: str) -> RawGDBody:
+    root: HtmlElement = document_fromstring(text)
+    form = root.xpath('//form')[1]
+    if form.xpath('.//input[@id="IsGovDataFlag"]')[0].attrib['value'] == '0':
+        return RawGDBody(dict(), '', '', '', '', '', '', '', '', dict())
+    standard_tables = form.xpath('.//table[@class="table meeting"]')
+    has_contact_table = len(standard_tables) == 3
+    if has_contact_table:
+        contact_information = get_dict_from_meeting_table_lxml(standard_tables[0])
+        social_table = standard_tables[1]
+        attributes_table = standard_tables[2]
+    else:
+        contact_information = dict()
+        social_table = standard_tables[0]
+        attributes_table = standard_tables[1]
+    social_list = get_list_from_meeting_table_lxml(social_table)
+    attribute_rows = attributes_table.xpath('(.//tbody)[1]/tr')
+    if len(attribute_rows) == 5:
+        budget: str = attribute_rows[0].xpath('.//td')[1].text_content()
+        personnel: str = attribute_rows[1].xpath('.//td')[1].text_content()
+        description: str = attribute_rows[2].xpath('.//td')[0].text_content()
+        responsibilities: str = attribute_rows[4].xpath('.//td')[0].text_content()
+    else:
+        budget = ''
+        personnel = ''
+        description = ''
+        responsibilities = ''
+
+    return RawGDBody(
+        contact_information=contact_information,
+        facebook=social_list[0],
+        twitter=social_list[1],
+        instagram=social_list[2],
+        linkedin=social_list[3],
+        budget=budget,
+        personnel=personnel,
+        description=description,
+        responsibilities=responsibilities,
+        people=dict())
+
+def parse_body_bm_page_lxml(text: str) -> RawBMBody:
+    root: HtmlElement = document_fromstring(text)
+    form = root.xpath('//form')[1]
+    if form.xpath('.//input[@id="IsBoardsFlag"]')[0].attrib['value'] == '0':
+        return RawBMBody(None, ('', ''), list())
+    label = form.xpath('.//label')[0]
+    if label.tail is None:
+        raise RuntimeError('Expected the number of board members after the first label.')
+    max_members: str = label.tail.strip()
+    board_table = form.xpath('.//*[@id="BoardMemberDetail"]')[0]
+    board_members = []
+    for tr in board_table.xpath('(.//tbody)[1]//tr'):
+        board_members.append(tuple(td.text_content() for td in tr.xpath('.//td')))
+    return RawBMBody(
+        max_members=max_members,
+        authority=('', ''),
+        board_members=board_members)
+
+@timed('tika')
 def extract_text(bytes: bytes, content_type: str = 'application/pdf', output_format: str = 'text/html') -> Response:
-    files = {"files": bytes}
-    headers = {'Content-type': content_type, 'Accept': output_format}
-    tika_response: Response = put(TIKA_ENDPOINT, files=files, headers=headers)
-    return tika_response
+    return get_tika_client().extract(bytes, content_type, output_format)
 
-def parse_document(sos_response: Response) -> RawDocument:
-    assert(is_tika_server_healthy())
-    text = re.sub('\n+', '', extract_text(sos_response.content).text)
+@timed('tika')
+async def extract_text_async(session: ClientSession, bytes: bytes, content_type: str = 'application/pdf', output_format: str = 'text/html') -> str:
+    return await get_tika_client().extract_async(session, bytes, content_type, output_format)
+
+def parse_tika_html(html: str) -> list[str]:
+    text = re.sub('\n+', '', html)
     ps = (p.text.strip() for p in bs(text, "html.parser").find_all('p'))
-    snippets = [re.sub('\s+', ' ', p) for p in ps if p]
+    return [re.sub('\s+', ' ', p) for p in ps if p]
+
+class TikaParser(HTMLParser):
+    """
+    Splits Tika's XHTML output into snippets as it is fed, finding the same snippets as parse_tika_html does in the whole output. Only the text of paragraphs still open is held, so output can be parsed as it arrives.
+    """
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        # text of each paragraph in the order they open; None until closed
+        self._paragraphs: list[str | None] = []
+        # index and text so far of each open paragraph, innermost last
+        self._open: list[tuple[int, list[str]]] = []
+
+    def feed(self, data: str):
+        # as parse_tika_html, newlines are removed before parsing rather than treated as whitespace
+        super().feed(data.replace('\n', ''))
+
+    def handle_starttag(self, tag: str, attrs):
+        if tag == 'p':
+            self._open.append((len(self._paragraphs), []))
+            self._paragraphs.append(None)
+
+    def handle_endtag(self, tag: str):
+        if tag == 'p' and self._open:
+            self._finish()
+
+    def handle_data(self, data: str):
+        # an outer paragraph's text includes that of paragraphs nested in it
+        for _, parts in self._open:
+            parts.append(data)
+
+    def _finish(self):
+        index, parts = self._open.pop()
+        self._paragraphs[index] = re.sub(r'\s+', ' ', ''.join(parts).strip())
+
+    def close(self):
+        super().close()
+        while self._open:
+            self._finish()
+
+    @property
+    def snippets(self) -> list[str]:
+        return [p for p in self._paragraphs if p]
+
+def parse_tika_stream(chunks: Iterable[str]) -> list[str]:
+    """
+    Splits Tika output into snippets a chunk at a time.
+    """
+    parser = TikaParser()
+    for chunk in chunks:
+        parser.feed(chunk)
+    parser.close()
+    return parser.snippets
+
+def parse_document_spooled(spool: Spool) -> RawDocument:
+    """
+    Extracts a spooled document, streaming it to Tika and parsing the output as it arrives, so neither the PDF nor Tika's output is held in memory whole.
+    """
+    with stage('tika'):
+        snippets = parse_tika_stream(get_tika_client().extract_stream(spool.chunks))
+    return RawDocument(stamp=get_stamp(spool),
+                       snippets=snippets,
+                       hash=spool.hash)
+
+def parse_document(sos_response: Response) -> RawDocument:
+    snippets = parse_tika_html(extract_text(sos_response.content).text)
+    return RawDocument(stamp=get_stamp(sos_response),
+                       snippets=snippets,
+                       hash=get_hash(sos_response))
+
+async def parse_document_async(session: ClientSession, sos_response: Response) -> RawDocument:
+    snippets = parse_tika_html(await extract_text_async(session, sos_response.content))
     return RawDocument(stamp=get_stamp(sos_response),
-                       snippets=snippets)
+                       snippets=snippets,
+                       hash=get_hash(sos_response))
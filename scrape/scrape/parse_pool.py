@@ -0,0 +1,111 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Future
+from tempfile import NamedTemporaryFile
+from requests import Response
+from requests.compat import chardet
+from parse import RawMeeting, RawBody, RawDocument, parse_meeting_page, parse_body_om_page, parse_body_gd_page, parse_body_bm_page, parse_tika_html, parse_tika_stream, configure_parser, get_parser, get_stamp, get_hash
+from download import Spool
+from tika import get_tika_client
+from metrics import timed, stage
+
+# Processes parsing pages and Tika output. Parsing is CPU-bound, so threads parsing at once contend for the GIL; processes use every core.
+PARSE_PROCESSES: int = os.cpu_count() or 1
+# Workers are started by a clean server process rather than forked from this one, since a fork taken while the log, metrics or Tika threads hold a lock would leave the lock held forever in the child
+START_METHOD: str = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+# Characters of streamed Tika output a worker reads at a time
+READ_CHARS: int = 64 * 1024
+
+def decode(content: bytes, encoding: str | None) -> str:
+    """
+    Decodes a response body the way requests' Response.text does, so a page parses the same in a worker process as in the thread that downloaded it.
+
+    :param content: the response body
+    :param encoding: the encoding given by the response headers, if any
+    """
+    if not content:
+        return ''
+    if encoding is None:
+        encoding = chardet.detect(content)['encoding'] if chardet else 'utf-8'
+    try:
+        return str(content, encoding, errors='replace') # type: ignore
+    except (LookupError, TypeError):
+        return str(content, errors='replace')
+
+# The functions below run in worker processes: they take response bodies and return the raw objects, both of which pickle compactly.
+
+def parse_meeting_content(content: bytes, encoding: str | None, stamp: float, hash: str) -> RawMeeting:
+    return parse_meeting_page(decode(content, encoding), stamp, hash)
+
+def parse_body_content(
+        om: tuple[bytes, str | None],
+        gd: tuple[bytes, str | None],
+        bm: tuple[bytes, str | None],
+        stamp: float,
+        hash: str) -> RawBody:
+    return RawBody(stamp=stamp,
+                   om=parse_body_om_page(decode(*om)),
+                   gd=parse_body_gd_page(decode(*gd)),
+                   bm=parse_body_bm_page(decode(*bm)),
+                   hash=hash)
+
+def parse_tika_content(content: bytes, encoding: str | None) -> list[str]:
+    return parse_tika_html(decode(content, encoding))
+
+def parse_tika_file(filename: str) -> list[str]:
+    # newline='' keeps the output as Tika sent it, as Response.text does
+    with open(filename, 'r', encoding='utf-8', newline='') as f:
+        return parse_tika_stream(iter(lambda: f.read(READ_CHARS), ''))
+
+class ParsePool:
+    """
+    Parses meeting pages, body pages and Tika output in a pool of processes. Downloads and Tika requests stay on the calling threads; only the bytes received are sent to the pool. Safe to share between threads.
+    """
+    def __init__(self, processes: int = PARSE_PROCESSES, parser: str | None = None):
+        """
+        :param processes: number of worker processes
+        :param parser: the parser backend of the workers; defaults to that of this process
+        """
+        self.processes: int = processes
+        self._executor = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context(START_METHOD), initializer=configure_parser, initargs=(parser or get_parser(),))
+
+    def submit_meeting(self, response: Response) -> Future:
+        return self._executor.submit(parse_meeting_content, response.content, response.encoding, get_stamp(response), get_hash(response))
+
+    def submit_snippets(self, html: str) -> Future:
+        return self._executor.submit(parse_tika_content, html.encode('utf-8'), 'utf-8')
+
+    @timed('parse_meeting')
+    def parse_meeting(self, response: Response) -> RawMeeting:
+        return self.submit_meeting(response).result()
+
+    @timed('parse_body')
+    def parse_body(self, om_response: Response, gd_response: Response, bm_response: Response) -> RawBody:
+        pages = [(r.content, r.encoding) for r in [om_response, gd_response, bm_response]]
+        return self._executor.submit(parse_body_content, *pages, get_stamp(om_response), get_hash(om_response, gd_response, bm_response)).result()
+
+    def parse_document_spooled(self, spool: Spool) -> RawDocument:
+        """
+        Streams a spooled document to Tika on the calling thread and writes the output to a temporary file, which a worker splits into snippets a chunk at a time. Only the snippets are ever held in memory whole.
+        """
+        # newline='' writes the output as Tika sent it; the file is kept after closing so the worker can read it
+        f = NamedTemporaryFile('w', encoding='utf-8', newline='', suffix='.html', delete=False)
+        try:
+            with f, stage('tika'):
+                for text in get_tika_client().extract_stream(spool.chunks):
+                    f.write(text)
+            snippets = self._executor.submit(parse_tika_file, f.name).result()
+        finally:
+            os.remove(f.name)
+        return RawDocument(stamp=get_stamp(spool),
+                           snippets=snippets,
+                           hash=spool.hash)
+
+    def close(self):
+        self._executor.shutdown()
+
+    def __enter__(self) -> 'ParsePool':
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,171 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Awaitable, Iterable, Any
+from aiohttp import ClientSession, TCPConnector
+from pymongo.database import Database
+from download import download_meeting_async, download_document_async, start_try_count
+from parse import RawDocument, parse_meeting, parse_tika_html, extract_text_async, get_hash, get_stamp
+from parse_pool import ParsePool
+from archive import ResponseArchive
+from discovery import MeetingIds
+from validate import Meeting, validate_meeting, get_document_paths
+from store import store_meeting
+from io_utils import ExistingIds
+from resource_type import ResourceType
+from doc_cache import DocumentCache
+from metrics import stage
+
+# Requests in flight at once. Coroutines waiting on the network are cheap, so this can be far higher than the thread count of the threaded engine.
+IN_FLIGHT: int = 2048
+# Open connections to any one host, e.g. opengov.sos.ri.gov
+CONNECTIONS_PER_HOST: int = 256
+# Documents being extracted by Tika at once
+TIKA_CONCURRENCY: int = 16
+# Threads running blocking pymongo calls, and parsing when there is no parse pool
+DB_WORKERS: int = 32
+
+def build_process_meeting_async(
+        db: Database,
+        session: ClientSession,
+        db_executor: ThreadPoolExecutor,
+        tika_semaphore: asyncio.Semaphore,
+        cache: DocumentCache | None = None,
+        pool: ParsePool | None = None,
+        archive: ResponseArchive | None = None,
+        meeting_ids: MeetingIds | None = None,
+        existing: ExistingIds | None = None) -> Callable[[int], Awaitable[int]]:
+    """
+    Constructs a coroutine function that downloads, parses, validates and stores a meeting, mirroring run.build_process_meeting. Unlike the thread engine, it reads each document into memory rather than spooling it, so memory grows with the documents in flight, and it always stores documents with their meeting, never as pending.
+
+    :param db: the database to store meetings in
+    :param session: the session used for all requests to SOS and Tika
+    :param db_executor: the thread pool that runs blocking database calls, and parsing when there is no pool
+    :param tika_semaphore: bounds the number of concurrent Tika extractions
+    :param cache: if given, documents are read from and added to the cache
+    :param pool: if given, pages and Tika output are parsed in its processes instead of on the database threads
+    :param archive: if given, every page and document downloaded is archived
+    :param meeting_ids: if given, records which ids are live and which are empty
+    :param existing: which meetings are stored; ids it has not prefetched are looked up one at a time
+    """
+    existing = existing or ExistingIds(db, ResourceType.MEETING)
+
+    async def in_thread(func: Callable, *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(db_executor, func, *args)
+
+    async def fetch_document(path: str) -> RawDocument:
+        if cache:
+            cached = await in_thread(cache.get, path)
+            if cached is not None:
+                return cached
+        response = await download_document_async(session, path)
+        if archive:
+            await in_thread(archive.write, response)
+        snippets = await in_thread(cache.get_snippets, get_hash(response)) if cache else None
+        if snippets is not None:
+            document = RawDocument(stamp=get_stamp(response), snippets=snippets, hash=get_hash(response))
+        else:
+            async with tika_semaphore:
+                html = await extract_text_async(session, response.content)
+            snippets = await asyncio.wrap_future(pool.submit_snippets(html)) if pool else await in_thread(parse_tika_html, html)
+            document = RawDocument(stamp=get_stamp(response), snippets=snippets, hash=get_hash(response))
+        if cache:
+            await in_thread(cache.put, path, document, response.content)
+        return document
+
+    async def process_meeting(id: int) -> int:
+        if await in_thread(existing.__contains__, id):
+            if meeting_ids:
+                meeting_ids.mark_live([id])
+            return -1
+        response = await download_meeting_async(session, id)
+        if archive:
+            await in_thread(archive.write, response)
+        with stage('parse_meeting'):
+            # parsing blocks, so without a pool it runs on the database threads rather than the event loop
+            raw = await asyncio.wrap_future(pool.submit_meeting(response)) if pool else await in_thread(parse_meeting, response)
+        if raw.body == '':
+            if meeting_ids:
+                meeting_ids.mark_empty(id)
+            return -1
+        if meeting_ids:
+            meeting_ids.mark_live([id])
+        paths = get_document_paths(raw)
+        rawdocs = await asyncio.gather(*(fetch_document(path) for path in paths))
+        documents: dict[str, RawDocument] = dict(zip(paths, rawdocs))
+        validate: Meeting | None = await in_thread(validate_meeting, db, raw, documents.__getitem__)
+        if validate:
+            await in_thread(store_meeting, db, id, validate)
+            return 0
+        return -1
+    return process_meeting
+
+async def process_all(
+        ids: Iterable[int],
+        process: Callable[[int], Awaitable[Any]],
+        in_flight: int,
+        on_error: Callable[[int, Exception], None],
+        on_done: Callable[[int, Any], None]) -> list:
+    """
+    Runs a coroutine function over every id with at most in_flight ids in progress at once.
+
+    :param ids: unique ids to process
+    :param process: processes a unique resource
+    :param in_flight: maximum number of ids in progress
+    :param on_error: called with the id and exception when processing raises
+    :param on_done: called with the id and result after processing finishes, or None if it fails
+    :return: the results of process in completion order, with None for errors
+    """
+    results: list = []
+    id_iter = iter(ids)
+
+    async def worker():
+        # the event loop is single-threaded, so workers can share the iterator
+        for id in id_iter:
+            result = None
+            # on_error and on_done run in this task, so they can read the tries of the id
+            start_try_count()
+            try:
+                result = await process(id)
+            except Exception as e:
+                on_error(id, e)
+            on_done(id, result)
+            results.append(result)
+
+    await asyncio.gather(*(worker() for _ in range(in_flight)))
+    return results
+
+def run_meetings_async(
+        db: Database,
+        ids: Iterable[int],
+        on_error: Callable[[int, Exception], None],
+        on_done: Callable[[int, Any], None],
+        in_flight: int = IN_FLIGHT,
+        connections_per_host: int = CONNECTIONS_PER_HOST,
+        cache: DocumentCache | None = None,
+        pool: ParsePool | None = None,
+        archive: ResponseArchive | None = None,
+        meeting_ids: MeetingIds | None = None,
+        existing: ExistingIds | None = None) -> list:
+    """
+    Processes meetings on a single event loop. Blocks until every id is processed.
+
+    :param db: the database to store meetings in
+    :param ids: meeting ids to process
+    :param on_error: called with the id and exception when processing raises
+    :param on_done: called with the id and result after processing finishes, or None if it fails
+    :param in_flight: maximum number of meetings in progress
+    :param connections_per_host: maximum open connections to any one host
+    :param cache: if given, documents are read from and added to the cache
+    :param pool: if given, pages and Tika output are parsed in its processes
+    :param archive: if given, every page and document downloaded is archived
+    :param meeting_ids: if given, records which ids are live and which are empty
+    :param existing: which meetings are stored, prefetched for the ids being processed
+    :return: the outcome of each meeting, as returned by run.build_process_meeting
+    """
+    async def run() -> list:
+        connector = TCPConnector(limit=in_flight, limit_per_host=connections_per_host)
+        with ThreadPoolExecutor(max_workers=DB_WORKERS) as db_executor:
+            async with ClientSession(connector=connector) as session:
+                process = build_process_meeting_async(db, session, db_executor, asyncio.Semaphore(TIKA_CONCURRENCY), cache, pool, archive, meeting_ids, existing)
+                return await process_all(ids, process, in_flight, on_error, on_done)
+    return asyncio.run(run())
@@ -0,0 +1,148 @@
+import random
+import asyncio
+import datetime as dt
+from email.utils import parsedate_to_datetime
+from threading import Lock
+from time import monotonic
+from requests import Response, Timeout, ConnectionError
+from aiohttp import ClientConnectionError
+
+# Requests per second to the SOS site. The rate starts at INITIAL_RATE, grows by INCREASE per second of successful requests and is multiplied by DECREASE when the site throttles or cannot be reached.
+INITIAL_RATE: float = 20.0
+MIN_RATE: float = 1.0
+MAX_RATE: float = 500.0
+INCREASE: float = 1.0
+DECREASE: float = 0.5
+# Requests that may be sent at once after an idle period
+BURST: int = 10
+# Requests in flight fail together, so the rate is decreased at most once per interval
+DECREASE_INTERVAL: float = 1.0
+# Retries wait a random time up to wait * 2 ** (try - 1), capped at MAX_BACKOFF seconds
+MAX_BACKOFF: float = 120.0
+
+# Statuses with which the site says it is overloaded; other failures are retried without slowing the crawl
+THROTTLE_STATUSES = [429, 503]
+# Errors reaching the site, which slow the crawl like throttling; other errors, e.g. from writing to disk, do not
+NETWORK_ERRORS = (Timeout, ConnectionError, ClientConnectionError, asyncio.TimeoutError)
+
+def is_throttled(response: Response) -> bool:
+    return response.status_code in THROTTLE_STATUSES
+
+def is_network_error(e: BaseException) -> bool:
+    return isinstance(e, NETWORK_ERRORS)
+
+def get_retry_after(response: Response) -> float | None:
+    """
+    Reads the Retry-After header, which may be a number of seconds or an HTTP date.
+
+    :return: seconds to wait, or None if the header is missing or unreadable
+    """
+    value = response.headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - dt.datetime.now(dt.timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def get_backoff(wait: float, try_count: int, max_backoff: float = MAX_BACKOFF) -> float:
+    """
+    Exponential backoff with full jitter, so retries of requests that failed together do not arrive together.
+    """
+    return random.uniform(0, min(max_backoff, wait * 2 ** (try_count - 1)))
+
+class RateController:
+    """
+    Paces requests with a token bucket whose rate is adjusted by additive increase, multiplicative decrease (AIMD): the rate climbs while the site answers and halves when it throttles, times out or fails. A Retry-After header pauses every request until it passes. Safe to share between threads and coroutines.
+    """
+    def __init__(self,
+                 rate: float = INITIAL_RATE,
+                 min_rate: float = MIN_RATE,
+                 max_rate: float = MAX_RATE,
+                 increase: float = INCREASE,
+                 decrease: float = DECREASE,
+                 burst: int = BURST):
+        self.rate: float = rate
+        self.min_rate: float = min_rate
+        self.max_rate: float = max_rate
+        self.increase: float = increase
+        self.decrease: float = decrease
+        self.burst: int = burst
+        self.successes: int = 0
+        self.throttles: int = 0
+        self.decreases: int = 0
+        self._lock = Lock()
+        self._next: float = monotonic()
+        self._paused_until: float = 0.0
+        self._last_decrease: float = 0.0
+
+    def reserve(self) -> float:
+        """
+        Reserves the next slot to send a request.
+
+        :return: seconds to wait before sending
+        """
+        with self._lock:
+            now = monotonic()
+            # an idle bucket holds at most burst tokens
+            self._next = max(self._next, now - self.burst / self.rate)
+            start = max(self._next, self._paused_until)
+            self._next = start + 1 / self.rate
+            return max(0.0, start - now)
+
+    def on_success(self):
+        with self._lock:
+            self.successes += 1
+            # grows the rate by increase per second's worth of requests
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def on_throttle(self, retry_after: float | None = None):
+        """
+        Records a throttled, failed or timed out request.
+
+        :param retry_after: seconds the site asked us to wait, if any
+        """
+        with self._lock:
+            self.throttles += 1
+            now = monotonic()
+            if retry_after is not None:
+                self._paused_until = max(self._paused_until, now + retry_after)
+            if now - self._last_decrease > DECREASE_INTERVAL:
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self.decreases += 1
+                self._last_decrease = now
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {'rate': round(self.rate, 2),
+                    'successes': self.successes,
+                    'throttles': self.throttles,
+                    'decreases': self.decreases,
+                    'paused_for': round(max(0.0, self._paused_until - monotonic()), 2)}
+
+_controller: RateController | None = None
+_controller_lock = Lock()
+
+def get_rate_controller() -> RateController:
+    """
+    Gets the controller shared by all downloads from the SOS site, building it on first use.
+    """
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                _controller = RateController()
+    return _controller
+
+def configure_rate_controller(rate: float = INITIAL_RATE, max_rate: float = MAX_RATE) -> RateController:
+    """
+    Replaces the shared controller. Call before starting workers.
+    """
+    global _controller
+    with _controller_lock:
+        _controller = RateController(rate=rate, max_rate=max_rate)
+    return _controller
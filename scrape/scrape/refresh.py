@@ -0,0 +1,79 @@
+from typing import Callable
+from pymongo.database import Database
+from requests import Response
+from download import download_meeting, download_body
+from parse import RawDocument, parse_meeting, parse_body, get_hash
+from parse_pool import ParsePool
+from validate import Meeting, Body, validate_meeting, validate_body
+from store import update_meeting, update_body
+from resource_type import ResourceType
+from doc_cache import DocumentCache, build_fetch_document_for
+
+# Incremental refresh of stored resources. Pages and documents are compared by content hash with what is stored, so unchanged meetings cost one page download and unchanged documents skip Tika and all writes.
+
+meetings = ResourceType.MEETING.collection_name()
+bodies = ResourceType.BODY.collection_name()
+docs = ResourceType.DOCUMENT.collection_name()
+
+def build_reuse_documents(db: Database, existing: dict | None) -> Callable[[str, str], RawDocument | None]:
+    """
+    Constructs a lookup for document fetchers that finds a stored document of a meeting by path and content hash, so a document whose content is unchanged is pointed at rather than extracted and written again.
+
+    :param db: the database
+    :param existing: the stored meeting, if any
+    :return: a function of a path and content hash that returns a reference to the stored document, or None if its content changed
+    """
+    stored_docs: dict[str, dict] = {}
+    if existing is not None:
+        for doc in db[docs].find({'_id': {'$in': existing['agendas'] + existing['minutes']}}):
+            if 'path' in doc:
+                stored_docs[doc['path']] = doc
+
+    def reuse(path: str, hash: str) -> RawDocument | None:
+        stored = stored_docs.get(path)
+        if stored and stored.get('hash') == hash:
+            return RawDocument(stamp=stored['stamp'], snippets=[], hash=hash, id=stored['_id'])
+        return None
+    return reuse
+
+def refresh_meeting(db: Database, id: int, cache: DocumentCache | None = None, pool: ParsePool | None = None) -> int:
+    """
+    Re-scrapes a stored meeting and writes only what changed. Documents are fetched as downloads fetch them, spooled to Tika and parsed in the pool, unless their content is unchanged.
+
+    :param db: the database
+    :param id: id of a stored meeting
+    :param cache: if given, documents are read from and added to the cache
+    :param pool: if given, the page and Tika output are parsed in its processes
+    :return: 0 if the meeting changed, -1 if it did not
+    """
+    existing: dict | None = db[meetings].find_one({'_id': id})
+    if existing is None:
+        raise RuntimeError(f'Error: could not find resource of type {ResourceType.MEETING} and id {id}')
+    response: Response = download_meeting(id)
+    if existing.get('hash') == get_hash(response):
+        return -1
+    raw = pool.parse_meeting(response) if pool else parse_meeting(response)
+    get_document = build_fetch_document_for(cache, pool, build_reuse_documents(db, existing))
+    meeting: Meeting | None = validate_meeting(db, raw, get_document)
+    if meeting and update_meeting(db, id, meeting):
+        return 0
+    return -1
+
+def refresh_body(db: Database, id: int) -> int:
+    """
+    Re-scrapes a stored body and writes only what changed.
+
+    :param db: the database
+    :param id: id of a stored body
+    :return: 0 if the body changed, -1 if it did not
+    """
+    existing: dict | None = db[bodies].find_one({'_id': id})
+    if existing is None:
+        raise RuntimeError(f'Error: could not find resource of type {ResourceType.BODY} and id {id}')
+    download = download_body(id)
+    if existing.get('hash') == get_hash(download['om'], download['gd'], download['bm']):
+        return -1
+    body: Body | None = validate_body(parse_body(download['om'], download['gd'], download['bm']))
+    if body and update_body(db, id, body):
+        return 0
+    return -1
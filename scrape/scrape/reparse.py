@@ -0,0 +1,124 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from pymongo.database import Database
+from requests import Response
+from archive import ARCHIVE_DIR, get_segments, read_index, read_record_at
+from parse import RawDocument, parse_meeting, parse_body, parse_document, get_hash, get_stamp
+from validate import Meeting, Body, validate_meeting, validate_body
+from store import update_meeting, update_body
+from refresh import build_reuse_documents
+from resource_type import ResourceType
+from doc_cache import DocumentCache
+
+# Re-parses archived responses without touching the SOS site, so fixes to parse.py and validate.py can be applied to everything downloaded so far.
+
+REPARSE_WORKERS: int = 16
+BODY_PAGES = ['body_om', 'body_gd', 'body_bm']
+
+meetings = ResourceType.MEETING.collection_name()
+
+class ArchiveIndex:
+    """
+    Locations of the latest archived response for every meeting, body page and document, read from the index beside each segment. Responses are read back from disk when needed, so memory does not grow with the size of the archive.
+    """
+    def __init__(self, dir: str = ARCHIVE_DIR):
+        self.locations: dict[str, dict[str, tuple[str, int]]] = {'meeting': {}, 'body_om': {}, 'body_gd': {}, 'body_bm': {}, 'document': {}}
+        for segment in get_segments(dir):
+            for kind, key, offset in read_index(segment):
+                self.locations[kind][key] = (segment, offset)
+
+    def get(self, kind: str, key: str) -> Response:
+        if key not in self.locations[kind]:
+            raise RuntimeError(f'Error: no archived {kind} for {key}.')
+        return read_record_at(*self.locations[kind][key])
+
+    def get_document(self, path: str) -> Response:
+        return self.get('document', path)
+
+    def body_ids(self) -> list[int]:
+        return sorted(int(id) for id in self.locations['body_om'] if all(id in self.locations[page] for page in BODY_PAGES))
+
+    def meeting_ids(self) -> list[int]:
+        return sorted(int(id) for id in self.locations['meeting'])
+
+def reparse_body(db: Database, index: ArchiveIndex, id: int) -> int:
+    om, gd, bm = (index.get(page, str(id)) for page in BODY_PAGES)
+    body: Body | None = validate_body(parse_body(om, gd, bm))
+    if body and update_body(db, id, body):
+        return 0
+    return -1
+
+def build_fetch_archived_document(
+        index: ArchiveIndex,
+        reuse: Callable[[str, str], RawDocument | None],
+        cache: DocumentCache | None = None) -> Callable[[str], RawDocument]:
+    """
+    Constructs a document fetcher for validate_meeting that reads documents from the archive. Stored documents with unchanged content are reused; others are extracted with Tika unless cached.
+
+    :param reuse: looks up a stored document by path and content hash, as built by refresh.build_reuse_documents
+    """
+    def get_document(path: str) -> RawDocument:
+        response = index.get_document(path)
+        hash = get_hash(response)
+        stored = reuse(path, hash)
+        if stored is not None:
+            return stored
+        snippets = cache.get_snippets(hash) if cache else None
+        if snippets is not None:
+            document = RawDocument(stamp=get_stamp(response), snippets=snippets, hash=hash)
+        else:
+            document = parse_document(response)
+        if cache:
+            cache.put(path, document, response.content)
+        return document
+    return get_document
+
+def reparse_meeting(db: Database, index: ArchiveIndex, id: int, cache: DocumentCache | None = None) -> int:
+    """
+    Re-parses the archived page of a meeting and its documents. Stored documents with unchanged content are reused; others are extracted with Tika unless cached.
+
+    :return: 0 if the meeting is new or changed, -1 if not
+    """
+    raw = parse_meeting(index.get('meeting', str(id)))
+    if raw.body == '':
+        return -1
+    existing: dict | None = db[meetings].find_one({'_id': id})
+    get_document = build_fetch_archived_document(index, build_reuse_documents(db, existing), cache)
+    meeting: Meeting | None = validate_meeting(db, raw, get_document)
+    if meeting and update_meeting(db, id, meeting):
+        return 0
+    return -1
+
+def reparse(
+        db: Database,
+        index: ArchiveIndex,
+        on_error: Callable[[str, int, Exception], None],
+        on_done: Callable[[str, int], None],
+        cache: DocumentCache | None = None,
+        workers: int = REPARSE_WORKERS) -> dict[str, int]:
+    """
+    Re-parses every archived body, then every archived meeting, since meetings are validated against stored body names.
+
+    :param db: the database
+    :param index: the archive to replay
+    :param on_error: called with the kind, id and exception when a resource fails
+    :param on_done: called with the kind and id of each resource after it finishes or fails
+    :param cache: if given, documents whose content is cached skip Tika
+    :param workers: number of threads
+    :return: the number of changed resources by kind
+    """
+    def run(kind: str, ids: list[int], process: Callable[[int], int]) -> int:
+        def try_process(id: int) -> int:
+            try:
+                return process(id)
+            except Exception as e:
+                on_error(kind, id, e)
+                return -1
+            finally:
+                on_done(kind, id)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return sum(1 for result in executor.map(try_process, ids) if result == 0)
+
+    return {
+        'body': run('body', index.body_ids(), lambda id: reparse_body(db, index, id)),
+        'meeting': run('meeting', index.meeting_ids(), lambda id: reparse_meeting(db, index, id, cache))}
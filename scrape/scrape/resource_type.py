@@ -62,9 +62,30 @@ class ResourceType(StrEnum):
                         'doctype': DocType,
                         'dt': float,
                         'filer': int,
-                        'snippets': list[int]}
+                        'snippets': list[str]}
             case ResourceType.SNIPPET:
-                return {'content': str}
+                return {'_id': str,
+                        'text': str,
+                        'refs': int}
+
+    def get_db_indexes(self) -> list[tuple[list[tuple[str, int]], dict]]:
+        """
+        :return: the (keys, options) of each index the collection needs besides _id
+        """
+        match(self):
+            case ResourceType.MEETING:
+                return [([('body', 1), ('meeting_dt', -1)], {}),
+                        ([('meeting_dt', -1)], {})]
+            case ResourceType.BODY:
+                return [([('name', 1)], {})]
+            case ResourceType.DOCUMENT:
+                return [([('path', 1)], {}),
+                        # documents written before they recorded their meeting are left out
+                        ([('meeting', 1), ('path', 1)], {'unique': True, 'partialFilterExpression': {'meeting': {'$exists': True}, 'path': {'$exists': True}}}),
+                        ([('pending', 1)], {'partialFilterExpression': {'pending': True}})]
+            case (ResourceType.PERSON
+                  | ResourceType.SNIPPET):
+                return []
 
     def plural(self) -> str:
         match(self):
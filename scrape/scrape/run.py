@@ -4,16 +4,33 @@ import sys
 import traceback
 from concurrent.futures import ThreadPoolExecutor
 from threading import Lock
+from time import perf_counter
 from typing import Callable, Iterator
 from progress.bar import Bar
-from pymongo import MongoClient
 from pymongo.database import Database
-from io_utils import make_dir_if_not_exists_and_check_is_dir, make_log_and_lock, threadsafe_write_if_log, get_database, is_tika_server_healthy, is_mongodb_server_healthy, is_in_db
-from download import download_meeting, download_body
-from parse import parse_meeting, parse_body
-from validate import validate_meeting, validate_body, Meeting, Body
-from store import store_meeting, store_body, delete
-from index import get_meeting_as_indexable, get_body_as_indexable
+from io_utils import make_dir_if_not_exists_and_check_is_dir, get_database, warn_missing_indexes, ensure_indexes, get_index_builds, is_mongodb_server_healthy, is_in_db, ExistingIds
+from download import start_try_count, get_try_count, download_meeting, download_body, download_body_om
+from parse import parse_meeting, parse_body, parse_dashboard_meeting_ids, configure_parser, PARSERS
+from parse_pool import ParsePool, PARSE_PROCESSES
+from validate import validate_meeting, validate_body, pending_document, Meeting, Body
+from store import store_meeting, store_meeting_with_pending, store_body, delete, migrate_snippets
+from index import get_meeting_as_indexable, get_meetings_as_indexable, get_body_as_indexable
+from refresh import refresh_meeting, refresh_body
+from doc_cache import DocumentCache, build_fetch_document_for, MAX_CACHE_BYTES
+from pipeline import run_meetings_async, CONNECTIONS_PER_HOST
+from documents import DocumentWorkers, get_pending_documents, DOCUMENT_WORKERS
+from export import NdjsonWriter, FORMATS, ndjson_extension
+from typesense_index import BatchResult, build_index_meetings, create_collection_if_not_exists, index_batches, IMPORT_BATCH_SIZE, IMPORT_CONCURRENCY
+from session import configure_session, add_response_hook, add_spool_hook, SOS_MAX_CONNECTIONS, TIKA_MAX_CONNECTIONS
+from tika import configure_tika, get_tika_client
+from archive import ResponseArchive
+from discovery import MeetingIds
+from rate_limit import configure_rate_controller, get_rate_controller, INITIAL_RATE, MAX_RATE
+from reparse import ArchiveIndex, reparse
+from checkpoint import Checkpoint, get_outcome, SUCCESS, ERROR
+from metrics import SnapshotWriter, serve_metrics, METRICS_HOST
+from event_log import EventLog
+from constants import SOS_SERVER, TIKA_SERVER
 from resource_type import ResourceType
 
 # Retry default constants are tailored to maximize request efficiency to the RISOS API without overloading it
@@ -25,6 +42,10 @@ MEETING_UPPER_BOUND: int = 1042372
 BODY_LOWER_BOUND: int = 1
 BODY_UPPER_BOUND: int = 8534
 
+# Meetings exported per batch of queries, and batches exported at once
+EXPORT_BATCH_SIZE: int = 500
+EXPORT_WORKERS: int = 8
+
 DATA_DIR = 'data'
 LOGS_DIR = f'{DATA_DIR}/logs'
 OUTPUTS_DIR = f'{DATA_DIR}/outputs'
@@ -36,7 +57,6 @@ def setup_dir():
 
 def setup_before_each():
     setup_dir()
-    assert(is_tika_server_healthy())
     assert(is_mongodb_server_healthy())
 
 def format_test_results(
@@ -57,80 +77,290 @@ def format_test_results(
     f'\ttry distribution:',
     str(''.join(list((f'\t\t{k}:\t{tries[k]}\n' if tries[k] else '' for k in tries.keys()))))]))
 
-def build_process_meeting(db: Database) -> Callable[[int], int]:
-    db_lock = Lock()
+def build_process_meeting(
+        db: Database,
+        update: bool = False,
+        cache: DocumentCache | None = None,
+        documents: DocumentWorkers | None = None,
+        pool: ParsePool | None = None,
+        meeting_ids: MeetingIds | None = None,
+        existing: ExistingIds | None = None) -> Callable[[int], int]:
+    get_document = build_fetch_document_for(cache, pool)
+    existing = existing or ExistingIds(db, ResourceType.MEETING)
     def process_meeting(id: int, overwrite: bool = False) -> int:
         collection: str = ResourceType.MEETING.collection_name()
-        if is_in_db(db, db_lock, collection, id):
+        if id in existing:
+            if meeting_ids:
+                meeting_ids.mark_live([id])
+            if update:
+                return refresh_meeting(db, id, cache, pool)
             if overwrite:
-                with db_lock:
-                    db[collection].delete_one({'_id': id})
+                db[collection].delete_one({'_id': id})
             else:
                 return -1
         download = download_meeting(id)
-        parse = parse_meeting(download)
-        validate: Meeting | None = validate_meeting(db, db_lock, parse)
+        parse = pool.parse_meeting(download) if pool else parse_meeting(download)
+        if meeting_ids:
+            if parse.body == '':
+                meeting_ids.mark_empty(id)
+            else:
+                meeting_ids.mark_live([id])
+        if documents:
+            # store the meeting now and leave its documents to the document workers
+            validate: Meeting | None = validate_meeting(db, parse, pending_document)
+            if validate:
+                for document_id, path in store_meeting_with_pending(db, id, validate):
+                    documents.submit(document_id, path)
+                return 0
+            return -1
+        validate = validate_meeting(db, parse, get_document)
         if validate:
-            store_meeting(db, db_lock, id, validate)
+            store_meeting(db, id, validate)
             return 0
         return -1
     return process_meeting
 
-def build_process_body(db: Database) -> Callable[[int], int]:
-    db_lock = Lock()
+def build_process_body(
+        db: Database,
+        update: bool = False,
+        pool: ParsePool | None = None,
+        meeting_ids: MeetingIds | None = None,
+        existing: ExistingIds | None = None) -> Callable[[int], int]:
+    existing = existing or ExistingIds(db, ResourceType.BODY)
     def process_body(id: int, overwrite: bool = False) -> int:
         collection: str = ResourceType.BODY.collection_name()
-        if is_in_db(db, db_lock, collection, id):
+        if id in existing:
+            if update:
+                return refresh_body(db, id)
             if overwrite:
-                with db_lock:
-                    db[collection].delete_one({'_id': id})
+                db[collection].delete_one({'_id': id})
             else:
                 return -1
         download = download_body(id)
-        parse = parse_body(download['om'], download['gd'], download['bm'])
+        if meeting_ids:
+            meeting_ids.mark_live(parse_dashboard_meeting_ids(download['om'].text))
+        if pool:
+            parse = pool.parse_body(download['om'], download['gd'], download['bm'])
+        else:
+            parse = parse_body(download['om'], download['gd'], download['bm'])
         validate: Body | None = validate_body(parse)
         if validate:
-            store_body(db, db_lock, id, validate)
+            store_body(db, id, validate)
             return 0
         return 1
     return process_body
 
+def build_discover_meetings(meeting_ids: MeetingIds) -> Callable[[int], int]:
+    def discover_meetings(id: int) -> int:
+        found = parse_dashboard_meeting_ids(download_body_om(id).text)
+        meeting_ids.mark_live(found)
+        return len(found)
+    return discover_meetings
+
 def build_export_meeting(db: Database) -> Callable[[int], dict | None]:
-    db_lock = Lock()
     def export_meeting(id: int) -> dict | None:
-        if is_in_db(db, db_lock, ResourceType.MEETING.collection_name(), id):
-            return get_meeting_as_indexable(db, db_lock, id)
+        if is_in_db(db, ResourceType.MEETING.collection_name(), id):
+            return get_meeting_as_indexable(db, id)
         return None
     return export_meeting
 
+def build_export_meetings(db: Database) -> Callable[[range], list[dict]]:
+    def export_meetings(ids: range) -> list[dict]:
+        return get_meetings_as_indexable(db, ids)
+    return export_meetings
+
 def build_export_body(db: Database) -> Callable[[int], dict]:
-    db_lock = Lock()
     def export_body(id: int) -> dict:
-        return get_body_as_indexable(db, db_lock, id)
+        return get_body_as_indexable(db, id)
     return export_body
     
-def build_clean(db: Database, db_lock: Lock, rtype: ResourceType, bar: Bar) -> Callable:
+def build_clean(db: Database, rtype: ResourceType, bar: Bar) -> Callable:
     assert(rtype == ResourceType.BODY)
     collection: str = rtype.collection_name()
     def clean(id: int) -> int:
         bar.next()
-        if is_in_db(db, db_lock, collection, id):
+        if is_in_db(db, collection, id):
             if db[collection].find_one({'_id':id})['name'] == '': #type: ignore
-                return delete(db, db_lock, collection, id)      
+                return delete(db, collection, id)      
         return 0
     return clean
 
+def run_index(db: Database, start: int, count: int, batch_size: int, concurrency: int, log: EventLog):
+    """
+    Exports meetings from the database and imports them straight into Typesense, reporting failed documents per batch.
+    """
+    if create_collection_if_not_exists():
+        print('Created meetings collection.')
+    index_batch = build_index_meetings(db)
+    batches = (range(i, min(i + batch_size, start + count)) for i in range(start, start + count, batch_size))
+    totals = {'imported': 0, 'failed': 0}
+    totals_lock = Lock()
+    with Bar('index', max=count) as bar:
+        def on_batch(result: BatchResult):
+            with totals_lock:
+                totals['imported'] += result.imported
+                totals['failed'] += len(result.failures)
+                bar.next(len(result.ids))
+            if result.failures:
+                log.log(stage='index', outcome='failed', start=result.ids.start, stop=result.ids.stop, imported=result.imported, failures=result.failures)
+        def on_error(batch: range, e: Exception):
+            log.error(e, stage='index', start=batch.start, stop=batch.stop)
+            with totals_lock:
+                bar.next(len(batch))
+        index_batches(batches, index_batch, on_batch, on_error, concurrency)
+    print(f"Imported {totals['imported']} meetings; {totals['failed']} failed.")
+
+def run_reparse(options: dict[str, str]):
+    """
+    Replays the response archive through parse, validate and store, with no requests to SOS.
+    """
+    db = get_database()
+    warn_missing_indexes(db)
+    log = EventLog(LOGS_DIR, 'reparse')
+    cache_size = get_int_option(options, 'cache-size', MAX_CACHE_BYTES // 1024 ** 2)
+    cache = DocumentCache(max_bytes=cache_size * 1024 ** 2) if cache_size > 0 else None
+    print('Indexing archive...')
+    index = ArchiveIndex()
+    bar_lock = Lock()
+    with Bar('reparse', max=len(index.body_ids()) + len(index.meeting_ids())) as bar:
+        def on_error(kind: str, id: int, e: Exception):
+            log.error(e, stage=f'reparse_{kind}', id=id)
+        def on_done(kind: str, id: int):
+            with bar_lock:
+                bar.next()
+        changed = reparse(db, index, on_error, on_done, cache)
+    if cache:
+        cache.close()
+    log.close()
+    print(f"Changed {changed['body']} bodies and {changed['meeting']} meetings.")
+
+def run_migrate():
+    """
+    Creates the indexes every collection needs and reports each one, along with any index builds still in progress, then moves documents stored before snippets were content-addressed onto hashed snippets.
+    """
+    db = get_database()
+    for collection, name, status in ensure_indexes(db):
+        print(f'{collection}.{name}: {status}')
+    builds = get_index_builds(db)
+    for build in builds:
+        print(f"Building {build['ns']}: {build['msg']} {json.dumps(build['progress'])}")
+    print(f'{len(builds)} index builds in progress.')
+    migrated, deleted = migrate_snippets(db)
+    print(f'Moved {migrated} documents onto content-addressed snippets, deleting {deleted} old snippets.')
+
+ENGINES = ['thread', 'async']
+# options that take no value
+FLAGS = ['update', 'no-archive', 'discovered-only', 'resume']
+
 def print_help():
-    print('\nUsage:\n\tpython3 run.py [download|export] [meeting|body] [start_id: int] [count: int]\n')
+    print('\nUsage:\n\tpython3 run.py [download|export] [meeting|body] [start_id: int] [count: int] [--engine thread|async] [--connections int] [--format json|ndjson|ndjson.gz] [--update] [--cache-size megabytes] [--document-workers int] [--parser lxml|bs4] [--processes int] [--no-archive] [--rate int] [--max-rate int] [--discovered-only] [--resume] [--metrics-port int] [--metrics-host address] [--tika url,...]')
+    print('\t\t--engine async only downloads meetings. It holds each document in memory while extracting it, stores documents with their meeting, and does not support --update or --document-workers.')
+    print('\tpython3 run.py discover meeting [start_body_id: int] [count: int] [--resume]')
+    print('\tpython3 run.py reparse [--cache-size megabytes]')
+    print('\tpython3 run.py migrate')
+    print('\tpython3 run.py index meeting [start_id: int] [count: int] [--batch-size int] [--concurrency int]\n')
+
+def get_int_option(options: dict[str, str], name: str, default: int) -> int:
+    if name not in options:
+        return default
+    try:
+        return int(options[name])
+    except ValueError:
+        print(f"Error: {name} must be a parseable integer.")
+        print_help()
+        exit(1)
+
+def parse_options(args: list[str]) -> tuple[list[str], dict[str, str]]:
+    """
+    Separates '--name value' options and '--flag' flags from positional arguments. Flags are given the value 'true'.
+
+    :param args: command line arguments
+    :return: (positional arguments, options by name)
+    """
+    positional: list[str] = []
+    options: dict[str, str] = {}
+    i = 0
+    while i < len(args):
+        if args[i][2:] in FLAGS:
+            options[args[i][2:]] = 'true'
+            i += 1
+        elif args[i].startswith('--'):
+            if i + 1 >= len(args):
+                print(f"Error: option '{args[i]}' requires a value.")
+                print_help()
+                exit(1)
+            options[args[i][2:]] = args[i+1]
+            i += 2
+        else:
+            positional.append(args[i])
+            i += 1
+    return positional, options
 
 def main(args):
     setup_before_each()
+    args, options = parse_options(args)
+    engine: str = options.get('engine', 'thread')
+    if engine not in ENGINES:
+        print(f'Error: engine \'{engine}\' not recognized.')
+        print_help()
+        exit(1)
+    if engine == 'async' and args[1:3] != ['download', 'meeting']:
+        print('Error: the async engine only supports \'download meeting\'.')
+        print_help()
+        exit(1)
+    if engine == 'async' and 'document-workers' in options:
+        print('Error: the async engine stores documents with their meeting and has no document workers.')
+        print_help()
+        exit(1)
+    update: bool = 'update' in options
+    if update and (args[1:2] != ['download'] or engine != 'thread'):
+        print('Error: --update only applies to downloads with the thread engine.')
+        print_help()
+        exit(1)
+    resume: bool = 'resume' in options
+    if resume and args[1:2] not in [['download'], ['discover']]:
+        print('Error: --resume only applies to downloads and discovery.')
+        print_help()
+        exit(1)
+    output_format: str = options.get('format', 'json')
+    if output_format not in FORMATS:
+        print(f'Error: format \'{output_format}\' not recognized.')
+        print_help()
+        exit(1)
+    if output_format != 'json' and args[1:2] != ['export']:
+        print('Error: only exports can be written as ndjson.')
+        print_help()
+        exit(1)
+    parser: str = options.get('parser', 'lxml')
+    if parser not in PARSERS:
+        print(f'Error: parser \'{parser}\' not recognized.')
+        print_help()
+        exit(1)
+    configure_parser(parser)
+    connections: int | None = None
+    if 'connections' in options:
+        connections = get_int_option(options, 'connections', CONNECTIONS_PER_HOST)
+    # documents are extracted by every Tika server given, e.g. --tika http://10.0.0.2:9998,http://10.0.0.3:9998
+    tika_servers: list[str] = options['tika'].split(',') if 'tika' in options else [TIKA_SERVER]
+    if connections or 'tika' in options:
+        configure_session({SOS_SERVER: connections or SOS_MAX_CONNECTIONS, **{server: TIKA_MAX_CONNECTIONS for server in tika_servers}})
+    if 'tika' in options:
+        configure_tika(tika_servers)
+    if 'rate' in options or 'max-rate' in options:
+        configure_rate_controller(get_int_option(options, 'rate', int(INITIAL_RATE)), get_int_option(options, 'max-rate', int(MAX_RATE)))
+    if args[1:] == ['reparse']:
+        run_reparse(options)
+        return
+    if args[1:] == ['migrate']:
+        run_migrate()
+        return
     arg_count = len(args)
     if arg_count != 5:
         print("Error: incorrect number of arguments.")
         print_help()
         exit(1)
     command: str
+    batched: bool = False
     match (args[1]):
         case 'download':
             match (args[2]):
@@ -147,7 +377,24 @@ def main(args):
                 case 'body':
                     func_builder = build_export_body
                 case 'meeting':
-                    func_builder = build_export_meeting
+                    func_builder = build_export_meetings
+                    batched = True
+                case default:
+                    print(f'Error: resource \'{default}\' not recognized.')
+                    print_help()
+                    exit(1)
+        case 'discover':
+            match (args[2]):
+                case 'meeting':
+                    func_builder = build_discover_meetings
+                case default:
+                    print(f'Error: resource \'{default}\' not recognized.')
+                    print_help()
+                    exit(1)
+        case 'index':
+            match (args[2]):
+                case 'meeting':
+                    func_builder = build_index_meetings
                 case default:
                     print(f'Error: resource \'{default}\' not recognized.')
                     print_help()
@@ -164,10 +411,71 @@ def main(args):
         print("Error: arguments must be parseable integers.")
         print_help()
         exit(1)
+    if args[1] == 'download':
+        # only downloads extract documents, so only they need Tika; the client is built and checked here, before any worker uses it
+        tika = get_tika_client()
+        tika.probe()
+        assert(tika.is_healthy())
     db = get_database()
-    func = func_builder(db)
+    warn_missing_indexes(db)
+    log = EventLog(LOGS_DIR, f'{args[1]}_{args[2]}')
+    if args[1] == 'index':
+        batch_size = get_int_option(options, 'batch-size', IMPORT_BATCH_SIZE)
+        concurrency = get_int_option(options, 'concurrency', IMPORT_CONCURRENCY)
+        run_index(db, start, count, batch_size, concurrency, log)
+        log.close()
+        return
+    # metrics are snapshotted to the logs, and served to Prometheus if --metrics-port is given
+    metrics_writer = SnapshotWriter(f'{LOGS_DIR}/{args[1]}_{args[2]}_metrics.json')
+    if 'metrics-port' in options:
+        serve_metrics(get_int_option(options, 'metrics-port', 0), options.get('metrics-host', METRICS_HOST))
+    # documents are cached unless --cache-size is 0
+    cache_size = get_int_option(options, 'cache-size', MAX_CACHE_BYTES // 1024 ** 2)
+    cache: DocumentCache | None = None
+    if cache_size > 0 and args[1:3] == ['download', 'meeting']:
+        cache = DocumentCache(max_bytes=cache_size * 1024 ** 2)
+    # every page and document downloaded from SOS is archived unless --no-archive is given
+    archive: ResponseArchive | None = None
+    if args[1] == 'download' and 'no-archive' not in options:
+        archive = ResponseArchive()
+        add_response_hook(archive.hook)
+        add_spool_hook(archive.write_spool)
+    # pages and documents are parsed in worker processes unless --processes is 0
+    pool: ParsePool | None = None
+    if args[1] == 'download':
+        processes = get_int_option(options, 'processes', PARSE_PROCESSES)
+        if processes > 0:
+            pool = ParsePool(processes)
+    # documents are downloaded by their own workers unless --document-workers is 0
+    documents: DocumentWorkers | None = None
+    if engine == 'thread' and args[1:3] == ['download', 'meeting']:
+        document_workers = get_int_option(options, 'document-workers', DOCUMENT_WORKERS)
+        if document_workers > 0:
+            def on_document_error(id, path: str, e: Exception):
+                log.error(e, stage='document', id=str(id), path=path)
+            documents = DocumentWorkers(db, build_fetch_document_for(cache, pool), document_workers, on_document_error)
+    # known meeting ids are learned from downloads and body dashboards, and empty ids are skipped
+    meeting_ids: MeetingIds | None = None
+    discovered_only: bool = 'discovered-only' in options
+    if args[1] in ['download', 'discover']:
+        meeting_ids = MeetingIds()
+    # the outcome of every id is logged, so an interrupted run can be resumed with --resume
+    checkpoint: Checkpoint | None = None
+    if args[1] in ['download', 'discover']:
+        checkpoint = Checkpoint(f'{args[1]}_{args[2]}')
+    # which ids are already stored is fetched once per chunk instead of once per id
+    existing: ExistingIds | None = None
+    if args[1] == 'download':
+        existing = ExistingIds(db, ResourceType(args[2]))
+    if args[1:3] == ['download', 'meeting']:
+        func = func_builder(db, update=update, cache=cache, documents=documents, pool=pool, meeting_ids=meeting_ids, existing=existing)
+    elif args[1:3] == ['download', 'body']:
+        func = func_builder(db, update=update, pool=pool, meeting_ids=meeting_ids, existing=existing)
+    elif args[1] == 'discover':
+        func = func_builder(meeting_ids)
+    else:
+        func = func_builder(db)
     bar_lock = Lock()
-    log_and_lock = make_log_and_lock(LOGS_DIR, f'{args[1]}_{args[2]}')
     chunk_number = 0
     chunk_size = 50000
     chunk_start = start
@@ -176,25 +484,119 @@ def main(args):
     while (count_copy > 0):
         chunk_count += 1
         count_copy -= chunk_size
+    # ndjson exports are streamed to one file as results complete instead of being collected per chunk
+    writer: NdjsonWriter | None = None
+    if output_format != 'json':
+        extension = ndjson_extension(output_format == 'ndjson.gz')
+        writer = NdjsonWriter(f'{OUTPUTS_DIR}/output_{dt.datetime.utcnow()}.{extension}', compress=output_format == 'ndjson.gz')
     with Bar(args[1], max=count) as bar, Bar("chunks", max=chunk_count) as chunk_bar:
+        stage = f'{args[1]}_{args[2]}'
+        def record_outcome(i: int, result, elapsed: float | None = None):
+            # discovery returns a count of ids found, not an outcome
+            outcome = get_outcome(result) if args[1] == 'download' else SUCCESS
+            if checkpoint:
+                checkpoint.record(i, outcome, tries=get_try_count())
+            if args[1] != 'export':
+                log.log(id=i, stage=stage, outcome=outcome, tries=get_try_count(), elapsed=elapsed)
+        def record_error(i: int, e: Exception, elapsed: float | None = None):
+            log.error(e, id=i, stage=stage, tries=get_try_count(), elapsed=elapsed)
+            if checkpoint:
+                checkpoint.record(i, ERROR, str(e), get_try_count())
         def try_process(i: int) -> int | dict | None:
             result = None
+            before = perf_counter()
+            start_try_count()
             try:
                 result = func(i)
+                record_outcome(i, result, perf_counter() - before)
             except Exception as e:
-                threadsafe_write_if_log(f'{i}: Exception {e}', log_and_lock, True)
+                record_error(i, e, perf_counter() - before)
             with bar_lock:
                 bar.next()
+            if writer and result is not None:
+                writer.write(result)
+                return None
             return result
+        def try_process_batch(ids: range) -> list:
+            result = []
+            try:
+                result = func(ids)
+            except Exception as e:
+                log.error(e, stage=stage, start=ids.start, stop=ids.stop)
+            with bar_lock:
+                bar.next(len(ids))
+            if writer:
+                for d in result:
+                    writer.write(d)
+                return []
+            return result
+        def on_error(i: int, e: Exception):
+            record_error(i, e)
+        def on_done(i: int, result):
+            if result is not None:
+                record_outcome(i, result)
+            bar.next()
         while chunk_start < start + count:
             chunk_end = min(chunk_start + chunk_size, start + count)
-            with ThreadPoolExecutor(max_workers=64) as executor:
-                results = list(filter(lambda x : x is not None, executor.map(try_process, range(chunk_start, chunk_end).__iter__())))
-            with open(f'{OUTPUTS_DIR}/output_{chunk_number}_{dt.datetime.utcnow()}.json', 'w') as output:
-                output.write(json.dumps(results))
+            chunk_ids: list[int] | range = range(chunk_start, chunk_end)
+            if meeting_ids and args[1:3] == ['download', 'meeting']:
+                chunk_ids = meeting_ids.select(chunk_ids, discovered_only)
+            if checkpoint and resume:
+                # completed ids are skipped without querying MongoDB; failed ids are retried
+                chunk_ids = checkpoint.select(chunk_ids)
+            with bar_lock:
+                bar.next(chunk_end - chunk_start - len(chunk_ids))
+            if existing:
+                existing.prefetch(chunk_start, chunk_end)
+            if engine == 'async':
+                results = list(filter(lambda x : x is not None, run_meetings_async(db, chunk_ids, on_error, on_done, connections_per_host=connections or CONNECTIONS_PER_HOST, cache=cache, pool=pool, archive=archive, meeting_ids=meeting_ids, existing=existing)))
+            elif batched:
+                batches = [range(i, min(i + EXPORT_BATCH_SIZE, chunk_end)) for i in range(chunk_start, chunk_end, EXPORT_BATCH_SIZE)]
+                with ThreadPoolExecutor(max_workers=EXPORT_WORKERS) as executor:
+                    results = [d for batch in executor.map(try_process_batch, batches) for d in batch]
+            else:
+                with ThreadPoolExecutor(max_workers=64) as executor:
+                    results = list(filter(lambda x : x is not None, executor.map(try_process, chunk_ids.__iter__())))
+            if not writer:
+                with open(f'{OUTPUTS_DIR}/output_{chunk_number}_{dt.datetime.utcnow()}.json', 'w') as output:
+                    output.write(json.dumps(results))
             chunk_start = chunk_end
             chunk_number += 1
             chunk_bar.next()
+            if meeting_ids:
+                meeting_ids.save()
+            if checkpoint:
+                checkpoint.flush()
+            if args[1] == 'download':
+                log.log(stage='chunk', chunk=chunk_number, rate_controller=get_rate_controller().snapshot())
+    if checkpoint:
+        print(f'Checkpoint {checkpoint.filename}: {json.dumps(checkpoint.counts())}')
+        checkpoint.close()
+    if writer:
+        writer.close()
+        print(f'Wrote {writer.count} objects to {writer.filename}.')
+    if documents:
+        documents.wait()
+        # retry documents still pending, e.g. left by an interrupted run
+        pending = get_pending_documents(db)
+        print(f'Retrying {len(pending)} pending documents.')
+        for id, path in pending:
+            documents.submit(id, path)
+        documents.close()
+        print(f'Filled {documents.filled} documents; {documents.failed} failed.')
+    if cache:
+        cache.close()
+    if pool:
+        pool.close()
+    if archive:
+        archive.close()
+        print(f'Archived {archive.count} responses.')
+    if args[1] == 'download':
+        print(f'Rate controller: {json.dumps(get_rate_controller().snapshot())}')
+    metrics_writer.close()
+    print(f'Wrote metrics to {metrics_writer.filename}.')
+    log.close()
+    print(f'Wrote log to {log.filename}.')
 
 
 # def main(args):
@@ -0,0 +1,84 @@
+from threading import Lock
+from typing import Callable
+from requests import Session
+from requests.adapters import HTTPAdapter
+from constants import SOS_SERVER, TIKA_SERVER
+
+# Maximum open connections per host. Threads wait for a free connection instead of opening extra, unpooled ones.
+SOS_MAX_CONNECTIONS: int = 64
+TIKA_MAX_CONNECTIONS: int = 16
+DEFAULT_MAX_CONNECTIONS: int = 10
+
+HEADERS: dict[str, str] = {'Accept-Encoding': 'gzip, deflate',
+                           'Connection': 'keep-alive'}
+
+def build_session(host_limits: dict[str, int] | None = None, default_limit: int = DEFAULT_MAX_CONNECTIONS) -> Session:
+    """
+    Builds a session that keeps connections alive and pools them per host. The session's connection pools are thread-safe, so one session can be shared by every worker.
+
+    :param host_limits: maximum open connections by url prefix, e.g. {'https://opengov.sos.ri.gov': 64}
+    :param default_limit: maximum open connections to any other host
+    """
+    if host_limits is None:
+        host_limits = {SOS_SERVER: SOS_MAX_CONNECTIONS, TIKA_SERVER: TIKA_MAX_CONNECTIONS}
+    session = Session()
+    session.headers.update(HEADERS)
+    for prefix in ['http://', 'https://']:
+        session.mount(prefix, HTTPAdapter(pool_maxsize=default_limit, pool_block=True))
+    for prefix, limit in host_limits.items():
+        session.mount(prefix, HTTPAdapter(pool_connections=1, pool_maxsize=limit, pool_block=True))
+    return session
+
+_session: Session | None = None
+_session_lock = Lock()
+# called with every response of the shared session, including sessions built by configure_session
+_response_hooks: list[Callable] = []
+# called with the spooled body of every streamed download, since response hooks run before a streamed body is read
+_spool_hooks: list[Callable] = []
+
+def get_session() -> Session:
+    """
+    Gets the session shared by all fetchers, building it on first use.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = build_session()
+                _session.hooks['response'].extend(_response_hooks)
+    return _session
+
+def configure_session(host_limits: dict[str, int] | None = None, default_limit: int = DEFAULT_MAX_CONNECTIONS) -> Session:
+    """
+    Replaces the shared session with one using the given connection limits. Call before starting workers.
+
+    :param host_limits: maximum open connections by url prefix
+    :param default_limit: maximum open connections to any other host
+    """
+    global _session
+    session = build_session(host_limits, default_limit)
+    session.hooks['response'].extend(_response_hooks)
+    with _session_lock:
+        old, _session = _session, session
+    if old is not None:
+        old.close()
+    return session
+
+def add_response_hook(hook: Callable):
+    """
+    Adds a requests response hook to the shared session, e.g. to archive responses.
+    """
+    with _session_lock:
+        _response_hooks.append(hook)
+        if _session is not None:
+            _session.hooks['response'].append(hook)
+
+def add_spool_hook(hook: Callable):
+    """
+    Adds a hook called with the Spool of every streamed download, e.g. to archive documents without reading them into memory.
+    """
+    with _session_lock:
+        _spool_hooks.append(hook)
+
+def get_spool_hooks() -> list[Callable]:
+    return _spool_hooks
@@ -0,0 +1,179 @@
+import random
+from glob import glob
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from os.path import dirname, join, isdir
+from threading import Thread, Lock
+from time import sleep
+from urllib.parse import urlsplit, parse_qs
+from requests import Session, PreparedRequest
+from requests.adapters import HTTPAdapter
+from constants import SOS_SERVER, TIKA_SERVER
+
+# A local stand-in for the SOS site and Tika that serves recorded pages and PDFs, for benchmarks that must not touch the real site.
+
+# Holds the recorded pages/ and pdfs/; the tests directory of a source checkout by default
+FIXTURES_DIR = join(dirname(__file__), '..', 'tests')
+MEETING_PAGES = ['1009540.html',
+                 '1037938.html',
+                 'https:%2F%2Fopengov%2Esos%2Eri%2Egov%2FOpenMeetingsPublic%2FViewMeetingDetailByID?MeetingID=1041874.html',
+                 'mock_cancelled_meeting.html']
+BODY_PAGES = {'OpenMeetingDashboard': 'https:%2F%2Fopengov%2Esos%2Eri%2Egov%2FOpenMeetingsPublic%2FOpenMeetingDashboard?subtopmenuId=201&EntityID=3570&MeetingID=0.html',
+              'GovDirectory': 'https:%2F%2Fopengov%2Esos%2Eri%2Egov%2FOpenMeetingsPublic%2FGovDirectory?subtopmenuId=202&EntityID=3570&MeetingID=0.html',
+              'BoardMembers': 'https:%2F%2Fopengov%2Esos%2Eri%2Egov%2FOpenMeetingsPublic%2FBoardMembers?subtopmenuId=203&EntityID=3570&MeetingID=0.html'}
+# Paragraphs in the stub Tika output for each document
+TIKA_PARAGRAPHS: int = 200
+
+def read_fixture(filename: str) -> bytes:
+    with open(filename, 'rb') as f:
+        return f.read()
+
+def build_tika_html(paragraphs: int = TIKA_PARAGRAPHS) -> bytes:
+    body = ''.join(f'<p>Item {i}. The board will discuss and vote on matter {i} of the agenda.</p>\n' for i in range(paragraphs))
+    return f'<html><head><title>stub</title></head><body>{body}</body></html>'.encode('utf-8')
+
+class StandInServer:
+    """
+    Serves recorded meeting, body and PDF fixtures at the SOS site's paths, and a stub Tika endpoint, from a thread. Meeting ids are mapped onto the recorded meetings round robin, and every document path onto one of the recorded PDFs.
+
+    :param latency: seconds to wait before each SOS response
+    :param error_rate: fraction of SOS requests answered with 503
+    :param tika_latency: seconds to wait before each Tika response
+    :param tika_error_rate: fraction of Tika requests answered with 503
+    :param fixtures_dir: the directory holding the recorded pages/ and pdfs/
+    """
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, tika_latency: float = 0.0, seed: int = 0, tika_error_rate: float = 0.0, fixtures_dir: str = FIXTURES_DIR):
+        if not isdir(join(fixtures_dir, 'pages')) or not isdir(join(fixtures_dir, 'pdfs')):
+            raise RuntimeError(f"Error: '{fixtures_dir}' has no pages/ and pdfs/ fixtures; pass the tests directory of a source checkout.")
+        self.latency: float = latency
+        self.error_rate: float = error_rate
+        self.tika_latency: float = tika_latency
+        self.tika_error_rate: float = tika_error_rate
+        pages_dir = join(fixtures_dir, 'pages')
+        self.meetings: list[bytes] = [read_fixture(join(pages_dir, page)) for page in MEETING_PAGES]
+        self.bodies: dict[str, bytes] = {path: read_fixture(join(pages_dir, page)) for path, page in BODY_PAGES.items()}
+        self.pdfs: list[bytes] = [read_fixture(pdf) for pdf in sorted(glob(join(fixtures_dir, 'pdfs', '*.pdf')))]
+        self.tika_html: bytes = build_tika_html()
+        self.requests: int = 0
+        self.errors: int = 0
+        # bytes of each document uploaded to the stub Tika endpoint
+        self.uploaded: list[int] = []
+        self._random = random.Random(seed)
+        self._lock = Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._build_handler())
+        self._server.daemon_threads = True
+        self._thread = Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'StandInServer':
+        self._thread.start()
+        return self
+
+    def close(self):
+        # shutdown waits for serve_forever, so it must only be called once the server is running
+        if self._thread.is_alive():
+            self._server.shutdown()
+            self._thread.join()
+        self._server.server_close()
+
+    def __enter__(self) -> 'StandInServer':
+        return self.start()
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get_sos(self, path: str, query: dict[str, list[str]]) -> tuple[int, str, bytes]:
+        """
+        :return: (status, content type, body) of the fixture for an SOS path
+        """
+        name = path.rsplit('/', 1)[-1]
+        if name == 'ViewMeetingDetailByID':
+            id = int(query.get('MeetingID', ['0'])[0])
+            return 200, 'text/html; charset=utf-8', self.meetings[id % len(self.meetings)]
+        if name in self.bodies:
+            return 200, 'text/html; charset=utf-8', self.bodies[name]
+        if name == 'DownloadMeetingFiles':
+            filepath = query.get('FilePath', [''])[0]
+            return 200, 'application/pdf', self.pdfs[sum(filepath.encode()) % len(self.pdfs)]
+        return 404, 'text/plain', b'not found'
+
+    def _build_handler(self) -> type:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def respond(self, status: int, content_type: str, body: bytes):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                if url.path in ['', '/']:
+                    # Tika's health check
+                    self.respond(200, 'text/plain', b'stand-in')
+                    return
+                with server._lock:
+                    server.requests += 1
+                    failed = server._random.random() < server.error_rate
+                    server.errors += failed
+                sleep(server.latency)
+                if failed:
+                    self.respond(503, 'text/plain', b'unavailable')
+                    return
+                self.respond(*server.get_sos(url.path, parse_qs(url.query)))
+
+            def read_body(self) -> bytes:
+                if self.headers.get('Transfer-Encoding', '').lower() != 'chunked':
+                    return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                # streamed uploads arrive in chunks, each preceded by its size in hex, until one of size 0
+                chunks: list[bytes] = []
+                while size := int(self.rfile.readline().split(b';')[0], 16):
+                    chunks.append(self.rfile.read(size))
+                    self.rfile.readline()
+                # the last chunk is followed by optional trailers and a blank line
+                while self.rfile.readline() not in [b'\r\n', b'\n', b'']:
+                    pass
+                return b''.join(chunks)
+
+            def do_PUT(self):
+                server.uploaded.append(len(self.read_body()))
+                with server._lock:
+                    failed = server._random.random() < server.tika_error_rate
+                sleep(server.tika_latency)
+                if failed:
+                    self.respond(503, 'text/plain', b'unavailable')
+                    return
+                self.respond(200, 'text/html; charset=utf-8', server.tika_html)
+
+        return Handler
+
+class RedirectAdapter(HTTPAdapter):
+    """
+    Sends requests for one url prefix to another, e.g. from the SOS site to a stand-in server.
+    """
+    def __init__(self, prefix: str, target: str, **kwargs):
+        super().__init__(**kwargs)
+        self.prefix: str = prefix
+        self.target: str = target
+
+    def send(self, request: PreparedRequest, **kwargs):
+        if request.url and request.url.startswith(self.prefix):
+            request.url = self.target + request.url[len(self.prefix):]
+        return super().send(request, **kwargs)
+
+def redirect_session(session: Session, target: str, pool_maxsize: int = 64):
+    """
+    Sends a session's requests for the SOS site and Tika to a stand-in server.
+    """
+    for prefix in [SOS_SERVER, TIKA_SERVER]:
+        session.mount(prefix, RedirectAdapter(prefix, target, pool_maxsize=pool_maxsize, pool_block=True))
@@ -1,23 +1,56 @@
-from threading import Lock
+import re
+import hashlib
+import unicodedata
+from collections import Counter
+from bson import ObjectId
+from pymongo import InsertOne, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
 from pymongo.database import Database
 from pymongo.collection import Collection
 from resource_type import ResourceType
 from validate import Meeting, Body, Document
+from parse import RawDocument
+from metrics import timed
 
-def insert(db: Database, db_lock: Lock, collection: str, object: dict) -> int:
-    with db_lock:
-        return db[collection].insert_one(object).inserted_id
+# MongoClient is thread-safe and pooled, so writes are not serialized. Meetings and bodies are unique by _id and are upserted; a meeting's documents are unique by meeting and path, and a document stored again replaces the row for its path, and rows a stored meeting no longer points at are deleted. Snippets are content-addressed: each is keyed by the hash of its text and counts the documents referencing it, so boilerplate repeated across agendas is stored once.
 
-def delete(db: Database, db_lock: Lock, collection: str, id: int) -> int:
-    with db_lock:
-        return db[collection].delete_one({'_id':id}).deleted_count
+# Documents rewritten per batch when migrating to content-addressed snippets
+MIGRATE_BATCH_SIZE: int = 1000
+# Code of the error raised when an insert violates a unique index
+DUPLICATE_KEY: int = 11000
+
+@timed('store')
+def insert(db: Database, collection: str, object: dict) -> int:
+    return db[collection].insert_one(object).inserted_id
+
+@timed('store')
+def upsert(db: Database, collection: str, object: dict) -> int:
+    db[collection].replace_one({'_id': object['_id']}, object, upsert=True)
+    return object['_id']
+
+@timed('store')
+def write_many(db: Database, collection: str, operations: list) -> None:
+    """
+    Sends inserts, replaces and updates to a collection in one unordered bulk write.
+    """
+    if not operations:
+        return
+    db[collection].bulk_write(operations, ordered=False)
+
+def delete(db: Database, collection: str, id: int) -> int:
+    return db[collection].delete_one({'_id':id}).deleted_count
 
 meetings = ResourceType.MEETING.collection_name()
 bodies = ResourceType.BODY.collection_name()
 docs = ResourceType.DOCUMENT.collection_name()
 snips = ResourceType.SNIPPET.collection_name()
 
-def store_meeting(db: Database, db_lock: Lock, id: int, meeting: Meeting) -> int:
+def build_meeting(id: int, meeting: Meeting) -> tuple[dict, list[dict], list[dict]]:
+    """
+    Builds the database entries for a meeting and its new documents and snippets. Documents that are already stored keep their ids.
+
+    :return: (meeting, documents, snippets)
+    """
     d: dict = {}
     d['_id'] = id
     d['stamp'] = meeting.stamp
@@ -25,14 +58,21 @@ def store_meeting(db: Database, db_lock: Lock, id: int, meeting: Meeting) -> int
     d['meeting_dt'] = meeting.meeting_dt
     d['meeting_address'] = meeting.meeting_address
     d['filing_dt'] = meeting.filing_dt
-    agendas: list[int] = []
-    for doc in meeting.agendas:
-        agendas.append(store_document(db, db_lock, doc))
-    d['agendas'] = agendas
-    minutes: list[int] = []
-    for doc in meeting.minutes:
-        minutes.append(store_document(db, db_lock, doc))
-    d['minutes'] = minutes
+    # documents and snippets are built with pre-allocated ids and written in one batch per collection
+    documents: list[dict] = []
+    snippets: list[dict] = []
+    for field, meeting_docs in [('agendas', meeting.agendas), ('minutes', meeting.minutes)]:
+        ids: list[ObjectId] = []
+        for doc in meeting_docs:
+            if doc.id is not None:
+                ids.append(doc.id)
+                continue
+            document, document_snippets = build_document(doc)
+            document['meeting'] = id
+            documents.append(document)
+            snippets.extend(document_snippets)
+            ids.append(document['_id'])
+        d[field] = ids
 
     if meeting.contact_name:
         d['contact_name'] = meeting.contact_name
@@ -62,9 +102,135 @@ def store_meeting(db: Database, db_lock: Lock, id: int, meeting: Meeting) -> int
         d['is_cancelled'] = True
         d['cancelled_dt'] = meeting.cancelled_dt
         d['cancelled_reason'] = meeting.cancelled_reason
-    return insert(db, db_lock, meetings, d)
+    if meeting.hash:
+        d['hash'] = meeting.hash
+    return d, documents, snippets
+
+def normalize_snippet(text: str) -> str:
+    return re.sub(r'\s+', ' ', unicodedata.normalize('NFC', text)).strip()
+
+def build_snippet(text: str) -> dict:
+    """
+    Builds the database entry for a snippet, whose id is the sha256 of its normalized text, so the same text in any document has the same id.
+    """
+    text = normalize_snippet(text)
+    return {'_id': hashlib.sha256(text.encode('utf-8')).hexdigest(), 'text': text}
+
+@timed('store')
+def add_snippets(db: Database, snippets: list[dict], count_refs: bool = True) -> int:
+    """
+    Stores each new snippet once and adds every reference to a snippet, new or stored, to its refs. An upsert racing another for the same _id is retried by the server, so workers can add the same snippet at once.
+
+    :param snippets: snippets built by build_snippet, once per reference
+    :param count_refs: if False, only the texts are stored, for a write that counts its references with add_refs once it succeeds
+    :return: number of snippets that were new
+    """
+    if not snippets:
+        return 0
+    counts = Counter(snippet['_id'] for snippet in snippets)
+    texts = {snippet['_id']: snippet['text'] for snippet in snippets}
+    operations = [UpdateOne({'_id': id}, {'$setOnInsert': {'text': texts[id]}, '$inc': {'refs': count if count_refs else 0}}, upsert=True)
+                  for id, count in counts.items()]
+    return db[snips].bulk_write(operations, ordered=False).upserted_count
+
+@timed('store')
+def add_refs(db: Database, ids: list[str]):
+    """
+    Adds a reference to a stored snippet for each id.
+    """
+    if not ids:
+        return
+    db[snips].bulk_write([UpdateOne({'_id': id}, {'$inc': {'refs': count}}) for id, count in Counter(ids).items()], ordered=False)
+
+@timed('store')
+def release_snippets(db: Database, ids: list[str]) -> int:
+    """
+    Removes one reference to a snippet for each id, e.g. of a deleted document, and deletes the snippets no longer referenced.
+
+    :return: number of snippets deleted
+    """
+    if not ids:
+        return 0
+    counts = Counter(ids)
+    db[snips].bulk_write([UpdateOne({'_id': id}, {'$inc': {'refs': -count}}) for id, count in counts.items()], ordered=False)
+    return db[snips].delete_many({'_id': {'$in': list(counts)}, 'refs': {'$lte': 0}}).deleted_count
+
+def write_documents(db: Database, meeting: int, documents: list[dict]) -> dict[ObjectId, ObjectId]:
+    """
+    Writes a meeting's new documents in one bulk write. A document whose path is already stored for the meeting replaces that row under its _id, and the snippet references of the replaced row are released; the rest are inserted. Add the documents' snippets first, so snippets shared by the old and new rows are never released to zero.
+
+    :return: the id each document was written under, by the id it was built with
+    """
+    ids = {document['_id']: document['_id'] for document in documents}
+    paths = [document['path'] for document in documents if 'path' in document]
+    stored = {row['path']: row for row in db[docs].find({'meeting': meeting, 'path': {'$in': paths}}, {'path': 1, 'snippets': 1})} if paths else {}
+    # one operation per document, in the same order, so a write error's index is that of its document
+    operations: list[InsertOne | ReplaceOne] = []
+    released: list[str] = []
+    for document in documents:
+        row = stored.get(document.get('path'))
+        if row is None:
+            operations.append(InsertOne(document))
+            continue
+        ids[document['_id']] = document['_id'] = row['_id']
+        operations.append(ReplaceOne({'_id': row['_id']}, document, upsert=True))
+        # snippets stored before they were content-addressed are not counted
+        released.extend(id for id in row.get('snippets', []) if isinstance(id, str))
+    try:
+        write_many(db, docs, operations)
+    except BulkWriteError as e:
+        # another worker stored the same meeting first; its rows are replaced instead
+        errors = e.details.get('writeErrors', [])
+        if any(error['code'] != DUPLICATE_KEY for error in errors):
+            raise
+        rewritten = write_documents(db, meeting, [documents[error['index']] for error in errors])
+        ids.update({id: rewritten.get(written, written) for id, written in ids.items()})
+    release_snippets(db, released)
+    return ids
+
+def point_at(d: dict, ids: dict[ObjectId, ObjectId]):
+    """
+    Points a meeting's agendas and minutes at the ids its documents were written under.
+    """
+    for field in ['agendas', 'minutes']:
+        d[field] = [ids.get(document, document) for document in d[field]]
+
+def delete_unreferenced_documents(db: Database, d: dict) -> int:
+    """
+    Deletes a meeting's document rows that it no longer points at, e.g. a document without a path, which cannot be matched to its row when stored again, and releases their snippet references. Each row's references are released only by the worker whose delete lands.
+
+    :param d: the stored meeting
+    :return: number of rows deleted
+    """
+    deleted = 0
+    for row in db[docs].find({'meeting': d['_id'], '_id': {'$nin': d['agendas'] + d['minutes']}}, {'snippets': 1}):
+        if db[docs].delete_one({'_id': row['_id']}).deleted_count == 1:
+            release_snippets(db, [id for id in row.get('snippets', []) if isinstance(id, str)])
+            deleted += 1
+    return deleted
 
-def store_body(db: Database, db_lock: Lock, id: int, body: Body) -> int:
+def write_meeting(db: Database, d: dict, documents: list[dict], snippets: list[dict]) -> int:
+    # insert the meeting last so a stored meeting always has its documents and snippets
+    add_snippets(db, snippets)
+    point_at(d, write_documents(db, d['_id'], documents))
+    id = upsert(db, meetings, d)
+    delete_unreferenced_documents(db, d)
+    return id
+
+def store_meeting(db: Database, id: int, meeting: Meeting) -> int:
+    return write_meeting(db, *build_meeting(id, meeting))
+
+def store_meeting_with_pending(db: Database, id: int, meeting: Meeting) -> list[tuple[ObjectId, str]]:
+    """
+    Stores a meeting whose documents may be pending.
+
+    :return: (id, path) of each pending document, to be filled in by fill_pending_document
+    """
+    d, documents, snippets = build_meeting(id, meeting)
+    write_meeting(db, d, documents, snippets)
+    return [(document['_id'], document['path']) for document in documents if document.get('pending')]
+
+def build_body(id: int, body: Body) -> dict:
     d: dict = {}
     d['_id'] = id
     d['stamp'] = body.stamp
@@ -96,10 +262,22 @@ def store_body(db: Database, db_lock: Lock, id: int, body: Body) -> int:
     if body.authority:
         d['authority'] = body.authority
     d['board_members'] = body.board_members
-    return insert(db, db_lock, bodies, d)
+    if body.hash:
+        d['hash'] = body.hash
+    return d
+
+def store_body(db: Database, id: int, body: Body) -> int:
+    return upsert(db, bodies, build_body(id, body))
 
-def store_document(db: Database, db_lock: Lock, doc: Document) -> int:
+def build_document(doc: Document) -> tuple[dict, list[dict]]:
+    """
+    Builds the database entries for a document and its snippets. The document's id is allocated before insertion so its meeting can reference it; its snippets are referenced by their hashes.
+
+    :param doc: the document to build
+    :return: (document, snippets), with one snippet per reference
+    """
     d: dict = {}
+    d['_id'] = ObjectId()
     d['stamp'] = doc.stamp
     if doc.name:
         d['name'] = doc.name
@@ -109,14 +287,119 @@ def store_document(db: Database, db_lock: Lock, doc: Document) -> int:
         d['filer'] = doc.filer
     if doc.path:
         d['path'] = doc.path
-    snippets: list[int] = []
-    for snippet in doc.snippets:
-        snippets.append(insert_snippet(db, db_lock, snippet))
-    d['snippets'] = snippets
-    return insert(db, db_lock, docs, d)
-
-def insert_snippet(db: Database, db_lock: Lock, snippet: str) -> int:
-    return insert(db, db_lock, snips, {'text': snippet})
+    if doc.hash:
+        d['hash'] = doc.hash
+    if doc.pending:
+        d['pending'] = True
+    snippets: list[dict] = [build_snippet(snippet) for snippet in doc.snippets]
+    d['snippets'] = [snippet['_id'] for snippet in snippets]
+    return d, snippets
+
+def store_document(db: Database, doc: Document) -> ObjectId:
+    d, snippets = build_document(doc)
+    add_snippets(db, snippets)
+    return insert(db, docs, d)
+
+def fill_pending_document(db: Database, id: ObjectId, document: RawDocument) -> bool:
+    """
+    Fills in the snippets of a document stored as pending.
+
+    :param db: the database
+    :param id: id of the pending document
+    :param document: the downloaded document
+    :return: if the document was still pending
+    """
+    snippets: list[dict] = [build_snippet(snippet) for snippet in document.snippets]
+    # the texts are stored before the document points at them, but counted only by the worker whose fill lands, so a retried or raced fill counts them once
+    add_snippets(db, snippets, count_refs=False)
+    d: dict = {'stamp': document.stamp, 'snippets': [snippet['_id'] for snippet in snippets]}
+    if document.hash:
+        d['hash'] = document.hash
+    result = db[docs].update_one({'_id': id, 'pending': True}, {'$set': d, '$unset': {'pending': ''}})
+    if result.modified_count != 1:
+        return False
+    add_refs(db, d['snippets'])
+    return True
+
+def insert_snippet(db: Database, snippet: str) -> str:
+    built = build_snippet(snippet)
+    add_snippets(db, [built])
+    return built['_id']
+
+def migrate_snippets(db: Database, batch_size: int = MIGRATE_BATCH_SIZE) -> tuple[int, int]:
+    """
+    Rewrites documents stored before snippets were content-addressed: their snippets are added by hash, the documents are pointed at the hashes, and the old snippets are deleted. Safe to interrupt and run again, though a batch interrupted after adding its snippets counts their references twice.
+
+    :return: (documents migrated, old snippets deleted)
+    """
+    migrated = deleted = 0
+    # old snippets have ObjectIds; hashes are strings
+    query = {'snippets.0': {'$type': 'objectId'}}
+    while batch := list(db[docs].find(query, {'snippets': 1}).limit(batch_size)):
+        old_ids = [id for document in batch for id in document['snippets']]
+        texts = {snippet['_id']: snippet['text'] for snippet in db[snips].find({'_id': {'$in': old_ids}})}
+        snippets: list[dict] = []
+        updates: list[UpdateOne] = []
+        for document in batch:
+            # a snippet lost from an interrupted write cannot be recovered, and is dropped
+            built = [build_snippet(texts[id]) for id in document['snippets'] if id in texts]
+            snippets.extend(built)
+            updates.append(UpdateOne({'_id': document['_id']}, {'$set': {'snippets': [snippet['_id'] for snippet in built]}}))
+        add_snippets(db, snippets)
+        db[docs].bulk_write(updates, ordered=False)
+        deleted += db[snips].delete_many({'_id': {'$in': old_ids}}).deleted_count
+        migrated += len(batch)
+    return migrated, deleted
+
+def normalize(value):
+    """
+    Converts tuples to lists, as they are when read back from the database, so new and stored values compare equal.
+    """
+    if isinstance(value, (tuple, list)):
+        return [normalize(v) for v in value]
+    if isinstance(value, dict):
+        return {k: normalize(v) for k, v in value.items()}
+    return value
+
+def update(db: Database, rtype: ResourceType, new: dict) -> bool:
+    """
+    Writes only the fields of a resource that changed. The previous values of changed and removed fields, with the id and stamp of the stored version, are recorded in the resource type's changes collection.
+
+    :param db: the database
+    :param rtype: an updateable resource type
+    :param new: the complete new database entry, including _id
+    :return: if anything changed
+    """
+    if not rtype.is_updateable():
+        raise RuntimeError(f'Error: cannot update {str(rtype)}. Only updateable ResourceTypes can be updated.')
+    collection = rtype.collection_name()
+    existing: dict | None = db[collection].find_one({'_id': new['_id']})
+    if existing is None:
+        upsert(db, collection, new)
+        return True
+    missing = object()
+    changed = {k: v for k, v in new.items() if k != 'stamp' and normalize(v) != existing.get(k, missing)}
+    removed = [k for k in existing if k not in new]
+    if not changed and not removed:
+        return False
+    changes: dict = {k: existing[k] for k in list(changed) + removed if k in existing}
+    changes['id'] = existing['_id']
+    changes['stamp'] = existing.get('stamp')
+    insert(db, rtype.changes_collection_name(), changes)
+    operations: dict = {'$set': changed | {'stamp': new['stamp']}}
+    if removed:
+        operations['$unset'] = {k: '' for k in removed}
+    db[collection].update_one({'_id': new['_id']}, operations)
+    return True
+
+def update_meeting(db: Database, id: int, meeting: Meeting) -> bool:
+    d, documents, snippets = build_meeting(id, meeting)
+    add_snippets(db, snippets)
+    point_at(d, write_documents(db, id, documents))
+    return update(db, ResourceType.MEETING, d)
+
+def update_body(db: Database, id: int, body: Body) -> bool:
+    return update(db, ResourceType.BODY, build_body(id, body))
 
 def get_collection(self, db: Database) -> Collection:
     return db[self.collection_name()]
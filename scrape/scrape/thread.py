@@ -1,4 +1,3 @@
-from io import TextIOWrapper
 import datetime as dt
 from typing import Tuple, Iterator, Callable, Any
 import threading
@@ -9,7 +8,7 @@ from progress.bar import Bar
 import traceback
 from sqlite3 import Connection
 
-from io_utils import threadsafe_write_if_log, add_event
+from event_log import EventLog
 
 # def build_scrape_resource_into_database(
 #         get_resource: Callable[[int], Iterator[Any]],
@@ -23,7 +22,7 @@ def build_download_unique_resource(
     try_count: int,
     try_pause: float,
     bar_and_lock: Tuple[Bar, threading.Lock] | None = None,
-    log_and_lock: Tuple[TextIOWrapper, threading.Lock] | None = None,
+    log: EventLog | None = None,
     verbose: bool = False,
     resource_name:str = 'resource'
     ) -> Callable[[int], Tuple[int, int, int]]:
@@ -36,7 +35,7 @@ def build_download_unique_resource(
     :param generate_filename: geneartes filename from unique identifier
     :param try_count: how many times to try downloading each resource
     :param wait_secs_before_retry: after failure, seconds to wait before retry
-    :param log_and_lock: the file and thread lock on it to write the log to
+    :param log: the log to write each download's events to
     :param verbose: if true, also writes non-error downloads to log.
     :param resource_name: short name of the resource type, e.g. 'meeting'
     :return: a function that downloads a resource
@@ -53,19 +52,18 @@ def build_download_unique_resource(
         """
         # Setup
         count: int = 0
-        log_header = f'\nDownload report for {resource_name} {id}:\n'
-        running_log: str = ''
-        def before_return(is_error: bool):
-            if verbose or is_error:
-                threadsafe_write_if_log(log_header + running_log, log_and_lock)
+        start = dt.datetime.utcnow().timestamp()
+        events: list[str] = []
+        def before_return(outcome: str):
+            if log and (verbose or outcome == 'error'):
+                log.log(id=id, stage=f'download_{resource_name}', outcome=outcome, tries=count, elapsed=dt.datetime.utcnow().timestamp() - start, events=events)
             if bar_and_lock:
                 with bar_and_lock[1]:
                     bar_and_lock[0].next()
         
         # Check if resource was already downloaded
         if is_duplicate(id):
-            running_log = add_event(f"{resource_name} {id} is duplicate.", running_log)
-            before_return(is_error=False)
+            before_return('duplicate')
             return (id, 1, count)
         # Request resource
         while count < try_count:
@@ -76,29 +74,29 @@ def build_download_unique_resource(
                 elapsed = dt.datetime.utcnow().timestamp() - before
                 # Download was successful
                 if is_response_success(response):
-                    running_log = add_event(f"Request #{count} successful in {elapsed} seconds.", running_log)
+                    events.append(f"Request #{count} successful in {elapsed} seconds.")
                     # Write to file was successful
                     try:
                         filename: str = write_to_file(id, response)
-                        running_log = add_event(f"{resource_name} successfully written to {filename}.", running_log)
-                        before_return(is_error=False)
+                        events.append(f"{resource_name} successfully written to {filename}.")
+                        before_return('success')
                         return (id, 0, count)
                     # Write to file was not successful
                     except Exception as e:
-                        running_log = add_event(f"Downloaded {resource_name} but could not create file due to {str(type(e))}.", running_log)
-                        before_return(is_error=True)
+                        events.append(f"Downloaded {resource_name} but could not create file due to {str(type(e))}.")
+                        before_return('error')
                         return (id, 2, count)
                 # Download was not successful, retry
-                running_log = add_event(f"Request #{count} was not successful in {elapsed} seconds. Retrying...", running_log)
+                events.append(f"Request #{count} was not successful in {elapsed} seconds. Retrying...")
             # Download was not successful, retry
             except Exception as e:
-                running_log = add_event(f"Request #{count} raised {str(type(e))}. Retrying...", running_log)
+                events.append(f"Request #{count} raised {str(type(e))}. Retrying...")
             # Wait before retrying download
             sleep(try_pause)
 
         # Download was not successful after exhausting try_count
-        running_log = add_event(f"Could not complete request after {count} tries.", running_log)
-        before_return(is_error=True)
+        events.append(f"Could not complete request after {count} tries.")
+        before_return('error')
         return (id, 2, count)
         
     return download_unique_resource
@@ -122,7 +120,7 @@ def build_process_unique_resource(
     process_resource: Callable[[int, Connection], None],
     db_connection: Connection,
     bar: Bar | None,
-    log: TextIOWrapper | None,
+    log: EventLog | None,
     verbose: bool = False,
     resource_name:str = 'resource'
     ) -> Callable[[int], Tuple[int, int]]:
@@ -132,7 +130,7 @@ def build_process_unique_resource(
     :param get_local_resource: gets local resource with unique identifier
     :param is_duplicate: if resource was already processed
     :param process_resource: processes the resource
-    :param log_and_lock: the file and thread lock on it to write the log to
+    :param log: the log to write each resource's outcome to
     :param verbose: if true, also writes non-error downloads to log.
     :param resource_name: short name of the resource type, e.g. 'meeting'
     """
@@ -145,28 +143,24 @@ def build_process_unique_resource(
                     id: id of resource
                     outcome: 0=success, 1=duplicate, 2=error
         """
-        log_header = f'\nDownload report for {resource_name} {id}:\n'
-        running_log: str = ''
-
-        def before_return(is_error: bool):
-            if log and (verbose or is_error):
-                log.write(log_header + running_log)
+        def before_return(outcome: str, e: Exception | None = None):
+            if log and e:
+                log.error(e, id=id, stage=f'process_{resource_name}')
+            elif log:
+                log.log(id=id, stage=f'process_{resource_name}', outcome=outcome)
             if bar:
                 bar.next()
 
         # Check if resource was already processed
         if is_duplicate(id, db_connection):
-            running_log = add_event(f"{resource_name} {id} is duplicate.", running_log)
-            before_return(True)
+            before_return('duplicate')
             return (id, 1)
         try:
             process_resource(id, db_connection)
         except Exception as e:
-            running_log = add_event(f"Error processing {resource_name} {id}: exception {str(type(e))} occurred:", running_log)
-            before_return(True)
+            before_return('error', e)
             return(id, 2)
-        running_log = add_event(f"{resource_name} {id} processed.", running_log)
-        before_return(True)
+        before_return('success')
         return (id, 0)
     return process_unique_resource
 
@@ -175,7 +169,7 @@ def threaded_action_by_id(
     ids: Iterator[int],
     action: Callable[[int], int],
     max_workers: int,
-    log_and_lock: Tuple[TextIOWrapper, threading.Lock] | None = None
+    log: EventLog | None = None
     ) -> Iterator[int]:
     """
     Processes resources in a multi-threaded way
@@ -183,7 +177,7 @@ def threaded_action_by_id(
     :param ids: unique ids to process
     :param process_resource: processes a unique resource
     :param max_workers: maximum number of threads to use
-    :param log_and_lock: the file and thread lock on it to write the log to
+    :param log: the log to write exceptions to
     :return: 
     """
     print(f'Threading...')
@@ -192,8 +186,6 @@ def threaded_action_by_id(
             return executor.map(action, ids)
         except Exception as e:
             traceback.print_exc()
-            if log_and_lock is not None:
-                with log_and_lock[1]:
-                    log_and_lock[0].write(f"Exception {str(type(e))}:\n")
-                    traceback.print_exc(file=log_and_lock[0])
+            if log is not None:
+                log.error(e, stage='threaded_action_by_id')
             raise e
\ No newline at end of file
@@ -0,0 +1,212 @@
+import asyncio
+from threading import Lock, Thread, Event
+from typing import Callable, Iterable, Iterator
+from aiohttp import ClientSession, ClientError
+from requests import Response, RequestException
+from constants import TIKA_SERVER
+from session import get_session
+from io_utils import is_http_success
+from metrics import get_registry
+
+# Client for one or more Tika servers. Requests go to the healthy server with the fewest requests outstanding, and fail over to the next when a server errors. Health is probed in the background, so extraction never waits on a health check.
+
+# Seconds between health probes of every server
+HEALTH_INTERVAL: float = 10.0
+PROBE_TIMEOUT: float = 5.0
+# Seconds to wait for Tika to extract a document
+EXTRACT_TIMEOUT: float = 300.0
+# Bytes of streamed output read at a time
+OUTPUT_CHUNK_BYTES: int = 64 * 1024
+
+class TikaServer:
+    def __init__(self, url: str):
+        self.url: str = url.rstrip('/')
+        self.endpoint: str = f'{self.url}/tika'
+        self.healthy: bool = True
+        self.outstanding: int = 0
+        self.requests: int = 0
+        self.failures: int = 0
+        self.gauge = get_registry().gauge('scrape_tika_outstanding', 'Requests in progress on each Tika server', server=self.url)
+
+class TikaClient:
+    """
+    Spreads extractions across Tika servers by least outstanding requests. Servers are taken to be healthy until probed. A server that fails is marked unhealthy and skipped until a probe finds it healthy again. Safe to share between threads and coroutines.
+
+    :param urls: base urls of the Tika servers, e.g. ['http://127.0.0.1:9998']
+    :param health_interval: seconds between health probes, starting with one as soon as the client is built, or 0 to not probe in the background
+    """
+    def __init__(self, urls: list[str] = [TIKA_SERVER], health_interval: float = HEALTH_INTERVAL):
+        if not urls:
+            raise RuntimeError('At least one Tika server is required.')
+        self.servers: list[TikaServer] = [TikaServer(url) for url in urls]
+        self._lock = Lock()
+        # rotates which server wins ties, so idle servers share the load
+        self._next: int = 0
+        self._stop = Event()
+        self._thread: Thread | None = None
+        if health_interval > 0:
+            self._thread = Thread(target=self._run, args=(health_interval,), daemon=True)
+            self._thread.start()
+
+    def probe(self):
+        for server in self.servers:
+            try:
+                healthy = is_http_success(get_session().get(server.url, timeout=PROBE_TIMEOUT))
+            except RequestException:
+                healthy = False
+            server.healthy = healthy
+
+    def _run(self, interval: float):
+        # the first probe runs here rather than in __init__, so building a client never waits on the servers
+        self.probe()
+        while not self._stop.wait(interval):
+            self.probe()
+
+    def is_healthy(self) -> bool:
+        """
+        :return: if any server passed its last probe; no request is made
+        """
+        return any(server.healthy for server in self.servers)
+
+    def acquire(self, tried: list[TikaServer]) -> TikaServer | None:
+        """
+        Chooses the healthy server with the fewest outstanding requests that has not been tried, or any untried server if none are healthy, and counts a request on it.
+        """
+        with self._lock:
+            candidates = [server for server in self.servers if server not in tried]
+            if not candidates:
+                return None
+            healthy = [server for server in candidates if server.healthy] or candidates
+            start = self._next % len(healthy)
+            self._next += 1
+            server = min(healthy[start:] + healthy[:start], key=lambda s: s.outstanding)
+            server.outstanding += 1
+            server.requests += 1
+        server.gauge.inc()
+        return server
+
+    def release(self, server: TikaServer, failed: bool):
+        with self._lock:
+            server.outstanding -= 1
+            if failed:
+                server.failures += 1
+                server.healthy = False
+        server.gauge.dec()
+
+    def extract(self, content: bytes, content_type: str = 'application/pdf', output_format: str = 'text/html') -> Response:
+        """
+        Extracts a document, trying each server at most once.
+        """
+        headers = {'Content-type': content_type, 'Accept': output_format}
+        tried: list[TikaServer] = []
+        errors: list[str] = []
+        while (server := self.acquire(tried)) is not None:
+            tried.append(server)
+            failed = True
+            try:
+                response = get_session().put(server.endpoint, data=content, headers=headers, timeout=EXTRACT_TIMEOUT)
+                # a 422 means the document is unreadable, which no other server will fix
+                failed = response.status_code >= 500
+                if not failed and not is_http_success(response):
+                    raise RuntimeError(f'Tika at {server.url} responded with status {response.status_code}.')
+                if not failed:
+                    return response
+                errors.append(f'{server.url}: status {response.status_code}')
+            except RequestException as e:
+                errors.append(f'{server.url}: {e}')
+            finally:
+                self.release(server, failed)
+        raise RuntimeError(f"Every Tika server failed: {'; '.join(errors)}")
+
+    def extract_stream(self, open_body: Callable[[], Iterable[bytes]], content_type: str = 'application/pdf', output_format: str = 'text/html') -> Iterator[str]:
+        """
+        Extracts a document without holding it or its output in memory: the document is sent with chunked encoding as open_body yields it, and the output is yielded as text as it arrives. open_body is called again for each server tried, so a request that fails before any output is replayed on the next server; one that fails after output has been yielded raises, since that output cannot be taken back.
+
+        :param open_body: starts a new pass over the document's bytes
+        """
+        headers = {'Content-type': content_type, 'Accept': output_format}
+        tried: list[TikaServer] = []
+        errors: list[str] = []
+        while (server := self.acquire(tried)) is not None:
+            tried.append(server)
+            failed = True
+            started = False
+            try:
+                with get_session().put(server.endpoint, data=open_body(), headers=headers, timeout=EXTRACT_TIMEOUT, stream=True) as response:
+                    failed = response.status_code >= 500
+                    if not failed and not is_http_success(response):
+                        raise RuntimeError(f'Tika at {server.url} responded with status {response.status_code}.')
+                    if not failed:
+                        # Tika names its charset; without one, requests would guess from the whole body
+                        response.encoding = response.encoding or 'utf-8'
+                        for text in response.iter_content(OUTPUT_CHUNK_BYTES, decode_unicode=True):
+                            started = True
+                            yield text
+                        return
+                    errors.append(f'{server.url}: status {response.status_code}')
+            except RequestException as e:
+                failed = True
+                if started:
+                    raise RuntimeError(f'Tika at {server.url} failed partway through its output: {e}') from e
+                errors.append(f'{server.url}: {e}')
+            finally:
+                self.release(server, failed)
+        raise RuntimeError(f"Every Tika server failed: {'; '.join(errors)}")
+
+    async def extract_async(self, session: ClientSession, content: bytes, content_type: str = 'application/pdf', output_format: str = 'text/html') -> str:
+        headers = {'Content-type': content_type, 'Accept': output_format}
+        tried: list[TikaServer] = []
+        errors: list[str] = []
+        while (server := self.acquire(tried)) is not None:
+            tried.append(server)
+            failed = True
+            try:
+                async with session.put(server.endpoint, data=content, headers=headers) as response:
+                    failed = response.status >= 500
+                    if not failed and (response.status < 200 or response.status > 299):
+                        raise RuntimeError(f'Tika at {server.url} responded with status {response.status}.')
+                    if not failed:
+                        return await response.text()
+                    errors.append(f'{server.url}: status {response.status}')
+            except (ClientError, asyncio.TimeoutError) as e:
+                # a hung server times out without a ClientError, and is failed over like any other
+                errors.append(f'{server.url}: {type(e).__name__} {e}')
+            finally:
+                self.release(server, failed)
+        raise RuntimeError(f"Every Tika server failed: {'; '.join(errors)}")
+
+    def snapshot(self) -> list[dict]:
+        with self._lock:
+            return [{'url': server.url, 'healthy': server.healthy, 'outstanding': server.outstanding, 'requests': server.requests, 'failures': server.failures}
+                    for server in self.servers]
+
+    def close(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+_client: TikaClient | None = None
+_client_lock = Lock()
+
+def get_tika_client() -> TikaClient:
+    """
+    Gets the client shared by all extractions, building it for the default server on first use.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = TikaClient()
+    return _client
+
+def configure_tika(urls: list[str], health_interval: float = HEALTH_INTERVAL) -> TikaClient:
+    """
+    Replaces the shared client with one for the given servers. Call before starting workers.
+    """
+    global _client
+    client = TikaClient(urls, health_interval)
+    with _client_lock:
+        old, _client = _client, client
+    if old is not None:
+        old.close()
+    return client
@@ -0,0 +1,146 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, Future
+from threading import BoundedSemaphore
+from typing import Callable, Iterable
+from pymongo.database import Database
+from requests import Response
+from constants import TYPESENSE_SERVER
+from io_utils import is_http_success
+from index import get_meetings_as_indexable
+from session import get_session
+
+MEETINGS_COLLECTION = 'meetings'
+# Documents sent per import request
+IMPORT_BATCH_SIZE: int = 100
+# Import requests in flight at once
+IMPORT_CONCURRENCY: int = 4
+IMPORT_ACTION = 'upsert'
+
+# Mirrors meetingsCreateSchema in typesense/src/add_documents.ts
+MEETINGS_SCHEMA: dict = {
+    'name': MEETINGS_COLLECTION,
+    'fields': [
+        {'name': 'body', 'type': 'string', 'facet': True},
+        {'name': 'meeting_dt', 'type': 'int64', 'facet': True},
+        {'name': 'address', 'type': 'string', 'facet': False},
+        {'name': 'filing_dt', 'type': 'int64', 'facet': False},
+        {'name': 'is_emergency', 'type': 'bool', 'facet': False},
+        {'name': 'is_annual_calendar', 'type': 'bool', 'facet': False},
+        {'name': 'is_public_notice', 'type': 'bool', 'facet': False},
+        {'name': 'is_cancelled', 'type': 'bool', 'facet': False},
+        {'name': 'cancelled_dt', 'type': 'int64', 'facet': False, 'optional': True},
+        {'name': 'cancelled_reason', 'type': 'string', 'facet': False, 'optional': True},
+        {'name': 'latestAgenda', 'type': 'string[]', 'facet': False, 'optional': True},
+        {'name': 'latestAgendaLink', 'type': 'string', 'facet': False, 'optional': True},
+        {'name': 'latestMinutes', 'type': 'string[]', 'facet': False, 'optional': True},
+        {'name': 'latestMinutesLink', 'type': 'string', 'facet': False, 'optional': True},
+        {'name': 'contactPerson', 'type': 'string', 'facet': False, 'optional': True},
+        {'name': 'contactEmail', 'type': 'string', 'facet': False, 'optional': True},
+        {'name': 'contactPhone', 'type': 'string', 'facet': False, 'optional': True}]}
+
+class BatchResult:
+    def __init__(self,
+                 ids: range,
+                 imported: int,
+                 failures: list[tuple[str, str]]):
+        self.ids: range = ids
+        self.imported: int = imported
+        self.failures: list[tuple[str, str]] = failures
+
+def get_api_key() -> str:
+    if 'TYPESENSE_API_KEY' not in os.environ:
+        raise RuntimeError('TYPESENSE_API_KEY is not set.')
+    return os.environ['TYPESENSE_API_KEY']
+
+def get_headers(api_key: str) -> dict[str, str]:
+    return {'X-TYPESENSE-API-KEY': api_key}
+
+def create_collection_if_not_exists(schema: dict = MEETINGS_SCHEMA, server: str = TYPESENSE_SERVER, api_key: str | None = None) -> bool:
+    """
+    Creates a Typesense collection unless it already exists.
+
+    :return: if the collection was created
+    """
+    headers = get_headers(api_key or get_api_key())
+    r: Response = get_session().get(f"{server}/collections/{schema['name']}", headers=headers)
+    if is_http_success(r):
+        return False
+    if r.status_code != 404:
+        raise RuntimeError(f"Could not retrieve collection {schema['name']}: {r.status_code} {r.text}")
+    r = get_session().post(f'{server}/collections', json=schema, headers=headers)
+    if not is_http_success(r):
+        raise RuntimeError(f"Could not create collection {schema['name']}: {r.status_code} {r.text}")
+    return True
+
+def import_documents(
+        documents: list[dict],
+        collection: str = MEETINGS_COLLECTION,
+        server: str = TYPESENSE_SERVER,
+        api_key: str | None = None,
+        action: str = IMPORT_ACTION) -> list[tuple[str, str]]:
+    """
+    Imports documents into a Typesense collection with one request to its /documents/import endpoint.
+
+    :param documents: the documents to import
+    :param collection: the collection to import into
+    :param server: the Typesense server
+    :param api_key: the Typesense API key; read from TYPESENSE_API_KEY if None
+    :param action: the import action, e.g. 'create', 'upsert'
+    :return: (id, error) of every document that failed to import
+    """
+    if not documents:
+        return []
+    body = ''.join(json.dumps(document) + '\n' for document in documents).encode('utf-8')
+    headers = get_headers(api_key or get_api_key())
+    headers['Content-Type'] = 'text/plain'
+    r: Response = get_session().post(f'{server}/collections/{collection}/documents/import',
+                                     params={'action': action}, data=body, headers=headers)
+    if not is_http_success(r):
+        raise RuntimeError(f'Import into {collection} failed: {r.status_code} {r.text}')
+    # the response has one JSON line per document, in the order sent
+    responses = [json.loads(line) for line in r.text.splitlines() if line]
+    return [(document.get('id', ''), response.get('error', ''))
+            for document, response in zip(documents, responses) if not response.get('success')]
+
+def build_index_meetings(
+        db: Database,
+        server: str = TYPESENSE_SERVER,
+        api_key: str | None = None) -> Callable[[range], BatchResult]:
+    api_key = api_key or get_api_key()
+    def index_meetings(ids: range) -> BatchResult:
+        documents = get_meetings_as_indexable(db, ids)
+        failures = import_documents(documents, server=server, api_key=api_key)
+        return BatchResult(ids, len(documents) - len(failures), failures)
+    return index_meetings
+
+def index_batches(
+        batches: Iterable[range],
+        index_batch: Callable[[range], BatchResult],
+        on_batch: Callable[[BatchResult], None],
+        on_error: Callable[[range, Exception], None],
+        concurrency: int = IMPORT_CONCURRENCY):
+    """
+    Indexes batches on a thread pool. At most twice concurrency batches are exported and waiting at once, so a slow Typesense server holds back reading from the database instead of letting batches pile up in memory.
+
+    :param batches: the id ranges to index
+    :param index_batch: exports and imports one batch
+    :param on_batch: called with the result of each batch
+    :param on_error: called with the batch and exception when a batch raises
+    :param concurrency: number of batches imported at once
+    """
+    slots = BoundedSemaphore(concurrency * 2)
+
+    def done(batch: range, future: Future):
+        slots.release()
+        e = future.exception()
+        if e is not None:
+            on_error(batch, e) # type: ignore
+        else:
+            on_batch(future.result())
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for batch in batches:
+            slots.acquire()
+            future = executor.submit(index_batch, batch)
+            future.add_done_callback(lambda f, batch=batch: done(batch, f))
@@ -3,12 +3,13 @@ import ast
 from typing import Callable
 import pytz
 import datetime as dt
+from bson import ObjectId
 from pymongo.database import Database
 from resource_type import DocType
-from download import download_document
-from parse import RawMeeting, RawBody, parse_document
-from io_utils import get_body_id_from_name
-from threading import Lock
+from download import download_document_spooled
+from parse import RawMeeting, RawBody, RawDocument, parse_document_spooled
+from io_utils import get_body_ids
+from metrics import timed
 
 class Document:
     def __init__(self,
@@ -18,7 +19,10 @@ class Document:
                  dt: float,
                  filer: str | None,
                  path: str | None,
-                 snippets: list[str]):
+                 snippets: list[str],
+                 hash: str = '',
+                 id: ObjectId | None = None,
+                 pending: bool = False):
         self.stamp: float = stamp
         self.name: str | None = name
         self.doctype: DocType = doctype
@@ -26,6 +30,9 @@ class Document:
         self.filer: str | None = filer
         self.path: str | None = path
         self.snippets: list[str] = snippets
+        self.hash: str = hash
+        self.id: ObjectId | None = id
+        self.pending: bool = pending
 
 class Meeting:
     def __init__(self,
@@ -50,7 +57,8 @@ class Meeting:
                  is_public_notice: bool,
                  is_cancelled: bool,
                  cancelled_dt: float | None,
-                 cancelled_reason: str | None):
+                 cancelled_reason: str | None,
+                 hash: str = ''):
         self.stamp: float = stamp
         self.body: int = body
         self.meeting_dt: float = meeting_dt
@@ -73,6 +81,7 @@ class Meeting:
         self.is_cancelled: bool = is_cancelled
         self.cancelled_dt: float | None = cancelled_dt
         self.cancelled_reason: str | None = cancelled_reason
+        self.hash: str = hash
 
 class Body:
     def __init__(self,
@@ -94,7 +103,8 @@ class Body:
                 people: dict[str, list[tuple[str, str, str, str]]],
                 max_members: str | None,
                 authority: tuple[str, str] | None,
-                board_members: list[tuple[str, str, str, str, str]]):
+                board_members: list[tuple[str, str, str, str, str]],
+                hash: str = ''):
         self.stamp: float = stamp
         self.name: str = name
         self.contact_name: str = contact_name
@@ -114,6 +124,7 @@ class Body:
         self.max_members: str | None = max_members
         self.authority: tuple[str, str] | None = authority
         self.board_members: list[tuple[str, str, str, str, str]] = board_members
+        self.hash: str = hash
 
 # analysis.py contains regex patterns that match fields to be scraped from meeting and body pages. These patterns were developed from analysis of all data on the SOS OMP up to May 1, 2023. These patterns can be used to validate new data scraped from the SOS OMP and to detect changes in the format of data presented on the OMP.
 
@@ -234,10 +245,31 @@ def parse_doctype(doctype: str) -> DocType:
             return DocType.MINUTES
     return DocType.UNKNOWN
 
-def validate_meeting(db: Database, db_lock: Lock, raw: RawMeeting) -> Meeting | None:
+def get_document_path(onclick: str) -> str | None:
+    onclick_match = re.fullmatch(DOC_ONCLICK_PATTERN, onclick)
+    if onclick_match and onclick_match.group(1):
+        return clean_filepath(onclick_match.group(1))
+    return None
+
+def get_document_paths(raw: RawMeeting) -> list[str]:
+    paths = (get_document_path(onclick) for _, onclick in raw.agendas + raw.minutes)
+    return [path for path in paths if path]
+
+def fetch_document(path: str) -> RawDocument:
+    with download_document_spooled(path) as spool:
+        return parse_document_spooled(spool)
+
+def pending_document(path: str) -> RawDocument:
+    """
+    Stands in for a document that a document worker will download later, so a meeting can be stored without waiting on its PDFs.
+    """
+    return RawDocument(stamp=0.0, snippets=[], pending=True)
+
+@timed('validate_meeting')
+def validate_meeting(db: Database, raw: RawMeeting, get_document: Callable[[str], RawDocument] = fetch_document) -> Meeting | None:
     if raw.body == '':
         return None
-    body: int = get_body_id_from_name(db, db_lock, raw.body)
+    body: int = get_body_ids(db).get(raw.body)
     meeting_dt: float = validate_meeting_datetime(raw.meeting_date, raw.meeting_time)
     filing_dt: float = parse_sos_dt_to_timestamp(raw.filing_dt)
     agendas: list[Document] = list()
@@ -245,15 +277,14 @@ def validate_meeting(db: Database, db_lock: Lock, raw: RawMeeting) -> Meeting |
     for begin, end in [(raw.agendas, agendas), (raw.minutes, minutes)]:
         for text, onclick in begin:
             text_match = re.fullmatch(DOC_TEXT_PATTERN, text)
-            onclick_match = re.fullmatch(DOC_ONCLICK_PATTERN, onclick)
+            path: str | None = get_document_path(onclick)
             name: str | None = text_match.group(1) if text_match else None
             doctype: DocType = parse_doctype(text_match.group(2)) if text_match else DocType.UNKNOWN
             filing_dt: float = parse_sos_dt_to_timestamp(text_match.group(3)) if text_match else 0.0
             filer: str | None = text_match.group(10) if text_match else None
-            if onclick_match and onclick_match.group(1):
-                path: str = clean_filepath(onclick_match.group(1))
-                rawdoc = parse_document(download_document(path))
-                end.append(Document(rawdoc.stamp, name, doctype, filing_dt, filer, path, rawdoc.snippets))
+            if path:
+                rawdoc = get_document(path)
+                end.append(Document(rawdoc.stamp, name, doctype, filing_dt, filer, path, rawdoc.snippets, rawdoc.hash, rawdoc.id, rawdoc.pending))
     is_meeting_dt_changed: bool = raw.is_meeting_date_changed != '0' or raw.is_meeting_time_changed != '0'
     is_address_changed: bool = raw.is_address_changed != '0'
     is_annual_calendar_changed: bool = raw.is_annual_calendar_changed != '0'
@@ -287,7 +318,8 @@ def validate_meeting(db: Database, db_lock: Lock, raw: RawMeeting) -> Meeting |
                    is_public_notice=is_public_notice,
                    is_cancelled=is_cancelled,
                    cancelled_dt=cancelled_dt,
-                   cancelled_reason=raw.cancelled_reason)
+                   cancelled_reason=raw.cancelled_reason,
+                   hash=raw.hash)
 
 def validate_body(raw: RawBody) -> Body | None:
     if raw.name == '':
@@ -318,4 +350,5 @@ def validate_body(raw: RawBody) -> Body | None:
                 people = raw.people,
                 max_members = raw.max_members if raw.max_members else None,
                 authority = raw.authority if raw.authority else None,
-                board_members = raw.board_members)
\ No newline at end of file
+                board_members = raw.board_members,
+                hash = raw.hash)
\ No newline at end of file
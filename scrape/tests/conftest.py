@@ -0,0 +1,60 @@
+import sys
+from os.path import dirname, join
+
+# The scrape modules import each other by module name, as when run from scrape/scrape
+sys.path.insert(0, join(dirname(dirname(__file__)), 'scrape'))
+
+import pytest
+from threading import RLock
+
+WRITE_LOCK = RLock()
+
+@pytest.fixture
+def db():
+    """
+    An in-memory stand-in for the MongoDB database, with the indexes the scraper creates.
+    """
+    mongomock = pytest.importorskip('mongomock')
+    from mongomock.collection import BulkOperationBuilder
+    from io_utils import ensure_indexes
+    # newer pymongo passes sort to bulk updates, which mongomock does not accept
+    for name in ['add_update', 'add_replace']:
+        add = getattr(BulkOperationBuilder, name)
+        if not getattr(add, 'drops_sort', False):
+            def drop_sort(self, *args, add=add, sort=None, **kwargs):
+                return add(self, *args, **kwargs)
+            drop_sort.drops_sort = True # type: ignore
+            setattr(BulkOperationBuilder, name, drop_sort)
+    # the server retries an upsert that races another for the same _id; mongomock does not, so its writes are serialized instead
+    from mongomock.collection import Collection
+    for name in ['insert_one', 'insert_many', 'replace_one', 'update_one', 'update_many', 'bulk_write', 'delete_one', 'delete_many']:
+        write = getattr(Collection, name)
+        if not getattr(write, 'serialized', False):
+            def serialized(self, *args, write=write, **kwargs):
+                with WRITE_LOCK:
+                    return write(self, *args, **kwargs)
+            serialized.serialized = True # type: ignore
+            setattr(Collection, name, serialized)
+    database = mongomock.MongoClient().db
+    ensure_indexes(database)
+    return database
+
+@pytest.fixture
+def make_meeting():
+    """
+    Builds meetings of body 1 with the given number of agendas and snippets per agenda.
+    """
+    from validate import Document, Meeting
+    from resource_type import DocType
+    def make(documents: int = 2, snippets: int = 3) -> Meeting:
+        agendas = [Document(stamp=0.0, name=None, doctype=DocType.AGENDA, dt=0.0, filer='Clerk',
+                            path=f'/Notices/0/{i}.pdf',
+                            snippets=[f'Item {j} of agenda {i}.' for j in range(snippets)])
+                   for i in range(documents)]
+        return Meeting(stamp=0.0, body=1, meeting_dt=0.0, meeting_address='Room 1', filing_dt=0.0,
+                       agendas=agendas, minutes=[], contact_name='Clerk', contact_phone='', contact_email='',
+                       is_meeting_dt_changed=False, is_address_changed=False, is_annual_calendar_changed=False,
+                       is_emergency_changed=False, is_public_notice_changed=False, is_agenda_changed=False,
+                       is_emergency=False, is_annual_calendar=False, is_public_notice=False, is_cancelled=False,
+                       cancelled_dt=None, cancelled_reason=None)
+    return make
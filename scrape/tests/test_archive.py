@@ -0,0 +1,84 @@
+import os
+import hashlib
+from io import BytesIO
+from requests import Response, PreparedRequest
+from requests.structures import CaseInsensitiveDict
+from archive import ResponseArchive, get_segments, read_segment, read_record_at, read_index, get_index_filename, classify
+from download import Spool, build_response, generate_meeting_url, generate_body_gd_url, generate_document_url
+from parse import get_stamp
+from reparse import ArchiveIndex
+from constants import SOS_SERVER
+
+DATE = 'Mon, 01 May 2023 14:00:00 GMT'
+
+def test_archive_round_trip(tmp_path):
+    archive = ResponseArchive(str(tmp_path), segment_bytes=400)
+    page = build_response(generate_meeting_url(1009540), 200, {'Date': DATE, 'Content-Type': 'text/html; charset=utf-8', 'Content-Encoding': 'gzip'}, '<html>é</html>'.encode('utf-8'))
+    pdf = build_response(generate_document_url('\\Notices\\4749\\2021\\397008.pdf'), 200, {'Date': DATE}, bytes(range(256)) * 4)
+    missing = build_response(generate_meeting_url(1), 500, {}, b'')
+    for response in [page, pdf, missing, page]:
+        archive.write(response)
+    archive.close()
+
+    segments = get_segments(str(tmp_path))
+    # the small segment size starts a new segment for every record
+    assert len(segments) == 3
+    records = [(segment, offset, response) for segment in segments for offset, response in read_segment(segment)]
+    assert [r.status_code for _, _, r in records] == [200, 200, 200]
+    _, _, read_page = records[0]
+    assert read_page.text == '<html>é</html>'
+    assert get_stamp(read_page) == get_stamp(page)
+    assert 'Content-Encoding' not in read_page.headers
+    segment, offset, _ = records[1]
+    assert read_record_at(segment, offset).content == pdf.content
+
+def test_spool_round_trip(tmp_path):
+    content = bytes(range(256)) * 1000
+    streamed = Response()
+    streamed.url = generate_document_url('\\Notices\\4749\\2021\\397008.pdf')
+    streamed.status_code = 200
+    streamed.headers = CaseInsensitiveDict({'Date': DATE, 'Content-Type': 'application/pdf'})
+    streamed.raw = BytesIO(content)
+    # a small spool spills to disk, and still reads back whole
+    with Spool(streamed, max_memory=1024) as spool:
+        assert spool.hash == hashlib.sha256(content).hexdigest()
+        assert spool.size == len(content)
+        assert b''.join(spool.chunks()) == b''.join(spool.chunks()) == content
+        assert get_stamp(spool) == get_stamp(build_response(streamed.url, 200, {'Date': DATE}, b''))
+        archive = ResponseArchive(str(tmp_path))
+        archive.write_spool(spool)
+        archive.close()
+    [(_, read)] = list(read_segment(get_segments(str(tmp_path))[0]))
+    assert read.content == content
+    assert read.url == streamed.url
+
+def test_classify():
+    assert classify(generate_meeting_url(1009540)) == ('meeting', '1009540')
+    assert classify(generate_body_gd_url(3570)) == ('body_gd', '3570')
+    assert classify(generate_document_url('\\Notices\\4749\\2021\\397008.pdf')) == ('document', '\\Notices\\4749\\2021\\397008.pdf')
+    assert classify('http://localhost:9998/tika') is None
+
+def test_index_is_read_without_decompressing(tmp_path):
+    archive = ResponseArchive(str(tmp_path))
+    meeting = build_response(generate_meeting_url(1009540), 200, {'Date': DATE}, b'<html></html>')
+    # a redirected response is classified by the url it was requested by
+    redirected = build_response(f'{SOS_SERVER}/OpenMeetingsPublic/Error', 200, {'Date': DATE}, b'<html>moved</html>')
+    first = build_response(generate_body_gd_url(3570), 302, {}, b'')
+    first.request = PreparedRequest()
+    first.request.prepare(method='GET', url=generate_body_gd_url(3570))
+    redirected.history = [first]
+    for response in [meeting, redirected, meeting]:
+        archive.write(response)
+    archive.close()
+
+    [segment] = get_segments(str(tmp_path))
+    entries = read_index(segment)
+    assert [(kind, key) for kind, key, _ in entries] == [('meeting', '1009540'), ('body_gd', '3570'), ('meeting', '1009540')]
+    assert read_record_at(segment, entries[1][2]).content == b'<html>moved</html>'
+    index = ArchiveIndex(str(tmp_path))
+    assert index.locations['meeting']['1009540'] == (segment, entries[2][2])
+
+    # a segment archived without an index is indexed from its WARC headers
+    os.remove(get_index_filename(segment))
+    assert [(kind, key) for kind, key, _ in read_index(segment)] == [('meeting', '1009540'), ('meeting', '1009540')]
+    assert os.path.exists(get_index_filename(segment))
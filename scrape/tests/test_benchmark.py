@@ -0,0 +1,33 @@
+import pytest
+from requests import Session
+from benchmark import percentile, compare_results, benchmark_store, format_store_results
+from download import generate_meeting_url, generate_document_url
+from parse import parse_meeting
+from stand_in import StandInServer, redirect_session
+
+def test_stand_in_serves_fixtures():
+    session = Session()
+    with StandInServer() as server:
+        redirect_session(session, server.url)
+        meeting = parse_meeting(session.get(generate_meeting_url(0)))
+        pdf = session.get(generate_document_url('\\Notices\\4749\\2021\\397008.pdf'))
+    assert meeting.body == 'Providence Board of Licenses'
+    assert pdf.content.startswith(b'%PDF')
+
+def test_stand_in_requires_a_fixtures_directory(tmp_path):
+    with pytest.raises(RuntimeError):
+        StandInServer(fixtures_dir=str(tmp_path))
+
+def test_compare_results():
+    assert percentile([1.0, 2.0, 3.0, 4.0, 5.0], 0.5) == 3.0
+    baseline = {'stages': [{'stage': 'parse_meeting', 'items_per_sec': 100.0}, {'stage': 'store_meeting', 'items_per_sec': 100.0}]}
+    current = {'stages': [{'stage': 'parse_meeting', 'items_per_sec': 95.0}, {'stage': 'store_meeting', 'items_per_sec': 50.0}]}
+    assert compare_results(baseline, current) == ['store_meeting: 100.0 -> 50.0 items/s']
+
+def test_benchmark_store_measures_each_mode(db):
+    results = benchmark_store(db, worker_counts=[1, 4], count=8)
+    assert list(results) == [1, 4]
+    assert all(rates['locked'] > 0 and rates['unlocked'] > 0 for rates in results.values())
+    assert format_store_results(results).count('\n') == 2
+    # the scratch database is left empty
+    assert db.meetings.count_documents({}) == 0
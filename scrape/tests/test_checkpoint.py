@@ -0,0 +1,19 @@
+from checkpoint import Checkpoint, get_outcome, SUCCESS, SKIPPED, INVALID, ERROR
+
+def test_resume_retries_only_failures(tmp_path):
+    checkpoint = Checkpoint('download_meeting', dir=str(tmp_path), buffer_size=2)
+    for id, result in [(1, 0), (2, -1), (3, 1)]:
+        checkpoint.record(id, get_outcome(result))
+    checkpoint.record(4, ERROR, 'timed out', tries=3)
+    checkpoint.close()
+
+    checkpoint = Checkpoint('download_meeting', dir=str(tmp_path))
+    assert checkpoint.select(range(1, 7)) == [4, 5, 6]
+    checkpoint.record(4, SUCCESS, tries=1)
+    assert checkpoint.select(range(1, 7)) == [5, 6]
+    assert checkpoint.counts() == {SUCCESS: 2, SKIPPED: 1, INVALID: 1}
+    # the download tries of both runs
+    assert checkpoint._conn.execute('SELECT tries FROM outcomes WHERE id = 4').fetchone() == (4,)
+    # an id recorded without tries, e.g. skipped before any download, has none
+    assert checkpoint._conn.execute('SELECT tries FROM outcomes WHERE id = 2').fetchone() == (0,)
+    checkpoint.close()
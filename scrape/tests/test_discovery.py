@@ -0,0 +1,45 @@
+import glob
+from os.path import dirname, join
+from discovery import IdBitmap, MeetingIds
+from parse import parse_dashboard_meeting_ids
+
+def test_bitmap_handles_byte_boundaries():
+    bitmap = IdBitmap()
+    assert bitmap.max() == -1
+    for id in [0, 7, 8, 15, 16]:
+        bitmap.add(id)
+    assert [id for id in range(20) if id in bitmap] == [0, 7, 8, 15, 16]
+    assert len(bitmap.bits) == 3
+    assert (bitmap.max(), bitmap.count()) == (16, 5)
+    bitmap.discard(16)
+    bitmap.discard(1000)
+    assert (bitmap.max(), bitmap.count()) == (15, 4)
+    assert 1000 not in bitmap
+
+def test_select_skips_empty_ids_only_below_the_frontier(tmp_path):
+    filename = str(tmp_path / 'meeting_ids.bin')
+    ids = MeetingIds(filename)
+    # with nothing known every id is chosen
+    assert ids.select(range(5)) == [0, 1, 2, 3, 4]
+    ids.mark_live([2, 10])
+    for id in [3, 11, 12]:
+        ids.mark_empty(id)
+    # a live id is never marked empty
+    ids.mark_empty(2)
+    assert ids.select(range(14)) == [0, 1, 2, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13]
+    assert ids.select(range(14), discovered_only=True) == [2, 10, 11, 12, 13]
+    ids.save()
+
+    ids = MeetingIds(filename)
+    assert ids.select(range(14), discovered_only=True) == [2, 10, 11, 12, 13]
+    assert 3 in ids.empty
+    # an empty id listed on a dashboard later is live again
+    ids.mark_live([3])
+    assert ids.select(range(5), discovered_only=True) == [2, 3]
+
+def test_dashboard_meeting_ids_are_unique_and_sorted():
+    [page] = glob.glob(join(dirname(__file__), 'pages', '*OpenMeetingDashboard*EntityID=2187.html'))
+    with open(page) as f:
+        found = parse_dashboard_meeting_ids(f.read())
+    assert found == sorted(set(found))
+    assert 807172 in found and 794084 in found
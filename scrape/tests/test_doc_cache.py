@@ -0,0 +1,22 @@
+from concurrent.futures import ThreadPoolExecutor
+from doc_cache import DocumentCache
+from parse import RawDocument
+
+def test_put_and_get(tmp_path):
+    cache = DocumentCache(str(tmp_path), max_bytes=10 ** 6)
+    pdf = b'%PDF-1.4 agenda'
+    document = RawDocument(stamp=1.0, snippets=['Call to order.'], hash='ab' * 32)
+    # workers storing the same content at once write one blob
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(lambda i: cache.put(f'/Notices/{i}.pdf', document, pdf), range(8)))
+    assert cache.size == len(pdf) + len(b'["Call to order."]')
+    assert cache.get('/Notices/3.pdf').snippets == ['Call to order.']
+    assert cache.get_content(document.hash) == pdf
+    assert list(tmp_path.glob('*/*.tmp')) == []
+    # reads are recorded in memory and written to the index on close
+    used = cache._conn.execute('SELECT last_used FROM blobs').fetchone()[0]
+    assert document.hash in cache._touched
+    cache.close()
+    cache = DocumentCache(str(tmp_path))
+    assert cache._conn.execute('SELECT last_used FROM blobs').fetchone()[0] > used
+    cache.close()
@@ -0,0 +1,35 @@
+from parse import RawDocument
+from documents import DocumentWorkers, get_pending_documents
+from store import store_meeting_with_pending
+
+def test_workers_fill_pending_documents_and_leave_failures_pending(db, make_meeting):
+    meeting = make_meeting(documents=4, snippets=0)
+    for document in meeting.agendas:
+        document.pending = True
+    pending = store_meeting_with_pending(db, 1, meeting)
+    # the meeting is stored before its documents are downloaded
+    assert db.meetings.count_documents({}) == 1
+    assert sorted(get_pending_documents(db)) == sorted(pending)
+
+    broken = {'/Notices/0/3.pdf'}
+    def get_document(path: str) -> RawDocument:
+        if path in broken:
+            raise RuntimeError('Tika is down')
+        return RawDocument(stamp=1.0, snippets=[f'Text of {path}.'], hash=path)
+    errors: list[str] = []
+    with DocumentWorkers(db, get_document, workers=2, on_error=lambda id, path, e: errors.append(path)) as workers:
+        for id, path in pending:
+            workers.submit(id, path)
+    assert (workers.filled, workers.failed) == (3, 1)
+    assert errors == ['/Notices/0/3.pdf']
+    assert [path for _, path in get_pending_documents(db)] == ['/Notices/0/3.pdf']
+    assert db.documents.find_one({'path': '/Notices/0/0.pdf'})['snippets']
+
+    # a later run retries what is still pending; filled documents are not filled twice
+    broken.clear()
+    with DocumentWorkers(db, get_document, workers=2) as workers:
+        for id, path in pending:
+            workers.submit(id, path)
+    assert workers.filled == 1
+    assert get_pending_documents(db) == []
+    assert [snippet['refs'] for snippet in db.snippets.find()] == [1] * 4
@@ -0,0 +1,18 @@
+import json
+from event_log import EventLog
+
+def test_events_are_written_as_rotated_json_lines(tmp_path):
+    log = EventLog(str(tmp_path), 'download_meeting', max_bytes=1000)
+    for id in range(100):
+        log.log(id=id, stage='download_meeting', outcome='success', elapsed=0.5)
+    try:
+        raise RuntimeError('failed after 3 tries')
+    except RuntimeError as e:
+        log.error(e, id=100, stage='download_meeting')
+    log.close()
+
+    assert len(log.filenames) > 1
+    events = [json.loads(line) for filename in log.filenames for line in open(filename)]
+    assert [event['id'] for event in events] == list(range(101))
+    assert events[-1]['outcome'] == 'error'
+    assert events[-1]['error'] == 'RuntimeError: failed after 3 tries'
@@ -0,0 +1,29 @@
+import gzip
+import json
+from concurrent.futures import ThreadPoolExecutor
+from export import NdjsonWriter, ndjson_extension
+
+def test_lines_are_buffered_until_the_buffer_fills(tmp_path):
+    filename = str(tmp_path / 'out.jsonl')
+    writer = NdjsonWriter(filename, buffer_size=3)
+    writer.write({'id': '1'})
+    writer.write({'id': '2'})
+    assert len(writer._buffer) == 2
+    # the third line fills the buffer, which is handed to the file in one write
+    writer.write({'id': '3'})
+    assert writer._buffer == []
+    writer.write({'id': '4'})
+    writer.close()
+    with open(filename) as f:
+        assert [json.loads(line)['id'] for line in f] == ['1', '2', '3', '4']
+    assert writer.count == 4
+
+def test_threads_write_whole_lines_to_gzip(tmp_path):
+    filename = str(tmp_path / f'out.{ndjson_extension(True)}')
+    with NdjsonWriter(filename, compress=True, buffer_size=10) as writer:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda i: writer.write({'id': str(i), 'text': 'x' * i}), range(500)))
+    with gzip.open(filename, 'rt', encoding='utf-8') as f:
+        lines = [json.loads(line) for line in f]
+    assert sorted(int(line['id']) for line in lines) == list(range(500))
+    assert all(len(line['text']) == int(line['id']) for line in lines)
@@ -0,0 +1,26 @@
+import pytest
+from index import get_meetings_as_indexable, get_meeting_as_indexable
+from store import store_meeting
+
+def test_meetings_are_exported_with_one_query_per_collection(db, make_meeting, monkeypatch):
+    db.bodies.insert_one({'_id': 1, 'name': 'Providence Board of Licenses'})
+    for id in [2, 4, 6]:
+        store_meeting(db, id, make_meeting(documents=2, snippets=3))
+    from mongomock.collection import Collection
+    find = Collection.find
+    queried: list[str] = []
+    def count_find(self, *args, **kwargs):
+        queried.append(self.name)
+        return find(self, *args, **kwargs)
+    monkeypatch.setattr(Collection, 'find', count_find)
+
+    results = get_meetings_as_indexable(db, range(7))
+    assert sorted(queried) == ['bodies', 'documents', 'meetings', 'snippets']
+    # ids without a meeting are skipped, and the rest keep their order
+    assert [result['id'] for result in results] == ['2', '4', '6']
+    assert results[0]['body'] == 'Providence Board of Licenses'
+    assert results[0]['latestAgenda'] == [f'Item {j} of agenda 0.' for j in range(3)]
+    assert results[0]['latestAgendaLink'].endswith('/Notices/0/0.pdf')
+    assert get_meeting_as_indexable(db, 4) == results[1]
+    with pytest.raises(RuntimeError):
+        get_meeting_as_indexable(db, 5)
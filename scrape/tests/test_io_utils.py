@@ -0,0 +1,71 @@
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep
+import io_utils
+from io_utils import ensure_indexes, warn_missing_indexes, get_missing_indexes, get_index_name, get_body_id_from_name, ExistingIds, BodyIds
+from resource_type import ResourceType
+
+def test_missing_indexes_are_found_without_creating_them(db):
+    assert get_missing_indexes(db) == []
+    db.documents.drop_index('pending_1')
+    db.bodies.drop_indexes()
+    assert get_missing_indexes(db) == [('bodies', 'name_1'), ('documents', 'pending_1')]
+    # checking does not create them
+    assert 'name_1' not in db.bodies.index_information()
+
+def test_missing_indexes_are_reported_once_per_call(db, capsys):
+    assert warn_missing_indexes(db) == 0
+    db.bodies.drop_indexes()
+    assert warn_missing_indexes(db) == 1
+    assert capsys.readouterr().out.count('Warning: index bodies.name_1 is missing') == 1
+
+def test_prefetched_ids_are_checked_without_queries(db, monkeypatch):
+    db.meetings.insert_many([{'_id': id} for id in [5, 12, 13, 20, 21, 40]])
+    existing = ExistingIds(db, ResourceType.MEETING)
+    # an unaligned range, so the bits do not line up with the ids
+    existing.prefetch(5, 21)
+    from mongomock.collection import Collection
+    find_one = Collection.find_one
+    lookups: list[int] = []
+    def count_find_one(self, filter, *args, **kwargs):
+        lookups.append(filter['_id'])
+        return find_one(self, filter, *args, **kwargs)
+    monkeypatch.setattr(Collection, 'find_one', count_find_one)
+    assert [id for id in range(5, 21) if id in existing] == [5, 12, 13, 20]
+    assert lookups == []
+    # ids outside the range, including its exclusive end, are looked up
+    assert 21 in existing and 40 in existing and 4 not in existing
+    assert lookups == [21, 40, 4]
+
+def test_concurrent_misses_for_a_name_share_one_lookup(db, monkeypatch):
+    db.bodies.insert_one({'_id': 1, 'name': 'Providence Board of Licenses'})
+    body_ids = BodyIds(db)
+    db.bodies.insert_one({'_id': 2, 'name': 'Coastal Resources Management Council'})
+    lookups: list[str] = []
+    def slow_lookup(db, name: str) -> int:
+        lookups.append(name)
+        sleep(0.2)
+        return get_body_id_from_name(db, name)
+    monkeypatch.setattr(io_utils, 'get_body_id_from_name', slow_lookup)
+    assert body_ids.get('Providence Board of Licenses') == 1
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        found = list(executor.map(body_ids.get, ['Coastal Resources Management Council'] * 8))
+    assert found == [2] * 8
+    assert lookups == ['Coastal Resources Management Council']
+    # a name found is kept, and a name not found is looked up again next time
+    assert body_ids.get('Coastal Resources Management Council') == 2
+    with pytest.raises(RuntimeError):
+        body_ids.get('Water Resources Board')
+    db.bodies.insert_one({'_id': 3, 'name': 'Water Resources Board'})
+    assert body_ids.get('Water Resources Board') == 3
+    assert len(lookups) == 3
+
+def test_ensure_indexes_reports_what_it_created():
+    mongomock = pytest.importorskip('mongomock')
+    db = mongomock.MongoClient().db
+    expected = [(rtype.collection_name(), get_index_name(keys)) for rtype in ResourceType for keys, _ in rtype.get_db_indexes()]
+    assert get_missing_indexes(db) == expected
+    assert ensure_indexes(db) == [(collection, name, 'created') for collection, name in expected]
+    assert ensure_indexes(db) == [(collection, name, 'exists') for collection, name in expected]
+    assert get_missing_indexes(db) == []
+    assert db.documents.index_information()['meeting_1_path_1']['unique']
@@ -0,0 +1,36 @@
+import pytest
+from requests import get
+from metrics import Registry, stage, serve_metrics
+
+def test_stage_records_latency_and_errors():
+    registry = Registry()
+    with stage('parse_meeting', registry):
+        pass
+    with pytest.raises(ValueError):
+        with stage('parse_meeting', registry):
+            raise ValueError()
+    snapshot = registry.snapshot()
+    assert snapshot['scrape_stage_seconds'][0]['value']['count'] == 2
+    assert snapshot['scrape_stage_errors_total'][0]['value'] == 1
+    assert snapshot['scrape_stage_in_flight'][0]['value'] == 0
+
+def test_prometheus_histogram_buckets_are_cumulative():
+    registry = Registry()
+    histogram = registry.histogram('wait_seconds', 'Waits', host='sos')
+    for value in [0.002, 0.02, 0.2, 500.0]:
+        histogram.observe(value)
+    text = registry.to_prometheus()
+    assert 'wait_seconds_bucket{host="sos",le="0.0025"} 1' in text
+    assert 'wait_seconds_bucket{host="sos",le="0.25"} 3' in text
+    assert 'wait_seconds_bucket{host="sos",le="+Inf"} 4' in text
+    assert 'wait_seconds_count{host="sos"} 4' in text
+    assert histogram.quantile(0.5) == 0.025
+
+def test_metrics_are_served_on_localhost_by_default():
+    registry = Registry()
+    registry.counter('requests_total', 'Requests').inc()
+    server = serve_metrics(0, registry=registry)
+    host, port = server.server_address[:2]
+    assert host == '127.0.0.1'
+    assert 'requests_total 1' in get(f'http://{host}:{port}/metrics').text
+    server.shutdown()
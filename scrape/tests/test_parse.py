@@ -0,0 +1,50 @@
+import glob
+from os.path import dirname, join
+from typing import Callable
+import pytest
+from parse import parse_meeting_page, parse_body_om_page, parse_body_gd_page, parse_body_bm_page, parse_tika_html, parse_tika_stream
+from stand_in import build_tika_html
+
+PAGES = sorted(glob.glob(join(dirname(__file__), 'pages', '*.html')))
+PAGE_PARSERS = [parse_meeting_page, parse_body_om_page, parse_body_gd_page, parse_body_bm_page]
+
+def parse_with(parse_page: Callable, text: str, parser: str) -> dict | None:
+    try:
+        return vars(parse_page(text, parser=parser))
+    except Exception:
+        return None
+
+@pytest.mark.parametrize('page', PAGES)
+@pytest.mark.parametrize('parse_page', PAGE_PARSERS)
+def test_parsers_agree(page: str, parse_page: Callable):
+    with open(page) as f:
+        text = f.read()
+    # both backends must build the same object, or both must reject the page
+    assert parse_with(parse_page, text, 'lxml') == parse_with(parse_page, text, 'bs4')
+
+def test_parse_meeting_page():
+    with open(join(dirname(__file__), 'pages', '1009540.html')) as f:
+        meeting = parse_meeting_page(f.read(), parser='lxml')
+    assert meeting.body == 'Providence Board of Licenses'
+    assert meeting.meeting_time == '3:00 PM'
+    assert len(meeting.agendas) == 2
+    assert meeting.contact_email == 'slopes@providenceri.gov'
+    assert meeting.is_cancelled == '1'
+
+def test_every_page_type_parses():
+    parsed = {parse_page: 0 for parse_page in PAGE_PARSERS}
+    for page in PAGES:
+        with open(page) as f:
+            text = f.read()
+        for parse_page in PAGE_PARSERS:
+            parsed[parse_page] += parse_with(parse_page, text, 'lxml') is not None
+    assert all(parsed.values())
+
+TIKA_HTML = build_tika_html(3).decode('utf-8') + """<div><p>A line
+broken &amp; joined,&#160;with  <b>bold</b>\r\n text</p><p> </p>
+<p>Outer <p>inner</p> after</p><!-- <p>comment</p> --></div><p>Unclosed"""
+
+@pytest.mark.parametrize('size', [1, 5, 64, len(TIKA_HTML)])
+def test_tika_stream_matches_whole(size: int):
+    chunks = [TIKA_HTML[i:i + size] for i in range(0, len(TIKA_HTML), size)]
+    assert parse_tika_stream(chunks) == parse_tika_html(TIKA_HTML)
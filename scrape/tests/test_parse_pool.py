@@ -0,0 +1,27 @@
+from os.path import dirname, join
+import tika
+from download import Spool, build_response, generate_meeting_url
+from parse import parse_meeting, parse_document_spooled
+from parse_pool import ParsePool
+from stand_in import StandInServer, TIKA_PARAGRAPHS
+
+PAGE = join(dirname(__file__), 'pages', '1009540.html')
+
+def test_pool_parses_like_the_calling_process():
+    with open(PAGE, 'rb') as f:
+        response = build_response(generate_meeting_url(1009540), 200, {'Content-Type': 'text/html; charset=utf-8'}, f.read())
+    with ParsePool(processes=1) as pool:
+        # workers are not forked from this process, which may be running threads
+        assert pool._executor._mp_context.get_start_method() in ['forkserver', 'spawn']
+        assert vars(pool.parse_meeting(response)) == vars(parse_meeting(response))
+
+def test_pool_parses_spooled_documents_like_the_calling_process(monkeypatch):
+    with StandInServer() as server:
+        monkeypatch.setattr(tika, '_client', tika.TikaClient([server.url], health_interval=0))
+        response = build_response('', 200, {}, b'%PDF-1.4')
+        # as if read to the end, so it can be spooled
+        response._content_consumed = True
+        with Spool(response) as spool, ParsePool(processes=1) as pool:
+            document = pool.parse_document_spooled(spool)
+            assert vars(document) == vars(parse_document_spooled(spool))
+    assert len(document.snippets) == TIKA_PARAGRAPHS
@@ -0,0 +1,60 @@
+import asyncio
+from os.path import dirname, join
+import pipeline
+from download import build_response
+from parse import parse_meeting
+from pipeline import process_all, run_meetings_async
+
+PAGES = {1: '1009540.html', 2: '1037938.html', 3: 'empty.html'}
+
+def read_page(id: int) -> bytes:
+    with open(join(dirname(__file__), 'pages', PAGES[id]), 'rb') as f:
+        return f.read()
+
+def test_process_all_bounds_ids_in_flight():
+    in_flight: list[int] = []
+    peak: list[int] = [0]
+    errors: dict[int, str] = {}
+    done: list[int] = []
+
+    async def process(id: int) -> int:
+        in_flight.append(id)
+        peak[0] = max(peak[0], len(in_flight))
+        await asyncio.sleep(0.01)
+        in_flight.remove(id)
+        if id == 3:
+            raise ValueError('no meeting')
+        return id * 2
+
+    results = asyncio.run(process_all(range(10), process, 4, lambda id, e: errors.update({id: str(e)}),
+                                      lambda id, result: done.append(id)))
+    assert peak[0] == 4
+    assert sorted(r for r in results if r is not None) == [0, 2, 4, 8, 10, 12, 14, 16, 18]
+    assert errors == {3: 'no meeting'}
+    assert sorted(done) == list(range(10))
+
+def test_async_engine_stores_meetings_and_skips_stored_ones(db, monkeypatch):
+    async def download_meeting_async(session, id: int):
+        return build_response('', 200, {}, read_page(id))
+    async def download_document_async(session, path: str):
+        return build_response('', 200, {}, path.encode())
+    async def extract_text_async(session, content: bytes) -> str:
+        return f'<html><body><p>Text of {content.decode()}.</p></body></html>'
+    monkeypatch.setattr(pipeline, 'download_meeting_async', download_meeting_async)
+    monkeypatch.setattr(pipeline, 'download_document_async', download_document_async)
+    monkeypatch.setattr(pipeline, 'extract_text_async', extract_text_async)
+    for id in [1, 2]:
+        db.bodies.insert_one({'_id': id, 'name': parse_meeting(build_response('', 200, {}, read_page(id))).body})
+    errors: list[Exception] = []
+
+    results = run_meetings_async(db, [1, 2, 3], lambda id, e: errors.append(e), lambda id, result: None, in_flight=2)
+    assert errors == []
+    # the empty page is skipped
+    assert sorted(results) == [-1, 0, 0]
+    assert db.meetings.count_documents({}) == 2
+    # documents of a meeting are extracted and stored with it
+    for meeting in db.meetings.find():
+        assert len(meeting['agendas'] + meeting['minutes']) == 2
+        for id in meeting['agendas'] + meeting['minutes']:
+            assert db.documents.find_one({'_id': id})['snippets']
+    assert run_meetings_async(db, [1, 2], lambda id, e: errors.append(e), lambda id, result: None) == [-1, -1]
@@ -0,0 +1,78 @@
+import asyncio
+import pytest
+from requests import ConnectionError
+import download
+from download import Spool, build_response, multitry, multitry_async, fetch_spooled, start_try_count, get_try_count
+from io_utils import is_http_success
+from rate_limit import RateController, get_retry_after, get_backoff
+from stand_in import StandInServer
+
+def test_rate_increases_and_decreases():
+    controller = RateController(rate=10.0, increase=1.0, decrease=0.5)
+    for _ in range(10):
+        controller.on_success()
+    assert 10.9 < controller.rate < 11.0
+    controller.on_throttle()
+    # failures of requests in flight together decrease the rate once
+    controller.on_throttle()
+    assert 5.4 < controller.rate < 5.5
+    assert controller.snapshot()['decreases'] == 1
+
+def test_retry_after_pauses_requests():
+    controller = RateController(rate=1000.0)
+    assert controller.reserve() == 0.0
+    controller.on_throttle(retry_after=5.0)
+    assert 4.9 < controller.reserve() <= 5.0
+
+def test_get_retry_after():
+    assert get_retry_after(build_response('', 429, {'Retry-After': '7'}, b'')) == 7.0
+    assert get_retry_after(build_response('', 503, {'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}, b'')) == 0.0
+    assert get_retry_after(build_response('', 429, {}, b'')) is None
+
+def test_backoff_is_capped():
+    assert all(0 <= get_backoff(10.0, try_count, max_backoff=30.0) <= 30.0 for try_count in range(1, 10))
+
+def test_only_overload_slows_the_crawl():
+    def fail_with(error: Exception):
+        def fetch():
+            raise error
+        return fetch
+    for fetch, throttles in [(fail_with(OSError('disk full')), False),
+                             (lambda: build_response('', 500, {}, b''), False),
+                             (fail_with(ConnectionError('reset')), True),
+                             (lambda: build_response('', 503, {}, b''), True)]:
+        controller = RateController(rate=1000.0)
+        with pytest.raises(RuntimeError):
+            multitry(1, 0.0, fetch, is_http_success, controller=controller)
+        assert controller.snapshot()['decreases'] == int(throttles)
+
+def test_failed_spool_hook_closes_the_spool(monkeypatch):
+    spools: list[Spool] = []
+    def hook(spool: Spool):
+        spools.append(spool)
+        raise OSError('disk full')
+    monkeypatch.setattr(download, 'get_spool_hooks', lambda: [hook])
+    with StandInServer() as server:
+        with pytest.raises(OSError):
+            fetch_spooled(f'{server.url}/Common/DownloadMeetingFiles?FilePath=a.pdf')
+    assert spools[0].file.closed
+
+def test_tries_are_counted_for_the_current_id():
+    responses = iter([build_response('', 500, {}, b''), build_response('', 200, {}, b'')])
+    start_try_count()
+    multitry(3, 0.0, lambda: next(responses), is_http_success)
+    with pytest.raises(RuntimeError):
+        multitry(2, 0.0, lambda: build_response('', 500, {}, b''), is_http_success)
+    assert get_try_count() == 4
+    start_try_count()
+    assert get_try_count() == 0
+
+def test_tries_of_concurrent_downloads_add_up():
+    async def fetch():
+        return build_response('', 200, {}, b'')
+    async def process() -> int | None:
+        start_try_count()
+        # gathered downloads run in tasks of their own
+        await asyncio.gather(*(multitry_async(1, 0.0, fetch, is_http_success) for _ in range(3)))
+        return get_try_count()
+    assert asyncio.run(process()) == 3
@@ -0,0 +1,75 @@
+from os.path import dirname, join
+import pytest
+import doc_cache
+import refresh
+from download import Spool, build_response
+from parse import RawDocument, parse_meeting, get_hash
+from refresh import refresh_meeting
+from validate import validate_meeting
+from store import store_meeting, update_meeting
+
+def read_page(filename: str) -> bytes:
+    with open(join(dirname(__file__), 'pages', filename), 'rb') as f:
+        return f.read()
+
+def test_unchanged_page_is_neither_parsed_nor_written(db, make_meeting, monkeypatch):
+    page = build_response('', 200, {}, b'<html>meeting</html>')
+    meeting = make_meeting(documents=1, snippets=1)
+    meeting.hash = get_hash(page)
+    store_meeting(db, 1, meeting)
+    def fail(*args):
+        raise AssertionError('an unchanged page was parsed')
+    monkeypatch.setattr(refresh, 'download_meeting', lambda id: page)
+    monkeypatch.setattr(refresh, 'parse_meeting', fail)
+    assert refresh_meeting(db, 1) == -1
+    with pytest.raises(RuntimeError):
+        refresh_meeting(db, 2)
+
+def spool(content: bytes) -> Spool:
+    response = build_response('', 200, {}, content)
+    # as if read to the end, so it can be spooled
+    response._content_consumed = True
+    return Spool(response)
+
+def test_documents_with_an_unchanged_pdf_are_reused(db, monkeypatch):
+    page = build_response('', 200, {}, read_page('1009540.html'))
+    same = b'%PDF same'
+    db.bodies.insert_one({'_id': 1, 'name': parse_meeting(page).body})
+    stored = validate_meeting(db, parse_meeting(page), lambda path: RawDocument(stamp=0.0, snippets=['An item.'], hash=spool(same).hash))
+    store_meeting(db, 1, stored)
+    # the page changed, so its documents are checked
+    db.meetings.update_one({'_id': 1}, {'$set': {'hash': 'old'}})
+    documents = {document['_id']: document for document in db.documents.find()}
+    [first, second] = sorted(document.path for document in stored.agendas + stored.minutes)
+    contents = {first: same, second: same}
+    parsed: list[bytes] = []
+    def parse_document_spooled(spool: Spool) -> RawDocument:
+        parsed.append(spool.read())
+        return RawDocument(stamp=1.0, snippets=['A new item.'], hash=spool.hash)
+    monkeypatch.setattr(refresh, 'download_meeting', lambda id: page)
+    monkeypatch.setattr(doc_cache, 'download_document_spooled', lambda path: spool(contents[path]))
+    monkeypatch.setattr(doc_cache, 'parse_document_spooled', parse_document_spooled)
+
+    refresh_meeting(db, 1)
+    # the stored rows are pointed at rather than extracted again
+    assert parsed == []
+    meeting = db.meetings.find_one({'_id': 1})
+    assert set(meeting['agendas'] + meeting['minutes']) == set(documents)
+    contents[second] = b'%PDF changed'
+    db.meetings.update_one({'_id': 1}, {'$set': {'hash': 'old'}})
+    assert refresh_meeting(db, 1) == 0
+    # only the changed document goes through the spooled path
+    assert parsed == [b'%PDF changed']
+
+def test_update_writes_changed_fields_and_records_old_values(db, make_meeting):
+    store_meeting(db, 1, make_meeting(documents=0))
+    moved = make_meeting(documents=0)
+    moved.meeting_address = 'Room 2'
+    assert update_meeting(db, 1, moved)
+    assert db.meetings.find_one({'_id': 1})['meeting_address'] == 'Room 2'
+    [change] = list(db.meetings_changes.find())
+    assert change['id'] == 1
+    assert change['meeting_address'] == 'Room 1'
+    assert 'contact_name' not in change
+    assert not update_meeting(db, 1, moved)
+    assert db.meetings_changes.count_documents({}) == 1
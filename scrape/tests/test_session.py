@@ -0,0 +1,44 @@
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread
+from constants import SOS_SERVER, TIKA_SERVER
+from session import build_session, HEADERS, SOS_MAX_CONNECTIONS, TIKA_MAX_CONNECTIONS, DEFAULT_MAX_CONNECTIONS
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+def test_each_host_gets_its_own_bounded_pool():
+    session = build_session()
+    for url, limit in [(f'{SOS_SERVER}/OpenMeetingsPublic', SOS_MAX_CONNECTIONS),
+                       (f'{TIKA_SERVER}/tika', TIKA_MAX_CONNECTIONS),
+                       ('https://example.com/', DEFAULT_MAX_CONNECTIONS)]:
+        adapter = session.get_adapter(url)
+        assert adapter._pool_maxsize == limit
+        assert adapter._pool_block
+    assert session.headers['Accept-Encoding'] == HEADERS['Accept-Encoding']
+
+def test_threads_share_kept_alive_connections():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}/'
+    session = build_session({url: 2})
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        statuses = list(executor.map(lambda _: session.get(url).status_code, range(32)))
+    pools = session.get_adapter(url).poolmanager.pools
+    connections = sum(pools[key].num_connections for key in pools.keys())
+    session.close()
+    server.shutdown()
+    server.server_close()
+    assert statuses == [200] * 32
+    # threads waited for one of the two pooled connections rather than opening their own
+    assert 1 <= connections <= 2
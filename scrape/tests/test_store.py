@@ -0,0 +1,114 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from resource_type import DocType
+from validate import Document
+from parse import RawDocument
+from store import store_meeting, store_meeting_with_pending, update_meeting, release_snippets, fill_pending_document, build_document, build_snippet
+
+def count_writes(monkeypatch) -> Counter:
+    from mongomock.collection import Collection
+    writes: Counter = Counter()
+    # mongomock carries out a bulk write with single writes, which are not counted again
+    depth: list[int] = [0]
+    for name in ['insert_one', 'insert_many', 'replace_one', 'update_one', 'bulk_write']:
+        def write(self, *args, name=name, write=getattr(Collection, name), **kwargs):
+            if depth[0] == 0:
+                writes[(self.name, name)] += 1
+            depth[0] += 1
+            try:
+                return write(self, *args, **kwargs)
+            finally:
+                depth[0] -= 1
+        monkeypatch.setattr(Collection, name, write)
+    return writes
+
+def test_a_meeting_is_written_in_one_call_per_collection(db, make_meeting, monkeypatch):
+    writes = count_writes(monkeypatch)
+    store_meeting(db, 1, make_meeting(documents=5, snippets=20))
+    assert writes == {('snippets', 'bulk_write'): 1, ('documents', 'bulk_write'): 1, ('meetings', 'replace_one'): 1}
+    assert db.documents.count_documents({}) == 5
+    assert db.snippets.count_documents({}) == 100
+    meeting = db.meetings.find_one({'_id': 1})
+    # the meeting points at its documents, and they at their snippets
+    assert sorted(meeting['agendas']) == sorted(row['_id'] for row in db.documents.find())
+    assert all(db.snippets.count_documents({'_id': {'$in': row['snippets']}}) == 20 for row in db.documents.find())
+
+def test_concurrent_stores_of_one_meeting_leave_one_copy(db, make_meeting):
+    meeting = make_meeting(documents=2, snippets=3)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda i: store_meeting(db, i % 4, meeting), range(32)))
+    assert db.meetings.count_documents({}) == 4
+    assert db.documents.count_documents({}) == 8
+    for row in db.meetings.find():
+        assert db.documents.count_documents({'_id': {'$in': row['agendas']}, 'meeting': row['_id']}) == 2
+
+def test_snippets_are_content_addressed():
+    notice = 'Open meetings notice: this meeting is accessible to people with disabilities.'
+    first, first_snippets = build_document(Document(0.0, 'Agenda', DocType.AGENDA, 0.0, None, 'a.pdf', [notice, 'Item 1.']))
+    second, second_snippets = build_document(Document(0.0, 'Agenda', DocType.AGENDA, 0.0, None, 'b.pdf', ['Item 1.', notice.replace(' ', '  ')]))
+    # the same text gets the same id in any document, whatever its spacing
+    assert first['snippets'] == second['snippets'][::-1]
+    assert [snippet['_id'] for snippet in first_snippets] == first['snippets']
+    assert second_snippets[1] == build_snippet(notice) == {'_id': first['snippets'][0], 'text': notice}
+    assert first['_id'] != second['_id']
+
+def test_storing_a_meeting_again_replaces_its_documents(db, make_meeting, monkeypatch):
+    store_meeting(db, 1, make_meeting(documents=2, snippets=3))
+    agendas = db.meetings.find_one({'_id': 1})['agendas']
+    writes = count_writes(monkeypatch)
+    store_meeting(db, 1, make_meeting(documents=2, snippets=3))
+    monkeypatch.undo()
+    # the replaces go out in one bulk write
+    assert writes[('documents', 'bulk_write')] == 1 and writes[('documents', 'replace_one')] == 0
+    # each path keeps its row and id rather than gaining a duplicate
+    assert db.meetings.find_one({'_id': 1})['agendas'] == agendas
+    assert sorted(row['_id'] for row in db.documents.find()) == sorted(agendas)
+    assert {row['meeting'] for row in db.documents.find()} == {1}
+    # the replaced rows' references are released
+    assert [snippet['refs'] for snippet in db.snippets.find()] == [1] * 6
+
+def test_a_document_without_a_path_is_not_duplicated(db, make_meeting):
+    meeting = make_meeting(documents=2, snippets=2)
+    meeting.agendas[0].path = None
+    store_meeting(db, 1, meeting)
+    store_meeting(db, 1, meeting)
+    # the first row of the pathless document is deleted, and its references released
+    agendas = db.meetings.find_one({'_id': 1})['agendas']
+    assert sorted(row['_id'] for row in db.documents.find()) == sorted(agendas)
+    assert [snippet['refs'] for snippet in db.snippets.find()] == [1] * 4
+
+def test_replace_then_release_drops_refs_to_zero(db, make_meeting):
+    store_meeting(db, 1, make_meeting(documents=1, snippets=2))
+    changed = make_meeting(documents=1, snippets=2)
+    changed.agendas[0].snippets = ['Item 0 of agenda 0.', 'A new item.']
+    update_meeting(db, 1, changed)
+    # the replaced row's references are released, and its snippet no longer referenced is deleted
+    assert {snippet['text']: snippet['refs'] for snippet in db.snippets.find()} == {'Item 0 of agenda 0.': 1, 'A new item.': 1}
+    [row] = list(db.documents.find())
+    assert release_snippets(db, row['snippets']) == 2
+    assert db.snippets.count_documents({}) == 0
+
+def test_pending_fill_counts_refs_once(db, make_meeting):
+    meeting = make_meeting(documents=1, snippets=0)
+    meeting.agendas[0].pending = True
+    [(id, path)] = store_meeting_with_pending(db, 1, meeting)
+    document = RawDocument(stamp=1.0, snippets=['Item 1.', 'Item 1.'], hash='abc')
+    assert fill_pending_document(db, id, document)
+    assert not fill_pending_document(db, id, document)
+    assert [snippet['refs'] for snippet in db.snippets.find()] == [2]
+
+def test_a_meeting_stored_concurrently_replaces_the_other_workers_rows(db, make_meeting, monkeypatch):
+    store_meeting(db, 1, make_meeting(documents=2, snippets=1))
+    agendas = db.meetings.find_one({'_id': 1})['agendas']
+    # as if another worker inserted the rows after this one looked for them
+    from mongomock.collection import Collection
+    find = Collection.find
+    calls: list[int] = []
+    def find_nothing_first(self, *args, **kwargs):
+        calls.append(1)
+        return iter([]) if len(calls) == 1 else find(self, *args, **kwargs)
+    monkeypatch.setattr(Collection, 'find', find_nothing_first)
+    store_meeting(db, 1, make_meeting(documents=2, snippets=1))
+    monkeypatch.undo()
+    assert db.meetings.find_one({'_id': 1})['agendas'] == agendas
+    assert db.documents.count_documents({}) == 2
@@ -0,0 +1,55 @@
+import asyncio
+from aiohttp import ClientSession, ClientTimeout
+from stand_in import StandInServer, TIKA_PARAGRAPHS
+from tika import TikaClient
+from parse import parse_tika_stream
+
+def test_requests_spread_and_fail_over():
+    with StandInServer() as first, StandInServer() as second:
+        stopped = StandInServer()
+        stopped.close()
+        client = TikaClient([first.url, second.url, stopped.url], health_interval=0)
+        # servers are not probed until asked
+        assert [server.healthy for server in client.servers] == [True, True, True]
+        client.probe()
+        assert [server.healthy for server in client.servers] == [True, True, False]
+        for _ in range(4):
+            assert b'<p>' in client.extract(b'%PDF').content
+        assert [server.requests for server in client.servers] == [2, 2, 0]
+
+        # a failing server is skipped after its first failure
+        second.tika_error_rate = 1.0
+        for _ in range(3):
+            assert b'<p>' in client.extract(b'%PDF').content
+        assert client.servers[1].failures == 1
+        assert not client.servers[1].healthy
+        assert client.servers[0].requests == 5
+
+def test_stream_replays_body_on_failover():
+    with StandInServer(tika_error_rate=1.0) as failing, StandInServer() as working:
+        client = TikaClient([failing.url, working.url], health_interval=0)
+        opened: list[int] = []
+
+        def open_body():
+            opened.append(1)
+            return iter([b'%PDF-1.4\n', b'x' * 100000])
+
+        snippets = parse_tika_stream(client.extract_stream(open_body))
+        client.close()
+    assert len(snippets) == TIKA_PARAGRAPHS
+    assert len(opened) == 2
+    assert failing.uploaded == working.uploaded == [100009]
+    assert [server.outstanding for server in client.servers] == [0, 0]
+
+def test_async_fails_over_from_a_hung_server():
+    async def extract(client: TikaClient) -> str:
+        async with ClientSession(timeout=ClientTimeout(total=0.5)) as session:
+            return await client.extract_async(session, b'%PDF')
+
+    with StandInServer(tika_latency=5.0) as hung, StandInServer() as working:
+        client = TikaClient([hung.url, working.url], health_interval=0)
+        assert '<p>' in asyncio.run(extract(client))
+        client.close()
+    assert client.servers[0].failures == 1
+    assert not client.servers[0].healthy
+    assert client.servers[1].requests == 1
@@ -0,0 +1,60 @@
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread, Lock
+from typesense_index import import_documents, index_batches, BatchResult
+
+class TypesenseStandIn(BaseHTTPRequestHandler):
+    """
+    Answers /documents/import like Typesense, rejecting documents without a body.
+    """
+    requests: list[tuple[str, list[dict]]] = []
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        documents = [json.loads(line) for line in self.rfile.read(length).decode().splitlines()]
+        TypesenseStandIn.requests.append((self.path, documents))
+        lines = [json.dumps({'success': True}) if 'body' in d else json.dumps({'success': False, 'error': 'Field `body` has been declared in the schema, but is not found in the document.'}) for d in documents]
+        body = '\n'.join(lines).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def start_stand_in() -> ThreadingHTTPServer:
+    TypesenseStandIn.requests = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), TypesenseStandIn)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def test_import_documents_reports_failures():
+    server = start_stand_in()
+    url = f'http://127.0.0.1:{server.server_address[1]}'
+    documents = [{'id': '1', 'body': 'a'}, {'id': '2'}, {'id': '3', 'body': 'c'}]
+    failures = import_documents(documents, server=url, api_key='xyz')
+    server.shutdown()
+    assert [id for id, _ in failures] == ['2']
+    path, sent = TypesenseStandIn.requests[0]
+    assert path == '/collections/meetings/documents/import?action=upsert'
+    assert sent == documents
+
+def test_index_batches_reports_every_batch():
+    server = start_stand_in()
+    url = f'http://127.0.0.1:{server.server_address[1]}'
+    def index_batch(ids: range) -> BatchResult:
+        documents = [{'id': str(id), 'body': 'b'} if id % 10 else {'id': str(id)} for id in ids]
+        failures = import_documents(documents, server=url, api_key='xyz')
+        return BatchResult(ids, len(documents) - len(failures), failures)
+    results: list[BatchResult] = []
+    lock = Lock()
+    def on_batch(result: BatchResult):
+        with lock:
+            results.append(result)
+    batches = [range(i, i + 25) for i in range(0, 100, 25)]
+    index_batches(batches, index_batch, on_batch, lambda batch, e: None, concurrency=2)
+    server.shutdown()
+    assert sorted(result.ids.start for result in results) == [0, 25, 50, 75]
+    assert sum(result.imported for result in results) == 90
+    assert sorted(id for result in results for id, _ in result.failures) == sorted(str(i) for i in range(0, 100, 10))